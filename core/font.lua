@@ -8,6 +8,24 @@ do
 
         local header = handle:read(6);
 
+        if header:sub(1, 2) == "FN" then
+            -- Bit-packed format: header and glyph bitmaps, kept in a string and rendered by pixmod.text
+            header = header .. handle:read(2)
+            local count = header:byte(6) * 256 + header:byte(5)
+            local width = header:byte(7)
+            local height = header:byte(8)
+            local glyphs = handle:read(count * math.floor((width * height + 7) / 8))
+            handle:close()
+
+            return setmetatable({
+                glyphs = glyphs,
+                first = header:byte(4),
+                count = count,
+                width = width,
+                height = height
+            }, mt)
+        end
+
         local count = header:byte(2) * 255 + header:byte(1)
         local width = header:byte(4) * 255 + header:byte(3)
         local height = header:byte(6) * 255 + header:byte(5)
@@ -26,6 +44,11 @@ do
 
 	function Font:print(screen, text, x, y, cr, cg, cb)
         if text == nil then return end
+        if self.glyphs then
+            local position, changed = pixmod.text(screen.buffer, screen.width, screen.height, self.glyphs, self.width, self.height, self.first, text, x, y, cr, cg, cb)
+            if changed then screen:invalidate() end
+            return position
+        end
         local offset = x
         for c in text:gmatch"." do
             self:char(screen, string.byte(c) + 1, offset, y, cr, cg, cb)
@@ -37,6 +60,11 @@ do
 	function Font:char(screen, index, x, y, cr, cg, cb)
 		local data = self.data
 
+        if self.glyphs then
+            self:print(screen, string.char(index - 1), x, y, cr, cg, cb)
+            return
+        end
+
         index = index - 32
 
         if index < 1 or index > self.count then return end
@@ -81,7 +109,8 @@ do
             local doffset = dst_offset + ((i + dst_top) * screen.width) + 1
             buffer:map(mapper, screen.buffer, doffset, doffset + line - 1, self.data, soffset)
             screen.buffer:replace(buffer, doffset)
-        end	
+        end
+        screen:invalidate()
 	end
 
     return Font
@@ -20,7 +20,10 @@ end
 --  return
 --end
 
-dofile("utilities.lua")
+if file.exists("utilities.lc") then dofile("utilities.lc") else dofile("utilities.lua") end
+
+local Transition = require("transition")
+local Scheduler = require("scheduler")
 
 local function pass(state, screen)
     return state
@@ -30,7 +33,12 @@ local screen = Screen.create(20, 20)
 local current = pass
 local current_name = ""
 local state = nil
-local timeout = node.random(framerate * 20, framerate * 60)
+
+-- During a transition the previous tile keeps running on its own screen and both are blended
+local transition_frames = framerate
+local previous = {tile = nil, state = nil, screen = Screen.create(20, 20)}
+local output = pixbuf.newBuffer(20 * 20, 3)
+local transition = nil
 
 ws2812.init()
 
@@ -130,20 +138,29 @@ local tiles = {}
 print(node.egc.meminfo())
 
 local l = file.list();
+local found = {}
 for k,v in pairs(l) do
-  if k:match("^tile_(.*).lua$") then
-    local name = string.sub(k, 1, -5)
+  -- Tiles can also be uploaded in compiled form
+  local name = k:match("^(tile_.*)%.lua$") or k:match("^(tile_.*)%.lc$")
+  if name and not found[name] then
+    found[name] = true
     require(name);
     package.loaded[name] = nil;
-    tiles[#tiles+1] = {name=name};
+    tiles[#tiles+1] = name;
   end
 end 
 
+-- Weights, durations and assets of tiles compiled from their tile.json files by manage.py
+local playlist = nil
+if file.exists("playlist.lc") then playlist = dofile("playlist.lc") elseif file.exists("playlist.lua") then playlist = dofile("playlist.lua") end
+
+local scheduler = Scheduler.create(tiles, playlist, framerate)
+
 print(node.egc.meminfo())
 
 function list_tiles()
-  for k,v in pairs(tiles) do
-    print("Tile " .. v.name .. " = " .. k)
+  for k,v in pairs(scheduler.entries) do
+    print("Tile " .. v.name .. " = " .. k .. " (weight " .. v.weight .. ", " .. (v.duration or "random") .. " frames)")
   end
 end
 
@@ -157,52 +174,72 @@ print(node.egc.meminfo())
 
 local loop = nil
 
-function list_tiles()
-  for k,v in pairs(tiles) do
-    print("Tile " .. v.name .. " = " .. k)
-  end
-end
-
 function run(i) 
   if loop ~= nil then
     loop:unregister()
   end
 
-  if i == nil then
-    if table.getn(tiles) > 0 then
-      i = node.random(1, table.getn(tiles))
-    else 
-      i = 0
-    end
+  transition = nil
+  previous.tile = nil
+  previous.state = nil
+
+  -- The next tile was chosen and prefetched while the current one was running
+  local entry, tile = nil, nil
+  if i == nil or i > 0 then
+    entry, tile = scheduler:start(i)
   end
 
-  if i < 1 then
+  if entry == nil then
     current = pass
     state = nil
     return
   else
-    package.loaded[current_name] = nil
-    current_name = tiles[i].name
-    current = require(current_name);
+    if current ~= pass then
+      previous.tile = current
+      previous.state = state
+      screen, previous.screen = previous.screen, screen
+      screen:clear()
+      transition = Transition.create(previous.screen, screen, output, transition_frames)
+    end
+    current_name = entry.name
+    current = tile
     state = nil;
-    timeout = node.random(framerate * 20, framerate * 60)
   end
 
   loop = tmr.create()
   loop:alarm(1000 / framerate, tmr.ALARM_AUTO, function()
-    state = current(state, screen)
-    ws2812.write(screen.buffer)
+    local ok
+    ok, state = pcall(current, state, screen)
     if not ok then 
       print(current_name, state)
       state = nil
       run(0)
       return
     end
-    timeout = timeout - 1
-    if timeout < 1 then
-      state = nil
+    if transition ~= nil then
+      -- The previous tile stops at its last frame when it finishes or fails
+      if previous.state ~= nil then
+        ok, previous.state = pcall(previous.tile, previous.state, previous.screen)
+        if not ok then
+          previous.state = nil
+        end
+      end
+      local blended = transition:step()
+      if blended ~= nil then
+        ws2812.write(blended)
+      else
+        transition = nil
+        previous.tile = nil
+        previous.state = nil
+        screen:invalidate()
+      end
+    end
+    -- Unchanged frames are not written again, the LEDs keep their colors
+    if transition == nil and screen:flush() then
+      ws2812.write(screen.buffer)
     end
-    if state == nil then
+    -- A tile that times out keeps running during the transition to the next one
+    if scheduler:tick() or state == nil then
         run()
     end
   end)
@@ -0,0 +1,157 @@
+do
+  Scheduler = {}
+  local mt = { __index = Scheduler }
+
+  -- Number of seconds before the end of a tile in which the next one is prefetched
+  local LEAD = 3
+  -- Bytes of encoded sprite frames read from flash in one prefetch step and kept for the next tile
+  local BLOCK = 512
+  local LIMIT = 4096
+  -- Free heap left to the running tile, below it the next tile loads whatever is missing itself
+  local RESERVE = 16384
+
+  -- Creates a scheduler for the tiles found on the device. Entries of the compiled playlist (see
+  -- "manage.py playlist") give the weight, duration in frames and sprite sheets of a tile, tiles
+  -- missing from it are shown with weight 1 and a random duration.
+  function Scheduler.create(names, playlist, framerate)
+    local known = {}
+    for _, entry in ipairs(playlist or {}) do
+      known[entry.name] = entry
+    end
+
+    local entries = {}
+    for _, name in ipairs(names) do
+      entries[#entries + 1] = known[name] or { name = name, weight = 1, assets = {} }
+    end
+
+    -- Sprite sheets opened ahead of time, Sprites.open hands them out by file name
+    ASSETS = {}
+
+    return setmetatable({
+      entries = entries,
+      framerate = framerate,
+      lead = LEAD * framerate,
+      remaining = 0,
+      current = nil,
+      job = nil
+    }, mt)
+  end
+
+  -- Picks an entry at random according to weights, the current tile is not repeated if there are others
+  function Scheduler:pick()
+    local total, choices = 0, 0
+    for _, entry in ipairs(self.entries) do
+      if entry.weight > 0 then choices = choices + 1 end
+    end
+    for _, entry in ipairs(self.entries) do
+      if entry ~= self.current or choices < 2 then total = total + entry.weight end
+    end
+    if total < 1 then
+      return nil
+    end
+    local r = node.random(1, total)
+    for _, entry in ipairs(self.entries) do
+      if entry ~= self.current or choices < 2 then
+        r = r - entry.weight
+        if r < 1 then return entry end
+      end
+    end
+  end
+
+  -- Performs one prefetch step: loads the module, opens a sprite sheet or reads a block of its frames.
+  -- Returns false when there is nothing left to do.
+  function Scheduler:step()
+    local job = self.job
+    if job == nil or job.done or node.heap() < RESERVE then
+      return false
+    end
+
+    if job.module == nil then
+      package.loaded[job.entry.name] = nil
+      job.module = require(job.entry.name)
+      package.loaded[job.entry.name] = nil
+      return true
+    end
+
+    local sheet = job.sheet
+    if sheet == nil then
+      job.asset = job.asset + 1
+      local name = job.entry.assets[job.asset]
+      if name == nil then
+        job.done = true
+        return false
+      end
+      sheet = load_sprites().open(name)
+      job.sheets[name] = sheet
+      -- Frames of indexed sheets are read one at a time, raw sheets are only opened
+      if sheet.palette ~= nil and job.bytes < LIMIT then
+        sheet.cache = {}
+        job.sheet, job.frame = sheet, 0
+      end
+      return true
+    end
+
+    local budget = BLOCK
+    while budget > 0 and job.frame < sheet.count and job.bytes < LIMIT and node.heap() >= RESERVE do
+      job.frame = job.frame + 1
+      local frame = sheet:frame(job.frame)
+      sheet.cache[job.frame] = frame
+      budget = budget - #frame
+      job.bytes = job.bytes + #frame
+    end
+    if job.frame >= sheet.count or job.bytes >= LIMIT then
+      job.sheet = nil
+    end
+    return true
+  end
+
+  -- Starts the given entry or the one chosen in advance, returns it together with the main function of
+  -- the tile or nil if there is nothing to show. The next tile is chosen right away, its prefetch starts
+  -- when the current one is about to end.
+  function Scheduler:start(index)
+    local job = self.job
+    if index ~= nil or job == nil then
+      if job ~= nil then
+        for _, sheet in pairs(job.sheets) do
+          sheet.data:close()
+        end
+      end
+      local entry = index ~= nil and self.entries[index] or self:pick()
+      if entry == nil then
+        return nil
+      end
+      job = { entry = entry, asset = 0, bytes = 0, sheets = {} }
+    end
+
+    -- Whatever was not prefetched yet is loaded by the tile itself
+    local module = job.module or require(job.entry.name)
+    package.loaded[job.entry.name] = nil
+
+    -- Sheets prefetched for the previous tile that it never opened are released
+    for _, sheet in pairs(ASSETS) do
+      sheet.data:close()
+    end
+    ASSETS = job.sheets
+
+    self.current = job.entry
+    self.remaining = job.entry.duration or node.random(self.framerate * 20, self.framerate * 60)
+
+    local upcoming = self:pick()
+    self.job = upcoming and { entry = upcoming, asset = 0, bytes = 0, sheets = {} }
+
+    return job.entry, module
+  end
+
+  -- Advances the schedule by one frame and prefetches the next tile near the end of the current one,
+  -- returns true when the current tile should be replaced
+  function Scheduler:tick()
+    self.remaining = self.remaining - 1
+    -- A failed prefetch is left to the tile, which loads whatever is missing itself
+    if self.remaining <= self.lead and self.job ~= nil and not pcall(self.step, self) then
+      self.job.done = true
+    end
+    return self.remaining < 1
+  end
+
+  return Scheduler
+end
@@ -3,11 +3,48 @@ do
 	Sprites = {}
 	local mt = { __index = Sprites }
 
+    local function word(data, i)
+        return data:byte(i + 1) * 256 + data:byte(i)
+    end
+
+    local function dword(data, i)
+        return word(data, i + 2) * 65536 + word(data, i)
+    end
+
 	function Sprites.open(filename)
+        -- Sheets prefetched by the scheduler are handed out once, with their first frames already read
+        local sheet = ASSETS ~= nil and ASSETS[filename]
+        if sheet then
+            ASSETS[filename] = nil
+            return sheet
+        end
+
         local handle = file.open(filename, "r")
 
         local data = handle:read(6);
 
+        if data:sub(1, 2) == "PX" then
+            -- Indexed format: header, palette, frame offsets and run-length encoded frames
+            local channels = data:byte(4)
+            data = data .. handle:read(6)
+            local count = word(data, 5)
+            local colors = word(data, 11)
+            local palette = handle:read(colors * channels)
+            local offsets = handle:read((count + 1) * 4)
+
+            return setmetatable({
+                data = handle,
+                count = count,
+                width = word(data, 7),
+                height = word(data, 9),
+                version = data:byte(3),
+                channels = channels,
+                palette = palette,
+                offsets = offsets,
+                start = 12 + colors * channels + (count + 1) * 4
+            }, mt)
+        end
+
         local count = data:byte(2) * 255 + data:byte(1)
         local width = data:byte(4) * 255 + data:byte(3)
         local height = data:byte(6) * 255 + data:byte(5)
@@ -20,6 +57,41 @@ do
 		}, mt)
 	end
 
+    -- Reads encoded content of a frame from an indexed sprite sheet
+    function Sprites:frame(index)
+        if self.cache ~= nil and self.cache[index] ~= nil then
+            return self.cache[index]
+        end
+        local first = dword(self.offsets, (index - 1) * 4 + 1)
+        local last = dword(self.offsets, index * 4 + 1)
+        self.data:seek("set", self.start + first)
+        return self.data:read(last - first)
+    end
+
+    local function is_keyframe(self, frame)
+        return self.version < 3 or frame:byte(1) == 0
+    end
+
+    local function keyframe(self, frame)
+        if self.version < 3 then return frame end
+        return frame:sub(2)
+    end
+
+    -- Applies changed rectangles of a delta frame to a buffer at the given position, returns true if any
+    -- pixel of the buffer changed
+    function Sprites:patch(frame, buffer, width, height, x, y)
+        local position = 3
+        local changed = false
+        for i = 1, frame:byte(2) do
+            local length = word(frame, position + 8)
+            local _, c = pixmod.decode_rect(buffer, width, height, x + word(frame, position), y + word(frame, position + 2),
+                word(frame, position + 4), word(frame, position + 6), frame:sub(position + 10, position + 9 + length), self.palette)
+            changed = changed or c
+            position = position + 10 + length
+        end
+        return changed
+    end
+
     function Sprites:load(position, count)
 		local source = self.data
 
@@ -29,6 +101,27 @@ do
 
         if type(source) == "Buffer" then
             data = source:sub(offset + 1, offset + length)
+        elseif self.palette ~= nil then
+            local size = self.width * self.height
+            local rows = self.height * count
+            -- Delta frames are reconstructed starting with the preceding keyframe
+            local first = position
+            while first > 1 and not is_keyframe(self, self:frame(first)) do
+                first = first - 1
+            end
+            data = pixbuf.newBuffer(size * count, self.channels)
+            for i = first, position + count - 1 do
+                local frame = self:frame(i)
+                local slot = math.max(i - position, 0)
+                if is_keyframe(self, frame) then
+                    pixmod.decode(data, slot * size + 1, keyframe(self, frame), self.palette)
+                else
+                    if slot > 0 then
+                        pixmod.blit(data, self.width, rows, data, self.width, rows, 1, 1 + (slot - 1) * self.height, self.width, self.height, 1, 1 + slot * self.height)
+                    end
+                    self:patch(frame, data, self.width, rows, 1, 1 + slot * self.height)
+                end
+            end
         else
             source:seek("set", offset + 6)
             data = pixbuf.newBuffer(self.width*self.height*count, 3)
@@ -58,6 +151,31 @@ do
 
 	end
 
+    -- Displays frames of an animation, if the previous frame was displayed at the same position
+    -- only changes are drawn, so the screen area of the sprite should not be modified in between
+    function Sprites:play(screen, index, x, y)
+        if index < 1 or index > self.count then
+            return
+        end
+
+        if type(self.data) == "Buffer" or self.version < 3 or self.last ~= index - 1 or self.x ~= x or self.y ~= y then
+            self:display(screen, index, x, y)
+        else
+            local frame = self:frame(index)
+            local changed
+            if is_keyframe(self, frame) then
+                changed = select(2, pixmod.decode_rect(screen.buffer, screen.width, screen.height, x, y, self.width, self.height, keyframe(self, frame), self.palette))
+            else
+                changed = self:patch(frame, screen.buffer, screen.width, screen.height, x, y)
+            end
+            if changed then screen:invalidate() end
+        end
+
+        self.last = index
+        self.x = x
+        self.y = y
+    end
+
     return Sprites
 end
 
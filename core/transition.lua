@@ -0,0 +1,48 @@
+do
+  Transition = {}
+  local mt = { __index = Transition }
+
+  -- Effects blend the screens of two tiles into the output buffer, progress goes from 0 to 256
+  local effects = {
+    crossfade = function(self, progress)
+      pixmod.crossfade(self.output, self.from.buffer, self.to.buffer, progress)
+    end,
+    wipe = function(self, progress)
+      local size = self.direction < 2 and self.to.width or self.to.height
+      pixmod.wipe(self.output, self.from.buffer, self.to.buffer, self.to.width, self.to.height,
+        math.floor(size * progress / 256), self.direction)
+    end,
+    dissolve = function(self, progress)
+      pixmod.dissolve(self.output, self.from.buffer, self.to.buffer, progress, self.seed)
+    end
+  }
+
+  Transition.effects = { "crossfade", "wipe", "dissolve" }
+
+  -- Creates a transition from one screen to another that lasts the given number of frames, both screens
+  -- keep being drawn while it runs. The output buffer is reused between transitions.
+  function Transition.create(from, to, output, frames, effect)
+    return setmetatable({
+      from = from,
+      to = to,
+      output = output,
+      frames = frames,
+      frame = 0,
+      effect = effect or Transition.effects[node.random(1, #Transition.effects)],
+      direction = node.random(0, 3),
+      seed = node.random(0, 65535)
+    }, mt)
+  end
+
+  -- Blends the next frame, returns the output buffer or nil when the transition is over
+  function Transition:step()
+    if self.frame >= self.frames then
+      return nil
+    end
+    self.frame = self.frame + 1
+    effects[self.effect](self, math.floor(self.frame * 256 / self.frames))
+    return self.output
+  end
+
+  return Transition
+end
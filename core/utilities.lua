@@ -3,29 +3,43 @@ do
 	Screen = {}
 	local mt = { __index = Screen }
 
+    -- The dirty flag is set when pixmod operations report that they changed the buffer, code that writes
+    -- to screen.buffer directly has to call Screen:invalidate(). Unchanged frames are not written to LEDs.
 	function Screen.create(width, height)
         local buffer = pixbuf.newBuffer(width * height, 3)
         buffer:fill(0, 0, 0)
 		return setmetatable({
 			  width = width,
         height = height,
-        buffer = buffer
+        buffer = buffer,
+        dirty = true
 		}, mt)
 	end
 
+    function Screen:invalidate()
+        self.dirty = true
+    end
+
+    -- Returns true if the buffer changed since the previous call
+    function Screen:flush()
+        local dirty = self.dirty
+        self.dirty = false
+        return dirty
+    end
+
 	function Screen:set(x, y, r, g, b)
 		local buffer = self.buffer
-        pixmod.set(buffer, self.width, self.height, x, y, r, g, b)
+        if pixmod.set(buffer, self.width, self.height, x, y, r, g, b) then self.dirty = true end
 	end
 
     function Screen:line(x1, y1, x2, y2, r, g, b)
         local buffer = self.buffer
-        pixmod.line(buffer, self.width, self.height, x1, y1, x2, y2, r, g, b)
+        if pixmod.line(buffer, self.width, self.height, x1, y1, x2, y2, r, g, b) then self.dirty = true end
     end
 
     function Screen:fill(x, y, w, h, r, g, b)
         local buffer = self.buffer
-        pixmod.fill(buffer, self.width, self.height, x, y, w, h, r, g, b)
+        if pixmod.fill(buffer, self.width, self.height, x, y, w, h, r, g, b) then self.dirty = true end
     end
 
     function Screen:clear()
@@ -34,22 +48,22 @@ do
 
     function Screen:add(v)
         local buffer = self.buffer
-        pixmod.add(buffer, self.width, self.height, v)
+        if pixmod.add(buffer, self.width, self.height, v) then self.dirty = true end
     end
 
     function Screen:blit(src, src_w, src_h, x, y, w, h, dx, dy)
         local screen = self.buffer
-        pixmod.blit(src, src_w, src_h, screen, self.width, self.height, x, y, w, h, dx, dy)
+        if pixmod.blit(src, src_w, src_h, screen, self.width, self.height, x, y, w, h, dx, dy) then self.dirty = true end
     end
 
     function Screen:slide(dx, dy)
         local screen = self.buffer
-        pixmod.blit(screen, self.width, self.height, screen, self.width, self.height, 1, 1, self.width, self.height, dx+1, dy+1)
+        if pixmod.blit(screen, self.width, self.height, screen, self.width, self.height, 1, 1, self.width, self.height, dx+1, dy+1) then self.dirty = true end
     end
 
     function Screen:blit_color(src, src_w, src_h, x, y, w, h, dx, dy, r, g, b)
         local screen = self.buffer
-        pixmod.blit_color(src, src_w, src_h, screen, self.width, self.height, x, y, w, h, dx, dy, r, g, b)
+        if pixmod.blit_color(src, src_w, src_h, screen, self.width, self.height, x, y, w, h, dx, dy, r, g, b) then self.dirty = true end
     end
 end
 
@@ -165,33 +165,44 @@ static uint32_t _pixmod_get(pixelbuffer_t *pixbuf, int x, int y)
   return 0;
 }
 
-static inline void _pixmod_set(pixelbuffer_t *pixbuf, int x, int y, uint32_t color)
+static inline int _pixmod_set(pixelbuffer_t *pixbuf, int x, int y, uint32_t color)
 {
+  // Returns 1 if the pixel changed, so that callers can tell if a buffer has to be displayed again
   if (x < 0 || x >= pixbuf->width || y < 0 || y >= pixbuf->height)
-    return;
+    return 0;
   uint8_t *p = pixbuf->data + y * pixbuf->stride + x * pixbuf->bpp;
   switch (pixbuf->bpp)
   {
   case 1:
+    if (*p == (uint8_t) color)
+      return 0;
     *p = color;
-    break;
+    return 1;
   case 2:
+    if (*(uint16_t *)p == (uint16_t) color)
+      return 0;
     *(uint16_t *)p = color;
-    break;
+    return 1;
   case 3:
+    if (p[0] == (color & 0xFF) && p[1] == ((color >> 8) & 0xFF) && p[2] == ((color >> 16) & 0xFF))
+      return 0;
     p[0] = color & 0xFF;
     p[1] = (color >> 8) & 0xFF;
     p[2] = (color >> 16) & 0xFF;
-    break;
+    return 1;
   case 4:
+    if (*(uint32_t *)p == color)
+      return 0;
     *(uint32_t *)p = color;
-    break;
+    return 1;
   }
+  return 0;
 }
 
-static inline void _pixmod_line(pixelbuffer_t *pixbuf, int x0, int y0, int x1, int y1, uint32_t color)
+static inline int _pixmod_line(pixelbuffer_t *pixbuf, int x0, int y0, int x1, int y1, uint32_t color)
 {
   // Draw line using Bresenham's algorithm
+  int changed = 0;
   int dx = abs(x1 - x0);
   int dy = abs(y1 - y0);
   int sx = x0 < x1 ? 1 : -1;
@@ -201,7 +212,7 @@ static inline void _pixmod_line(pixelbuffer_t *pixbuf, int x0, int y0, int x1, i
 
   for (;;)
   {
-    _pixmod_set(pixbuf, x0, y0, color);
+    changed |= _pixmod_set(pixbuf, x0, y0, color);
     if (x0 == x1 && y0 == y1)
       break;
     e2 = 2 * err;
@@ -216,10 +227,13 @@ static inline void _pixmod_line(pixelbuffer_t *pixbuf, int x0, int y0, int x1, i
       y0 += sy;
     }
   }
+
+  return changed;
 }
 
-static void _pixmod_add(pixelbuffer_t *pixbuf, int value)
+static int _pixmod_add(pixelbuffer_t *pixbuf, int value)
 {
+  int changed = 0;
   for (int y = 0; y < pixbuf->height; y++)
   {
     for (int x = 0; x < pixbuf->width; x++)
@@ -231,27 +245,31 @@ static void _pixmod_add(pixelbuffer_t *pixbuf, int value)
       r = r + value;
       g = g + value;
       b = b + value;
-      _pixmod_set(pixbuf, x, y, _color_pack(r, g, b));
+      changed |= _pixmod_set(pixbuf, x, y, _color_pack(r, g, b));
     }
   }
+  return changed;
 }
 
-static void _pixmod_fill(pixelbuffer_t *pixbuf, int x, int y, int width, int height, uint32_t color)
+static int _pixmod_fill(pixelbuffer_t *pixbuf, int x, int y, int width, int height, uint32_t color)
 {
+  int changed = 0;
   for (int i = 0; i < height; i++)
   {
     for (int j = 0; j < width; j++)
     {
-      _pixmod_set(pixbuf, x + j, y + i, color);
+      changed |= _pixmod_set(pixbuf, x + j, y + i, color);
     }
   }
+  return changed;
 }
 
-static void _pixmod_copy(pixelbuffer_t *src, pixelbuffer_t *dst)
+static int _pixmod_copy(pixelbuffer_t *src, pixelbuffer_t *dst)
 {
+  int changed = 0;
 
   if (src->width != dst->width || src->height != dst->height)
-    return;
+    return 0;
 
   // Determine if the buffers overlap, overlap direction and copy direction
   uint8_t *src_start = src->data;
@@ -267,7 +285,7 @@ static void _pixmod_copy(pixelbuffer_t *src, pixelbuffer_t *dst)
       for (int j = src->width - 1; j >= 0; j--)
       {
         uint32_t color = _pixmod_get(src, j, i);
-        _pixmod_set(dst, j, i, color);
+        changed |= _pixmod_set(dst, j, i, color);
       }
     }
   } else {
@@ -276,13 +294,15 @@ static void _pixmod_copy(pixelbuffer_t *src, pixelbuffer_t *dst)
       for (int j = 0; j < src->width; j++)
       {
         uint32_t color = _pixmod_get(src, j, i);
-        _pixmod_set(dst, j, i, color);
+        changed |= _pixmod_set(dst, j, i, color);
       }
     }
   }
+
+  return changed;
 }
 
-static void _pixmod_blit(pixelbuffer_t *src, pixelbuffer_t *dst, int x, int y, int w, int h, int dx, int dy)
+static int _pixmod_blit(pixelbuffer_t *src, pixelbuffer_t *dst, int x, int y, int w, int h, int dx, int dy)
 {
   // x, y, w, h are the region of the mask to be blitted
   // dx, dy are the coordinates of the destination
@@ -304,17 +324,17 @@ static void _pixmod_blit(pixelbuffer_t *src, pixelbuffer_t *dst, int x, int y, i
   rect_t clip = rect_intersection(&src_clip2, &dst_clip2);
 
   if (clip.w <= 0 || clip.h <= 0)
-    return;
+    return 0;
 
   // Cut source buffer
   pixelbuffer_t src_cut = cut_buffer(src, x + clip.x, y + clip.y, clip.w, clip.h);
   // Cut destination buffer
   pixelbuffer_t dst_cut = cut_buffer(dst, dst_clip.x, dst_clip.y, clip.w, clip.h);
 
-  _pixmod_copy(&src_cut, &dst_cut);
+  return _pixmod_copy(&src_cut, &dst_cut);
 }
 
-static void _pixmod_blit_color(pixelbuffer_t *mask, pixelbuffer_t *dst, int x, int y, int w, int h, int dx, int dy, uint32_t color)
+static int _pixmod_blit_color(pixelbuffer_t *mask, pixelbuffer_t *dst, int x, int y, int w, int h, int dx, int dy, uint32_t color)
 {
   // x, y, w, h are the region of the mask to be blitted
   // dx, dy are the coordinates of the destination
@@ -336,7 +356,7 @@ static void _pixmod_blit_color(pixelbuffer_t *mask, pixelbuffer_t *dst, int x, i
   rect_t clip = rect_intersection(&src_clip2, &dst_clip2);
 
   if (clip.w <= 0 || clip.h <= 0)
-    return;
+    return 0;
 
   // Cut source buffer
   pixelbuffer_t mask_cut = cut_buffer(mask, x + clip.x, y + clip.y, clip.w, clip.h);
@@ -344,6 +364,8 @@ static void _pixmod_blit_color(pixelbuffer_t *mask, pixelbuffer_t *dst, int x, i
   // Cut destination buffer
   pixelbuffer_t dst_cut = cut_buffer(dst, dst_clip.x, dst_clip.y, clip.w, clip.h);
 
+  int changed = 0;
+
   for (int i = 0; i < mask_cut.height; i++)
   {
     for (int j = 0; j < mask_cut.width; j++)
@@ -351,18 +373,19 @@ static void _pixmod_blit_color(pixelbuffer_t *mask, pixelbuffer_t *dst, int x, i
       uint32_t mask_color = _pixmod_get(&mask_cut, j, i);
       if (mask_color != 0)
       {
-        _pixmod_set(&dst_cut, j, i, color);
-      } else {
-        }
+        changed |= _pixmod_set(&dst_cut, j, i, color);
+      }
     }
   }
+
+  return changed;
 }
 
-static void _pixmod_blit_mask(pixelbuffer_t *src, pixelbuffer_t *dst, pixelbuffer_t *mask, int x, int y, int w, int h, int dx, int dy)
+static int _pixmod_blit_mask(pixelbuffer_t *src, pixelbuffer_t *dst, pixelbuffer_t *mask, int x, int y, int w, int h, int dx, int dy)
 {
   // source and mask must have the same dimensions
   if (src->width != mask->width || src->height != mask->height)
-    return;
+    return 0;
 
   // x, y, w, h are the region of the mask to be blitted
   // dx, dy are the coordinates of the destination
@@ -384,7 +407,7 @@ static void _pixmod_blit_mask(pixelbuffer_t *src, pixelbuffer_t *dst, pixelbuffe
   rect_t clip = rect_intersection(&src_clip2, &dst_clip2);
 
   if (clip.w <= 0 || clip.h <= 0)
-    return;
+    return 0;
 
   // Cut source buffer
   pixelbuffer_t src_cut = cut_buffer(src, x + clip.x, y + clip.y, clip.w, clip.h);
@@ -393,6 +416,8 @@ static void _pixmod_blit_mask(pixelbuffer_t *src, pixelbuffer_t *dst, pixelbuffe
   // Cut mask buffer
   pixelbuffer_t mask_cut = cut_buffer(mask, x + clip.x, y + clip.y, clip.w, clip.h);
 
+  int changed = 0;
+
   for (int i = 0; i < mask_cut.height; i++)
   {
     for (int j = 0; j < mask_cut.width; j++)
@@ -401,10 +426,276 @@ static void _pixmod_blit_mask(pixelbuffer_t *src, pixelbuffer_t *dst, pixelbuffe
       if (mask_color != 0)
       {
         uint32_t color = _pixmod_get(&src_cut, j, i);
-        _pixmod_set(&dst_cut, j, i, color);
+        changed |= _pixmod_set(&dst_cut, j, i, color);
+      }
+    }
+  }
+
+  return changed;
+}
+
+static int _pixmod_life(pixelbuffer_t *world, pixelbuffer_t *scratch, int birth, int survive, int *changed)
+{
+  // Computes one generation of a cellular automaton, cells outside of the world are dead
+  // birth and survive are bit masks, bit n is set if a cell with n living neighbours is born or survives
+  // Returns the number of living cells, changed is set if any cell of the world changed
+
+  *changed = 0;
+
+  if (world->width != scratch->width || world->height != scratch->height)
+    return 0;
+
+  int alive = 0;
+
+  for (int y = 0; y < world->height; y++)
+  {
+    for (int x = 0; x < world->width; x++)
+    {
+      int neighbours = 0;
+      for (int i = -1; i <= 1; i++)
+      {
+        for (int j = -1; j <= 1; j++)
+        {
+          if ((i != 0 || j != 0) && _pixmod_get(world, x + j, y + i) != 0)
+            neighbours++;
+        }
+      }
+      int rule = (_pixmod_get(world, x, y) != 0) ? survive : birth;
+      int state = (rule >> neighbours) & 1;
+      _pixmod_set(scratch, x, y, state);
+      alive += state;
+    }
+  }
+
+  *changed = _pixmod_copy(scratch, world);
+
+  return alive;
+}
+
+typedef struct decoder
+{
+  const uint8_t *data;
+  size_t length;
+  size_t position;
+  int size;
+  int count;
+  int repeat;
+} decoder_t;
+
+static decoder_t decoder(const uint8_t *data, size_t length, int colors)
+{
+  // Run-length encoded palette indices: a control byte c < 128 is followed by c + 1 literal indices,
+  // c >= 128 by an index repeated c - 126 times. Indices take two bytes (little endian) if the palette
+  // has more than 256 colors.
+  decoder_t d;
+  d.data = data;
+  d.length = length;
+  d.position = 0;
+  d.size = (colors > 256) ? 2 : 1;
+  d.count = 0;
+  d.repeat = 0;
+  return d;
+}
+
+static int _decoder_next(decoder_t *d)
+{
+  // Returns the next index or -1 at the end of data
+  if (d->count == 0)
+  {
+    if (d->position >= d->length)
+      return -1;
+    uint8_t control = d->data[d->position++];
+    d->repeat = control >= 128;
+    d->count = d->repeat ? control - 126 : control + 1;
+  }
+
+  if (d->position + d->size > d->length)
+    return -1;
+
+  int index = (d->size == 2) ? (d->data[d->position] | (d->data[d->position + 1] << 8)) : d->data[d->position];
+
+  d->count--;
+  if (!d->repeat || d->count == 0)
+    d->position += d->size;
+
+  return index;
+}
+
+static int _pixmod_decode(uint8_t *dst, int npix, int bpp, const uint8_t *data, size_t length, const uint8_t *palette, int colors, int *changed)
+{
+  // Decodes palette indices to consecutive pixels, returns the number of decoded pixels
+  decoder_t d = decoder(data, length, colors);
+  int pixel = 0;
+  int index;
+
+  *changed = 0;
+
+  while (pixel < npix && (index = _decoder_next(&d)) >= 0)
+  {
+    if (index < colors && memcmp(dst + pixel * bpp, palette + index * bpp, bpp) != 0)
+    {
+      memcpy(dst + pixel * bpp, palette + index * bpp, bpp);
+      *changed = 1;
+    }
+    pixel++;
+  }
+
+  return pixel;
+}
+
+static int _pixmod_decode_rect(pixelbuffer_t *dst, int x, int y, int w, int h, const uint8_t *data, size_t length, const uint8_t *palette, int colors, int *changed)
+{
+  // Decodes palette indices to a rectangle of the buffer, pixels outside of the buffer are skipped
+  decoder_t d = decoder(data, length, colors);
+  int pixel = 0;
+  int index;
+
+  *changed = 0;
+
+  if (w <= 0 || h <= 0)
+    return 0;
+
+  while (pixel < w * h && (index = _decoder_next(&d)) >= 0)
+  {
+    int px = x + pixel % w;
+    int py = y + pixel / w;
+    if (index < colors && px >= 0 && px < dst->width && py >= 0 && py < dst->height)
+    {
+      uint8_t *p = dst->data + py * dst->stride + px * dst->bpp;
+      if (memcmp(p, palette + index * dst->bpp, dst->bpp) != 0)
+      {
+        memcpy(p, palette + index * dst->bpp, dst->bpp);
+        *changed = 1;
+      }
+    }
+    pixel++;
+  }
+
+  return pixel;
+}
+
+static int _pixmod_text(pixelbuffer_t *dst, const uint8_t *glyphs, int count, int gw, int gh, int first, const uint8_t *text, size_t length, int x, int y, int spacing, uint32_t color, int *changed)
+{
+  // Glyphs are stored as bit-packed bitmaps, each one gw x gh bits in row-major order, most significant bit
+  // first and padded to a whole byte. Characters outside of the glyph table are left empty.
+  int stride = (gw * gh + 7) / 8;
+
+  *changed = 0;
+
+  if (gw <= 0 || gh <= 0 || y >= dst->height || y + gh <= 0)
+    return x + (int) length * (gw + spacing);
+
+  for (size_t i = 0; i < length; i++, x += gw + spacing)
+  {
+    int index = text[i] - first;
+
+    if (x >= dst->width)
+      return x + (int) (length - i) * (gw + spacing);
+
+    if (index < 0 || index >= count || x + gw <= 0)
+      continue;
+
+    const uint8_t *glyph = glyphs + index * stride;
+
+    for (int py = max(0, -y); py < min(gh, dst->height - y); py++)
+    {
+      for (int px = max(0, -x); px < min(gw, dst->width - x); px++)
+      {
+        int bit = py * gw + px;
+        if (glyph[bit >> 3] & (0x80 >> (bit & 7)))
+          *changed |= _pixmod_set(dst, x + px, y + py, color);
+      }
+    }
+  }
+
+  return x;
+}
+
+static int _pixmod_crossfade(uint8_t *dst, const uint8_t *a, const uint8_t *b, int length, int alpha)
+{
+  // Blends two buffers byte by byte, alpha is the weight of the second one from 0 to 256. The destination
+  // can be one of the sources.
+  int changed = 0;
+
+  alpha = (alpha < 0) ? 0 : ((alpha > 256) ? 256 : alpha);
+
+  for (int i = 0; i < length; i++)
+  {
+    uint8_t value = (a[i] * (256 - alpha) + b[i] * alpha) >> 8;
+    if (dst[i] != value)
+    {
+      dst[i] = value;
+      changed = 1;
+    }
+  }
+
+  return changed;
+}
+
+static int _pixmod_select(uint8_t *dst, const uint8_t *a, const uint8_t *b, int pixel, int bpp, int second)
+{
+  // Copies a pixel from one of the sources, returns 1 if the destination changed
+  const uint8_t *src = (second ? b : a) + pixel * bpp;
+  uint8_t *p = dst + pixel * bpp;
+
+  if (p == src || memcmp(p, src, bpp) == 0)
+    return 0;
+
+  memcpy(p, src, bpp);
+  return 1;
+}
+
+static int _pixmod_wipe(uint8_t *dst, const uint8_t *a, const uint8_t *b, int width, int height, int bpp, int position, int direction)
+{
+  // Pixels before the position come from the second buffer, the rest from the first one. The position is
+  // counted in columns from the left (0) or right (1), or in rows from the top (2) or bottom (3).
+  int changed = 0;
+
+  for (int y = 0; y < height; y++)
+  {
+    for (int x = 0; x < width; x++)
+    {
+      int coordinate;
+      switch (direction)
+      {
+      case 1:
+        coordinate = width - 1 - x;
+        break;
+      case 2:
+        coordinate = y;
+        break;
+      case 3:
+        coordinate = height - 1 - y;
+        break;
+      default:
+        coordinate = x;
       }
+      changed |= _pixmod_select(dst, a, b, y * width + x, bpp, coordinate < position);
     }
   }
+
+  return changed;
+}
+
+static uint8_t _dissolve_threshold(uint32_t pixel, uint32_t seed)
+{
+  // Integer hash of the pixel index, gives every pixel a fixed pseudo-random threshold
+  uint32_t h = (pixel ^ seed) * 2654435761u;
+  h ^= h >> 15;
+  h *= 2246822519u;
+  h ^= h >> 13;
+  return h & 0xFF;
+}
+
+static int _pixmod_dissolve(uint8_t *dst, const uint8_t *a, const uint8_t *b, int npix, int bpp, int amount, uint32_t seed)
+{
+  // Pixels with a threshold below the amount (0 to 256) come from the second buffer, the rest from the first one
+  int changed = 0;
+
+  for (int i = 0; i < npix; i++)
+    changed |= _pixmod_select(dst, a, b, i, bpp, _dissolve_threshold(i, seed) < amount);
+
+  return changed;
 }
 
 #ifndef _EMULATOR_MODE_
@@ -419,8 +710,8 @@ static int pixmod_set(lua_State *L)
 
   uint32_t color = _color_pack(luaL_checkinteger(L, 6), luaL_checkinteger(L, 7), luaL_checkinteger(L, 8));
   pixelbuffer_t pb = wrap_buffer(source, w, h, 0, 0);
-  _pixmod_set(&pb, x-1, y-1, color);
-  return 0;
+  lua_pushboolean(L, _pixmod_set(&pb, x-1, y-1, color));
+  return 1;
 }
 
 static int pixmod_line(lua_State *L)
@@ -435,8 +726,8 @@ static int pixmod_line(lua_State *L)
 
   uint32_t color = _color_pack(luaL_checkinteger(L, 8), luaL_checkinteger(L, 9), luaL_checkinteger(L, 10));
   pixelbuffer_t pb = wrap_buffer(source, w, h, 0, 0);
-  _pixmod_line(&pb, x0-1, y0-1, x1-1, y1-1, color);
-  return 0;
+  lua_pushboolean(L, _pixmod_line(&pb, x0-1, y0-1, x1-1, y1-1, color));
+  return 1;
 }
 
 static int pixmod_add(lua_State *L)
@@ -446,8 +737,8 @@ static int pixmod_add(lua_State *L)
   int h = luaL_checkinteger(L, 3);
   int value = luaL_checkinteger(L, 4);
   pixelbuffer_t pb = wrap_buffer(source, w, h, 0, 0);
-  _pixmod_add(&pb, value);
-  return 0;
+  lua_pushboolean(L, _pixmod_add(&pb, value));
+  return 1;
 }
 
 static int pixmod_fill(lua_State *L)
@@ -461,8 +752,8 @@ static int pixmod_fill(lua_State *L)
   int height = luaL_checkinteger(L, 7);
   uint32_t color = _color_pack(luaL_checkinteger(L, 8), luaL_checkinteger(L, 9), luaL_checkinteger(L, 10));
   pixelbuffer_t pb = wrap_buffer(source, w, h, 0, 0);
-  _pixmod_fill(&pb, x-1, y-1, width, height, color);
-  return 0;
+  lua_pushboolean(L, _pixmod_fill(&pb, x-1, y-1, width, height, color));
+  return 1;
 }
 
 static int pixmod_blit(lua_State *L)
@@ -481,8 +772,10 @@ static int pixmod_blit(lua_State *L)
   int dst_x = luaL_checkinteger(L, 11);
   int dst_y = luaL_checkinteger(L, 12);
 
-  _pixmod_blit(wrap_buffer(src, src_w, src_h, 0, 0), wrap_buffer(dst, dst_w, dst_h, 0, 0), src_x, src_y, src_w2, src_h2, dst_x, dst_y);
-  return 0;
+  pixelbuffer_t pb_src = wrap_buffer(src, src_w, src_h, 0, 0);
+  pixelbuffer_t pb_dst = wrap_buffer(dst, dst_w, dst_h, 0, 0);
+  lua_pushboolean(L, _pixmod_blit(&pb_src, &pb_dst, src_x - 1, src_y - 1, src_w2, src_h2, dst_x - 1, dst_y - 1));
+  return 1;
 }
 
 static int pixmod_blit_color(lua_State *L)
@@ -503,8 +796,10 @@ static int pixmod_blit_color(lua_State *L)
 
   uint32_t color = _color_pack(luaL_checkinteger(L, 13), luaL_checkinteger(L, 14), luaL_checkinteger(L, 15));
 
-  _pixmod_blit_color(wrap_buffer(mask, mask_w, mask_h, 0, 0), wrap_buffer(dst, dst_w, dst_h, 0, 0), mask_x, mask_y, mask_w2, mask_h2, dst_x, dst_y, color);
-  return 0;
+  pixelbuffer_t pb_mask = wrap_buffer(mask, mask_w, mask_h, 0, 0);
+  pixelbuffer_t pb_dst = wrap_buffer(dst, dst_w, dst_h, 0, 0);
+  lua_pushboolean(L, _pixmod_blit_color(&pb_mask, &pb_dst, mask_x - 1, mask_y - 1, mask_w2, mask_h2, dst_x - 1, dst_y - 1, color));
+  return 1;
 }
 
 static int pixmod_blit_mask(lua_State *L)
@@ -527,10 +822,138 @@ static int pixmod_blit_mask(lua_State *L)
   int mask_w = luaL_checkinteger(L, 14);
   int mask_h = luaL_checkinteger(L, 15);
 
-  _pixmod_blit_mask(wrap_buffer(src, src_w, src_h, 0, 0), wrap_buffer(dst, dst_w, dst_h, 0, 0), wrap_buffer(mask, mask_w, mask_h, 0, 0), src_x, src_y, src_w2, src_h2, dst_x, dst_y);
-  return 0;
+  pixelbuffer_t pb_src = wrap_buffer(src, src_w, src_h, 0, 0);
+  pixelbuffer_t pb_dst = wrap_buffer(dst, dst_w, dst_h, 0, 0);
+  pixelbuffer_t pb_mask = wrap_buffer(mask, mask_w, mask_h, 0, 0);
+  lua_pushboolean(L, _pixmod_blit_mask(&pb_src, &pb_dst, &pb_mask, src_x - 1, src_y - 1, src_w2, src_h2, dst_x - 1, dst_y - 1));
+  return 1;
+}
+
+static int pixmod_life(lua_State *L)
+{
+  pixbuf *world = pixbuf_from_lua_arg(L, 1);
+  pixbuf *scratch = pixbuf_from_lua_arg(L, 2);
+  int w = luaL_checkinteger(L, 3);
+  int h = luaL_checkinteger(L, 4);
+  // Conway's rules (B3/S23) are used by default
+  int birth = luaL_optinteger(L, 5, 0x08);
+  int survive = luaL_optinteger(L, 6, 0x0C);
+
+  pixelbuffer_t pb_world = wrap_buffer(world, w, h, 0, 0);
+  pixelbuffer_t pb_scratch = wrap_buffer(scratch, w, h, 0, 0);
+  int changed;
+  lua_pushinteger(L, _pixmod_life(&pb_world, &pb_scratch, birth, survive, &changed));
+  lua_pushboolean(L, changed);
+  return 2;
+}
+static int pixmod_decode(lua_State *L)
+{
+  pixbuf *dst = pixbuf_from_lua_arg(L, 1);
+  int position = luaL_checkinteger(L, 2);
+  size_t length, palette_length;
+  const uint8_t *data = (const uint8_t *) luaL_checklstring(L, 3, &length);
+  const uint8_t *palette = (const uint8_t *) luaL_checklstring(L, 4, &palette_length);
+
+  luaL_argcheck(L, position >= 1 && position <= dst->npix, 2, "index out of bounds");
+
+  int changed;
+  lua_pushinteger(L, _pixmod_decode(dst->values + (position - 1) * dst->nchan, dst->npix - position + 1, dst->nchan, data, length, palette, palette_length / dst->nchan, &changed));
+  lua_pushboolean(L, changed);
+  return 2;
+}
+
+static int pixmod_decode_rect(lua_State *L)
+{
+  pixbuf *dst = pixbuf_from_lua_arg(L, 1);
+  int dst_w = luaL_checkinteger(L, 2);
+  int dst_h = luaL_checkinteger(L, 3);
+  int x = luaL_checkinteger(L, 4);
+  int y = luaL_checkinteger(L, 5);
+  int w = luaL_checkinteger(L, 6);
+  int h = luaL_checkinteger(L, 7);
+  size_t length, palette_length;
+  const uint8_t *data = (const uint8_t *) luaL_checklstring(L, 8, &length);
+  const uint8_t *palette = (const uint8_t *) luaL_checklstring(L, 9, &palette_length);
+
+  pixelbuffer_t pb = wrap_buffer(dst, dst_w, dst_h, 0, 0);
+  int changed;
+  lua_pushinteger(L, _pixmod_decode_rect(&pb, x - 1, y - 1, w, h, data, length, palette, palette_length / dst->nchan, &changed));
+  lua_pushboolean(L, changed);
+  return 2;
+}
+
+static int pixmod_text(lua_State *L)
+{
+  pixbuf *dst = pixbuf_from_lua_arg(L, 1);
+  int dst_w = luaL_checkinteger(L, 2);
+  int dst_h = luaL_checkinteger(L, 3);
+  size_t glyphs_length, text_length;
+  const uint8_t *glyphs = (const uint8_t *) luaL_checklstring(L, 4, &glyphs_length);
+  int gw = luaL_checkinteger(L, 5);
+  int gh = luaL_checkinteger(L, 6);
+  int first = luaL_checkinteger(L, 7);
+  const uint8_t *text = (const uint8_t *) luaL_checklstring(L, 8, &text_length);
+  int x = luaL_checkinteger(L, 9);
+  int y = luaL_checkinteger(L, 10);
+  uint32_t color = _color_pack(luaL_checkinteger(L, 11), luaL_checkinteger(L, 12), luaL_checkinteger(L, 13));
+  int spacing = luaL_optinteger(L, 14, 0);
+
+  luaL_argcheck(L, gw > 0 && gh > 0, 5, "invalid glyph size");
+
+  pixelbuffer_t pb = wrap_buffer(dst, dst_w, dst_h, 0, 0);
+  int changed;
+  // Returns the position after the last character
+  lua_pushinteger(L, _pixmod_text(&pb, glyphs, glyphs_length / ((gw * gh + 7) / 8), gw, gh, first, text, text_length, x - 1, y - 1, spacing, color, &changed) + 1);
+  lua_pushboolean(L, changed);
+  return 2;
 }
 
+static void check_sizes(lua_State *L, pixbuf *dst, pixbuf *a, pixbuf *b)
+{
+  luaL_argcheck(L, a->npix == dst->npix && a->nchan == dst->nchan, 2, "buffers differ in size");
+  luaL_argcheck(L, b->npix == dst->npix && b->nchan == dst->nchan, 3, "buffers differ in size");
+}
+
+static int pixmod_crossfade(lua_State *L)
+{
+  pixbuf *dst = pixbuf_from_lua_arg(L, 1);
+  pixbuf *a = pixbuf_from_lua_arg(L, 2);
+  pixbuf *b = pixbuf_from_lua_arg(L, 3);
+  int alpha = luaL_checkinteger(L, 4);
+
+  check_sizes(L, dst, a, b);
+  lua_pushboolean(L, _pixmod_crossfade(dst->values, a->values, b->values, dst->npix * dst->nchan, alpha));
+  return 1;
+}
+
+static int pixmod_wipe(lua_State *L)
+{
+  pixbuf *dst = pixbuf_from_lua_arg(L, 1);
+  pixbuf *a = pixbuf_from_lua_arg(L, 2);
+  pixbuf *b = pixbuf_from_lua_arg(L, 3);
+  int w = luaL_checkinteger(L, 4);
+  int h = luaL_checkinteger(L, 5);
+  int position = luaL_checkinteger(L, 6);
+  int direction = luaL_optinteger(L, 7, 0);
+
+  check_sizes(L, dst, a, b);
+  luaL_argcheck(L, w > 0 && h > 0 && w * h <= dst->npix, 4, "invalid size");
+  lua_pushboolean(L, _pixmod_wipe(dst->values, a->values, b->values, w, h, dst->nchan, position, direction));
+  return 1;
+}
+
+static int pixmod_dissolve(lua_State *L)
+{
+  pixbuf *dst = pixbuf_from_lua_arg(L, 1);
+  pixbuf *a = pixbuf_from_lua_arg(L, 2);
+  pixbuf *b = pixbuf_from_lua_arg(L, 3);
+  int amount = luaL_checkinteger(L, 4);
+  uint32_t seed = luaL_optinteger(L, 5, 0);
+
+  check_sizes(L, dst, a, b);
+  lua_pushboolean(L, _pixmod_dissolve(dst->values, a->values, b->values, dst->npix, dst->nchan, amount, seed));
+  return 1;
+}
 
 LROT_BEGIN(pixmod_map, NULL, 0)
 LROT_FUNCENTRY(set, pixmod_set)
@@ -540,6 +963,13 @@ LROT_FUNCENTRY(fill, pixmod_fill)
 LROT_FUNCENTRY(blit, pixmod_blit)
 LROT_FUNCENTRY(blit_color, pixmod_blit_color)
 LROT_FUNCENTRY(blit_mask, pixmod_blit_mask)
+LROT_FUNCENTRY(life, pixmod_life)
+LROT_FUNCENTRY(decode, pixmod_decode)
+LROT_FUNCENTRY(decode_rect, pixmod_decode_rect)
+LROT_FUNCENTRY(text, pixmod_text)
+LROT_FUNCENTRY(crossfade, pixmod_crossfade)
+LROT_FUNCENTRY(wipe, pixmod_wipe)
+LROT_FUNCENTRY(dissolve, pixmod_dissolve)
 LROT_END(pixmod_map, NULL, 0)
 
 NODEMCU_MODULE(PIXMOD, "pixmod", pixmod_map, NULL);
@@ -550,39 +980,34 @@ int set(uint8_t *data, int width, int height, int bpp, int x, int y, int r, int
 {
   pixelbuffer_t pb = wrap_buffer(data, width, height, bpp, 0, 0);
   uint32_t color = _color_pack(r, g, b);
-  _pixmod_set(&pb, x-1, y-1, color);
-  return 0;
+  return _pixmod_set(&pb, x-1, y-1, color);
 }
 
 int line(uint8_t *data, int width, int height, int bpp, int x0, int y0, int x1, int y1, int r, int g, int b)
 {
   pixelbuffer_t pb = wrap_buffer(data, width, height, bpp, 0, 0);
   uint32_t color = _color_pack(r, g, b);
-  _pixmod_line(&pb, x0-1, y0-1, x1-1, y1-1, color);
-  return 0;
+  return _pixmod_line(&pb, x0-1, y0-1, x1-1, y1-1, color);
 }
 
 int add(uint8_t *data, int width, int height, int bpp, int value)
 {
   pixelbuffer_t pb = wrap_buffer(data, width, height, bpp, 0, 0);
-  _pixmod_add(&pb, value);
-  return 0;
+  return _pixmod_add(&pb, value);
 }
 
 int fill(uint8_t *data, int width, int height, int bpp, int x, int y, int w, int h, int r, int g, int b)
 {
   pixelbuffer_t pb = wrap_buffer(data, width, height, bpp, 0, 0);
   uint32_t color = _color_pack(r, g, b);
-  _pixmod_fill(&pb, x-1, y-1, w, h, color);
-  return 0;
+  return _pixmod_fill(&pb, x-1, y-1, w, h, color);
 }
 
 int blit(uint8_t *src, int src_width, int src_height, int src_bpp, uint8_t *dst, int dst_width, int dst_height, int dst_bpp, int x, int y, int w, int h, int dx, int dy)
 {
   pixelbuffer_t pb_src = wrap_buffer(src, src_width, src_height, src_bpp, 0, 0);
   pixelbuffer_t pb_dst = wrap_buffer(dst, dst_width, dst_height, dst_bpp, 0, 0);
-  _pixmod_blit(&pb_src, &pb_dst, x-1, y-1, w, h, dx-1, dy-1);
-  return 0;
+  return _pixmod_blit(&pb_src, &pb_dst, x-1, y-1, w, h, dx-1, dy-1);
 }
 
 int blit_color(uint8_t *mask, int mask_width, int mask_height, int mask_bpp, uint8_t *dst, int dst_width, int dst_height, int dst_bpp, int x, int y, int w, int h, int dx, int dy, int r, int g, int b)
@@ -590,8 +1015,7 @@ int blit_color(uint8_t *mask, int mask_width, int mask_height, int mask_bpp, uin
   pixelbuffer_t pb_target = wrap_buffer(dst, dst_width, dst_height, dst_bpp, 0, 0);
   pixelbuffer_t pb_mask = wrap_buffer(mask, mask_width, mask_height, mask_bpp, 0, 0);
   uint32_t color = _color_pack(r, g, b);
-  _pixmod_blit_color(&pb_mask, &pb_target, x-1, y-1, w, h, dx-1, dy-1, color);
-  return 0;
+  return _pixmod_blit_color(&pb_mask, &pb_target, x-1, y-1, w, h, dx-1, dy-1, color);
 }
 
 int blit_mask(uint8_t *src, int src_width, int src_height, int src_bpp, uint8_t *dst, int dst_width, int dst_height, int dst_bpp, uint8_t *mask, int mask_width, int mask_height, int x, int y, int w, int h, int dx, int dy)
@@ -599,8 +1023,49 @@ int blit_mask(uint8_t *src, int src_width, int src_height, int src_bpp, uint8_t
   pixelbuffer_t pb_src = wrap_buffer(src, src_width, src_height, src_bpp, 0, 0);
   pixelbuffer_t pb_dst = wrap_buffer(dst, dst_width, dst_height, dst_bpp, 0, 0);
   pixelbuffer_t pb_mask = wrap_buffer(mask, mask_width, mask_height, 1, 0, 0);
-  _pixmod_blit_mask(&pb_src, &pb_dst, &pb_mask, x-1, y-1, w, h, dx-1, dy-1);
-  return 0;
+  return _pixmod_blit_mask(&pb_src, &pb_dst, &pb_mask, x-1, y-1, w, h, dx-1, dy-1);
+}
+
+int life(uint8_t *world, int width, int height, int bpp, uint8_t *scratch, int scratch_bpp, int birth, int survive, int *changed)
+{
+  pixelbuffer_t pb_world = wrap_buffer(world, width, height, bpp, 0, 0);
+  pixelbuffer_t pb_scratch = wrap_buffer(scratch, width, height, scratch_bpp, 0, 0);
+  return _pixmod_life(&pb_world, &pb_scratch, birth, survive, changed);
+}
+
+int decode(uint8_t *dst, int npix, int bpp, const uint8_t *data, int length, const uint8_t *palette, int colors, int *changed)
+{
+  return _pixmod_decode(dst, npix, bpp, data, length, palette, colors, changed);
+}
+
+int decode_rect(uint8_t *dst, int width, int height, int bpp, int x, int y, int w, int h, const uint8_t *data, int length, const uint8_t *palette, int colors, int *changed)
+{
+  pixelbuffer_t pb = wrap_buffer(dst, width, height, bpp, 0, 0);
+  return _pixmod_decode_rect(&pb, x - 1, y - 1, w, h, data, length, palette, colors, changed);
+}
+
+int text(uint8_t *dst, int width, int height, int bpp, const uint8_t *glyphs, int length, int gw, int gh, int first, const uint8_t *text, int text_length, int x, int y, int r, int g, int b, int spacing, int *changed)
+{
+  pixelbuffer_t pb = wrap_buffer(dst, width, height, bpp, 0, 0);
+  *changed = 0;
+  if (gw <= 0 || gh <= 0)
+    return x;
+  return _pixmod_text(&pb, glyphs, length / ((gw * gh + 7) / 8), gw, gh, first, text, text_length, x - 1, y - 1, spacing, _color_pack(r, g, b), changed) + 1;
+}
+
+int crossfade(uint8_t *dst, const uint8_t *a, const uint8_t *b, int length, int alpha)
+{
+  return _pixmod_crossfade(dst, a, b, length, alpha);
+}
+
+int wipe(uint8_t *dst, const uint8_t *a, const uint8_t *b, int width, int height, int bpp, int position, int direction)
+{
+  return _pixmod_wipe(dst, a, b, width, height, bpp, position, direction);
+}
+
+int dissolve(uint8_t *dst, const uint8_t *a, const uint8_t *b, int npix, int bpp, int amount, int seed)
+{
+  return _pixmod_dissolve(dst, a, b, npix, bpp, amount, (uint32_t) seed);
 }
 
 #endif
\ No newline at end of file
@@ -67,7 +67,7 @@
 //#define LUA_USE_MODULES_TLS
 #define LUA_USE_MODULES_TMR
 //#define LUA_USE_MODULES_TSL2561
-//#define LUA_USE_MODULES_UART
+#define LUA_USE_MODULES_UART
 //#define LUA_USE_MODULES_U8G2
 //#define LUA_USE_MODULES_UCG
 //#define LUA_USE_MODULES_WEBSOCKET
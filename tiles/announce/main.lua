@@ -18,7 +18,7 @@ local function main(state, screen)
         state.offset = -screen.width
     end
 
-    screen.buffer:fill(0, 0, 0)
+    screen:clear()
     state.font:print(screen, state.text, -state.offset, state.y, state.cr, state.cg, state.cb)
 
     state.offset = state.offset + 1
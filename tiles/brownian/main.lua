@@ -11,7 +11,7 @@ local function brownian(state, screen)
             g = node.random(0, 255),
             b = node.random(0, 255)
         }   
-        screen.buffer:fill(0, 0, 0)
+        screen:clear()
     end
 
     if state.counter == 0 then
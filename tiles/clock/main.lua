@@ -16,6 +16,7 @@ end
 local function main(state, screen)
 
     if state == nil then
+        local Font = load_font()
         state = {
             counter = 1000,
 			time = time,
@@ -28,11 +29,16 @@ local function main(state, screen)
         state.counter = 0
     end
 
-    screen.buffer.fill(0, 0, 0)
+    -- The screen is only drawn again when the time changes
+    local shown = (state.time.date or "") .. (state.time.time or "") .. (state.time.day or "")
 
-    state.font:print(screen, state.time.date, 1, 2, 255, 255, 255)
-    state.font:print(screen, state.time.time, 1, 8, 255, 0, 255)
-    state.font:print(screen, state.time.day, 5, 15, 255, 255, 255)
+    if shown ~= state.shown then
+        state.shown = shown
+        screen:clear()
+        state.font:print(screen, state.time.date, 1, 2, 255, 255, 255)
+        state.font:print(screen, state.time.time, 1, 8, 255, 0, 255)
+        state.font:print(screen, state.time.day, 5, 15, 255, 255, 255)
+    end
 
     state.counter = state.counter + 1
 
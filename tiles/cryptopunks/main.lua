@@ -4,16 +4,19 @@ local function cryptopunks(state, screen)
 
     if state == nil then
         local Sprites = load_sprites();
+        local sprites = Sprites.open("cryptopunks.dat")
         state = {
-            sprites = Sprites.open("cryptopunks.dat"),
+            sprites = sprites,
+            index = node.random(1, sprites.count),
             count = 0
         }
   
     end
 
+    -- Punks are shown in order from a random one on, consecutive frames are drawn straight to the screen
     if state.count % 200 == 0 then
-        local i = node.random(1, state.sprites.count)
-        state.sprites:display(screen, i, 1, 1)
+        state.sprites:play(screen, state.index, 1, 1)
+        state.index = state.index % state.sprites.count + 1
     end
 
     state.count = state.count + 1
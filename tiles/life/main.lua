@@ -4,7 +4,7 @@ do
 	Life = {}
 	local mt = { __index = Life }
 
-	function Life.new(m, n)
+	function Life.new(m, n, birth, survive)
 		local world = pixbuf.newBuffer(m * n, 1)
 		local temporary = pixbuf.newBuffer(m * n, 1)
 
@@ -16,7 +16,9 @@ do
 			temporary = temporary,
 			m = m,
 			n = n,
-			l = 1,
+			-- Rules are bit masks of neighbour counts, B3/S23 by default
+			birth = birth or 0x08,
+			survive = survive or 0x0C,
 			cr = node.random(100, 255),
 			cg = node.random(100, 255),
 			cb = node.random(100, 255),
@@ -31,36 +33,8 @@ do
 		self.world:set((y-1) * self.m + x, 0)
 	end
 
-	function Life:step(c)
-		local O = self.temporary
-		local I = self.world
-
-		for j = self.l, math.min(self.l + c, self.n) do
-			for i = 1, self.m do
-				local s = 0
-				for p = i-1,i+1 do
-					for q = j-1,j+1 do
-						if p > 0 and p <= self.m and q > 0 and q <= self.n then
-							s = s + I:get((q-1)*self.m + p)
-						end
-					end
-				end
-				local x = I:get((j-1) * self.m + i)
-				s = s - x
-				if s == 3 or (s+x) == 3 then
-					O:set((j-1) * self.m + i, 1)
-				else
-					O:set((j-1) * self.m + i, 0)
-				end
-			end
-		end
-		self.l = math.min(self.l + c, self.n) 
-		if self.l == self.n then
-			I:replace(O)
-			self.l = 1
-			return true
-		end
-		return false
+	function Life:step()
+		return pixmod.life(self.world, self.temporary, self.m, self.n, self.birth, self.survive)
 	end
 
 	function Life:display(screen)
@@ -72,6 +46,7 @@ do
 			end
 		end
 		screen.buffer:map(f, self.world, 1)
+		screen:invalidate()
 	end
 end
 
@@ -92,9 +67,11 @@ local function life(state, screen)
 
     end
 
-    if state.game:step(3) then
-		state.game:display(screen)
-	end
+    -- Still lifes are not displayed again
+    local _, changed = state.game:step()
+    if changed or state.counter == 0 then
+        state.game:display(screen)
+    end
 
 	state.counter = state.counter + 1
 
@@ -24,7 +24,7 @@ local function mario(state, screen)
 
     if state.count % 5 == 0 then
 
-        screen.buffer:fill(0, 0, 0)
+        screen:clear()
 
         if state.x > (screen.width+1) or state.y > (screen.height+1) or state.x < -screen.width or state.y < -screen.height then
             state.direction = node.random(1, state.sprites.count / 2)
@@ -0,0 +1,119 @@
+-- Stream
+--
+-- Shows frames rendered on a host, e.g. with "emulator.py <tile> --stream udp://<panel>:5005". Frames arrive
+-- as UDP datagrams or as messages with a two byte length prefix over TCP. Each message has a header
+-- ("PF", type, frame, base frame, part, number of parts) and a list of spans (first pixel, number of pixels,
+-- GRB values). Keyframes are always accepted, deltas only if the base frame was received completely.
+
+local PORT = 5005
+-- Number of frames without new data before other tiles are shown
+local IDLE = 50
+
+local function u16(data, i)
+    local a, b = data:byte(i, i + 1)
+    return a + b * 256
+end
+
+local function apply(receiver, packet)
+
+    if #packet < 9 or packet:sub(1, 2) ~= "PF" then
+        return
+    end
+
+    local kind = packet:byte(3)
+    local sequence, base = u16(packet, 4), u16(packet, 6)
+    local part, parts = packet:byte(8, 9)
+
+    if part == 0 and (kind == 0 or receiver.sequence == base) then
+        receiver.current = sequence
+        receiver.expect = 0
+    end
+
+    if receiver.current ~= sequence or receiver.expect ~= part then
+        return
+    end
+
+    local frame = receiver.frame
+    local i = 10
+
+    while i + 2 <= #packet do
+        local start, count = u16(packet, i), packet:byte(i + 2)
+        if i + 2 + count * 3 > #packet or start + count > frame:size() then
+            receiver.current = nil
+            return
+        end
+        frame:set(start + 1, packet:sub(i + 3, i + 2 + count * 3))
+        i = i + 3 + count * 3
+    end
+
+    receiver.expect = part + 1
+
+    if receiver.expect == parts then
+        receiver.sequence = sequence
+        receiver.received = receiver.received + 1
+    end
+end
+
+local function listen(screen)
+
+    local receiver = {
+        frame = pixbuf.newBuffer(screen.width * screen.height, 3),
+        received = 0
+    }
+
+    receiver.udp = net.createUDPSocket()
+    receiver.udp:on("receive", function(s, data) apply(receiver, data) end)
+    receiver.udp:listen(PORT)
+
+    receiver.tcp = net.createServer(net.TCP, 30)
+    receiver.tcp:listen(PORT, function(connection)
+        local pending = ""
+        connection:on("receive", function(c, data)
+            pending = pending .. data
+            while #pending >= 2 and #pending >= u16(pending, 1) + 2 do
+                local length = u16(pending, 1)
+                apply(receiver, pending:sub(3, length + 2))
+                pending = pending:sub(length + 3)
+            end
+        end)
+    end)
+
+    return receiver
+end
+
+local function main(state, screen)
+
+    -- The receiver is global as tiles are loaded again every time they are shown, the sockets stay open
+    if STREAM == nil then
+        STREAM = listen(screen)
+    end
+
+    -- Nothing was streamed yet, other tiles are shown instead of an empty frame
+    if STREAM.received == 0 then
+        return nil
+    end
+
+    if state == nil then
+        state = {
+            received = STREAM.received,
+            -- The last received frame is shown right away
+            idle = -1
+        }
+    end
+
+    if STREAM.received ~= state.received or state.idle < 0 then
+        state.received = STREAM.received
+        state.idle = 0
+        screen.buffer:replace(STREAM.frame)
+        screen:invalidate()
+    else
+        state.idle = state.idle + 1
+        if state.idle > IDLE then
+            return nil
+        end
+    end
+
+    return state
+end
+
+return main
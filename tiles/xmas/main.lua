@@ -3,6 +3,7 @@
 local function xmas(state, screen)
 
     if state == nil then
+        local Sprites = load_sprites();
         local db = Sprites.open("tree.dat")
         state = {
             sprites = db:load(1, 1),
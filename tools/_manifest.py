@@ -0,0 +1,75 @@
+# Lists the core and tile files that make up a device and compiles the playlist, shared by manage.py and the
+# emulator. Nothing here converts or writes files.
+
+import os
+import json
+from os.path import isdir, isfile, join
+
+def core_files(base):
+    """Returns the names and paths of the core scripts and sprite sheets, init.lua last as it starts the others"""
+    files = {}
+
+    core = join(base, "core")
+    for e in sorted(os.listdir(core), key=lambda e: (e == "init.lua", e)):
+        if os.path.splitext(e)[1] in [".lua", ".dat"]:
+            files[e] = join(core, e)
+
+    return files
+
+def device_files(base):
+    """Returns the names and paths of the core and tile files on a device, tiles are stored as tile_<name>.lua
+    next to their sprite sheets. Sprite sheets are listed as they were last converted."""
+    files = core_files(base)
+
+    tiles = join(base, "tiles")
+    for e in sorted(os.listdir(tiles)):
+        if not isdir(join(tiles, e)):
+            continue
+        for f in sorted(os.listdir(join(tiles, e))):
+            if f == "main.lua":
+                files["tile_%s.lua" % e] = join(tiles, e, f)
+            elif os.path.splitext(f)[1] == ".dat":
+                files[f] = join(tiles, e, f)
+
+    return files
+
+def playlist(base):
+    """Compiles tile.json files of the tiles in the manifest into playlist entries. A tile can set its
+    "weight" (relative chance of being picked, 0 disables it), "duration" (number of frames it is shown,
+    random if omitted) and "assets" (sprite sheets prefetched before it starts, .dat files in the tile
+    directory and the ones declared in "sprites" by default)."""
+    entries = []
+
+    tiles = join(base, "tiles")
+    for e in sorted(os.listdir(tiles)):
+        if not isfile(join(tiles, e, "main.lua")):
+            continue
+        meta = {}
+        if isfile(join(tiles, e, "tile.json")):
+            with open(join(tiles, e, "tile.json"), "r") as handle:
+                meta = json.load(handle)
+        entry = {"name": "tile_%s" % e, "title": meta.get("name", e), "weight": max(0, int(meta.get("weight", 1)))}
+        if "duration" in meta:
+            entry["duration"] = max(1, int(meta["duration"]))
+        # Sprite sheets declared in tile.json count even if they were not converted yet
+        sheets = set(f for f in os.listdir(join(tiles, e)) if os.path.splitext(f)[1] == ".dat")
+        sheets.update(os.path.splitext(f)[0] + ".dat" for f in meta.get("sprites", {}))
+        entry["assets"] = meta.get("assets", sorted(sheets))
+        entries.append(entry)
+
+    return entries
+
+def format_playlist(entries):
+    """Formats playlist entries as a Lua chunk that returns them, loaded by core/main.lua"""
+    def value(v):
+        if isinstance(v, list):
+            return "{" + ", ".join(value(i) for i in v) + "}"
+        if isinstance(v, str):
+            return json.dumps(v, ensure_ascii=False)
+        return str(v)
+
+    lines = ["return {"]
+    for entry in entries:
+        lines.append("  {" + ", ".join("%s = %s" % (k, value(v)) for k, v in entry.items()) + "},")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
@@ -1,8 +1,13 @@
 import sys
 import serial
 import socket
+import select
 import os
+import re
 import stat
+import asyncio
+import collections
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep
 
 class TransportError(Exception):
@@ -15,18 +20,86 @@ class TransportError(Exception):
         return self.message
 
 class AbstractTransport:
+    # Interpreter prompt (or continuation prompt) at the beginning of a line
+    PROMPT = re.compile(rb"(?:^|\n)>>? ")
+
     def __init__(self):
         raise NotImplementedError('abstract transports cannot be instantiated.')
 
     def close(self):
         raise NotImplementedError('Function not implemented')
 
-    def read(self, length):
+    def receive(self):
+        """Returns a chunk of available data, waits until timeout if nothing is available and returns
+        an empty string in that case.
+        """
+        raise NotImplementedError('Function not implemented')
+
+    def available(self):
+        raise NotImplementedError('Function not implemented')
+
+    def discard(self):
         raise NotImplementedError('Function not implemented')
 
     def raw(self, data, check=1):
         raise NotImplementedError('Function not implemented')
 
+    def write(self, data):
+        self.raw(data, False)
+
+    def read(self, length):
+        if len(self._buffer) == 0:
+            self._buffer += self.receive()
+        data = bytes(self._buffer[:length])
+        del self._buffer[:length]
+        return data
+
+    def inWaiting(self):
+        return len(self._buffer) + self.available()
+
+    def flushInput(self):
+        self._buffer.clear()
+        self.discard()
+
+    def read_until(self, pattern):
+        """Reads until the pattern (compiled regular expression) is matched. Returns the data before the
+        match, the matched part is consumed.
+        """
+        position = 0
+        while True:
+            match = pattern.search(self._buffer, position)
+            if match is not None:
+                data = bytes(self._buffer[:match.start()])
+                del self._buffer[:match.end()]
+                return data
+            # A match may start at the last few bytes and continue in the next chunk
+            position = max(0, len(self._buffer) - 4)
+            chunk = self.receive()
+            if len(chunk) == 0:
+                raise TransportError('Timeout waiting for "%s"' % pattern.pattern.decode("utf-8"))
+            self._buffer += chunk
+
+    def readline(self):
+        return self.read_until(re.compile(rb"\r?\n"))
+
+    def response(self, echo=None):
+        """Reads the output of a command up to the next prompt. If the echo of the command is given, it
+        is removed from the output.
+        """
+        data = self.read_until(self.PROMPT)
+        if echo is not None:
+            echo = echo.rstrip(b"\r\n")
+            if data.startswith(echo):
+                data = data[len(echo):]
+        return data.strip(b"\r\n")
+
+    def execute(self, command):
+        if isinstance(command, str):
+            command = command.encode("utf-8")
+        self.flushInput()
+        self.write(command)
+        return self.response(command)
+
     def data(self, data):
         bytes = ["%d" % i for i in data]
         self.raw("file.write(string.char(" + ",".join(bytes) + "))\r")
@@ -42,11 +115,12 @@ class AbstractTransport:
             keep += char
 
 class SerialTransport(AbstractTransport):
-    def __init__(self, port, baud, delay):
+    def __init__(self, port, baud, delay=0):
         self.port = port
         self.baud = baud
         self.serial = None
         self.delay = delay
+        self._buffer = bytearray()
 
         try:
             self.serial = serial.Serial(port, baud)
@@ -59,16 +133,37 @@ class SerialTransport(AbstractTransport):
     def raw(self, data, check=True):
         if isinstance(data, str):
             data = data.encode("utf-8")
-    
-        if self.serial.inWaiting() > 0:
-            self.serial.flushInput()
+
         self.serial.write(data)
-        sleep(self.delay)
+        if self.delay > 0:
+            sleep(self.delay)
         #if check:
         #    self.echocheck(data)
 
-    def read(self, length):
-        return self.serial.read(length)
+    def receive(self):
+        return self.serial.read(max(1, self.serial.inWaiting()))
+
+    def available(self):
+        return self.serial.inWaiting()
+
+    def discard(self):
+        self.serial.flushInput()
+
+    @property
+    def timeout(self):
+        return self.serial.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.serial.timeout = value
+
+    @property
+    def interCharTimeout(self):
+        return self.serial.interCharTimeout
+
+    @interCharTimeout.setter
+    def interCharTimeout(self, value):
+        self.serial.interCharTimeout = value
 
     def close(self):
         self.serial.flush()
@@ -76,10 +171,12 @@ class SerialTransport(AbstractTransport):
 
 
 class TcpSocketTransport(AbstractTransport):
-    def __init__(self, host, port):
+    def __init__(self, host, port, timeout=3):
         self.host = host
         self.port = port
         self.socket = None
+        self.interCharTimeout = timeout
+        self._buffer = bytearray()
 
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -87,28 +184,106 @@ class TcpSocketTransport(AbstractTransport):
             raise TransportError(e.strerror)
 
         try:
+            self.socket.settimeout(timeout)
             self.socket.connect((host, port))
         except socket.error as e:
-            raise TransportError(e.strerror)
+            raise TransportError(str(e))
         # read intro from telnet server (see telnet_srv.lua)
         #self.socket.recv(50)
 
     def raw(self, data, check=True):
         if isinstance(data, str):
             data = data.encode("utf-8")
-            
+
         self.socket.sendall(data)
         #if check:
         #    self.echocheck(data)
 
-    def read(self, length):
-        return self.socket.recv(length)
+    def receive(self):
+        # A timeout is reported as an empty read, the same as with a serial port
+        try:
+            return self.socket.recv(4096)
+        except socket.timeout:
+            return b""
+
+    def available(self):
+        readable, _, _ = select.select([self.socket], [], [], 0)
+        if not readable:
+            return 0
+        return len(self.socket.recv(4096, socket.MSG_PEEK))
+
+    def discard(self):
+        while self.available() > 0:
+            self.socket.recv(4096)
+
+    @property
+    def timeout(self):
+        return self.socket.gettimeout()
+
+    @timeout.setter
+    def timeout(self, value):
+        self.socket.settimeout(value)
 
     def close(self):
         self.socket.close()
 
 
-def create_transport(port, baud=9600, delay=0.05):
+class AsyncTransport:
+    """Asyncio access to a transport. Commands are written as soon as they are issued, without waiting
+    for the previous ones to finish, and the responses are matched to them in order. With a window, at
+    most that many commands are in flight, so that the input buffer of the device does not overflow.
+    The transport stays open when this is closed.
+    """
+    def __init__(self, transport, window=None):
+        self.transport = transport
+        self._pending = collections.deque()
+        self._reader = None
+        self._lock = asyncio.Lock()
+        self._window = asyncio.Semaphore(window) if window else None
+        self._writing = ThreadPoolExecutor(max_workers=1)
+        self._reading = ThreadPoolExecutor(max_workers=1)
+
+    async def command(self, command):
+        if self._window is None:
+            return await self._command(command)
+        async with self._window:
+            return await self._command(command)
+
+    async def _command(self, command):
+        if isinstance(command, str):
+            command = command.encode("utf-8")
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        async with self._lock:
+            self._pending.append((command, future))
+            await loop.run_in_executor(self._writing, self.transport.write, command)
+
+        if self._reader is None or self._reader.done():
+            self._reader = loop.create_task(self._read())
+
+        return await future
+
+    async def execute(self, *commands):
+        return await asyncio.gather(*[self.command(command) for command in commands])
+
+    async def _read(self):
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            command, future = self._pending[0]
+            try:
+                future.set_result(await loop.run_in_executor(self._reading, self.transport.response, command))
+            except Exception as e:
+                future.set_exception(e)
+            self._pending.popleft()
+
+    def close(self):
+        self._writing.shutdown()
+        self._reading.shutdown()
+
+
+def create_transport(port, baud=9600, delay=0):
 
     is_serial = False
 
@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+#
+# Measures pixel buffers, pixmod operations, sprite conversion and tile rendering of the emulator on panels
+# of different sizes, stores results as JSON baselines and compares them
+
+import sys
+import os
+import time
+import json
+import fnmatch
+import platform
+import itertools
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+import emulator
+import sprites
+
+root = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")
+
+SIZES = [(20, 20), (50, 50), (100, 100), (200, 200)]
+
+SUITES = ("buffer", "operations", "sprites", "tiles")
+
+# Conversions of images to sprite sheets
+CONVERSIONS = {
+    "raw": {},
+    "indexed": {"indexed": True},
+    "delta": {"delta": True}
+}
+
+def measure(function, repeat=5, duration=0.05, limit=2.0):
+    """Returns the best time of a single call and the number of calls in one measurement. Calls are repeated
+    until a measurement takes at least the given duration, slow functions are measured fewer times."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            break
+        number = number * 2 if elapsed <= 0 else max(number + 1, int(number * duration * 1.2 / elapsed))
+
+    times = [elapsed / number]
+    total = elapsed
+    while len(times) < repeat and total < limit:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        times.append(elapsed / number)
+        total += elapsed
+
+    return min(times), number
+
+def _alternate(function, *arguments):
+    """Calls the function with each of the argument tuples in turn, so that operations that skip unchanged
+    pixels always have something to do"""
+    cycle = itertools.cycle(arguments)
+    return lambda: function(*next(cycle))
+
+def buffer_cases(env, width, height):
+    pixbuf = emulator.Pixbuf(env)
+    count = width * height
+    random = np.random.default_rng(0)
+
+    buffer = pixbuf.newBuffer(count, 3)
+    source = pixbuf.newBuffer(count, 3)
+    source._buffer[:] = random.integers(0, 256, source._buffer.shape)
+    single = pixbuf.newBuffer(count, 1)
+    single._buffer[:] = random.integers(0, 16, single._buffer.shape)
+
+    pixels = source._buffer.tobytes()
+    swap = env.lua.eval("function(g, r, b) return r, g, b end")
+    gray = env.lua.eval("function(v) return v * 16, v * 16, v * 16 end")
+    palette = env.lua.table(*[env.lua.table(i * 16, 0, 255 - i * 16) for i in range(16)])
+
+    return {
+        "set": _alternate(buffer.set, (count // 2, 255, 0, 0), (count // 2, 0, 255, 0)),
+        "set.string": lambda: buffer.set(1, pixels),
+        "map": lambda: buffer.map(swap, source),
+        "map.single": lambda: buffer.map(gray, single),
+        "map.palette": lambda: buffer.map(palette, single),
+        "fade": _alternate(buffer.fade, (2, emulator.Pixbuf.FADE_OUT), (2, emulator.Pixbuf.FADE_IN)),
+        "replace": lambda: buffer.replace(source),
+        "sub": lambda: buffer.sub(1, count // 2)
+    }
+
+def operation_cases(operations, font, width, height):
+    count = width * height
+    random = np.random.default_rng(0)
+
+    def buffer(channels=3, high=256):
+        b = emulator.Buffer(count, channels)
+        b._buffer[:] = random.integers(0, high, b._buffer.shape)
+        return b
+
+    screen, a, b = buffer(), buffer(), buffer()
+    mask, world, scratch = buffer(1, 2), buffer(1, 2), buffer(1)
+
+    indices = random.integers(0, 4, (height, width))
+    # Runs of pixels, as in sprites
+    indices[:, width // 2:] = 0
+    data = sprites.encode_rle(indices.reshape(-1).tolist())
+    palette = random.integers(0, 256, 12, dtype=np.uint8).tobytes()
+
+    red, green = (0, 255, 0), (255, 0, 0)
+
+    return {
+        "set": _alternate(operations.set, (screen, width, height, 1, 1) + red, (screen, width, height, 1, 1) + green),
+        "line": _alternate(operations.line, (screen, width, height, 1, 1, width, height) + red, (screen, width, height, 1, 1, width, height) + green),
+        "add": _alternate(operations.add, (screen, width, height, 1), (screen, width, height, -1)),
+        "fill": _alternate(operations.fill, (screen, width, height, 1, 1, width, height) + red, (screen, width, height, 1, 1, width, height) + green),
+        "blit": _alternate(operations.blit, (a, width, height, screen, width, height, 1, 1, width, height, 1, 1),
+            (b, width, height, screen, width, height, 1, 1, width, height, 1, 1)),
+        "blit_color": _alternate(operations.blit_color, (mask, width, height, screen, width, height, 1, 1, width, height, 1, 1) + red,
+            (mask, width, height, screen, width, height, 1, 1, width, height, 1, 1) + green),
+        "blit_mask": _alternate(operations.blit_mask, (a, width, height, screen, width, height, mask, width, height, 1, 1, width, height, 1, 1),
+            (b, width, height, screen, width, height, mask, width, height, 1, 1, width, height, 1, 1)),
+        "life": lambda: operations.life(world, scratch, width, height),
+        "decode": lambda: operations.decode(screen, 1, data, palette),
+        "decode_rect": lambda: operations.decode_rect(screen, width, height, 1, 1, width, height, data, palette),
+        "text": _alternate(operations.text, (screen, width, height, font["glyphs"], font["width"], font["height"], font["first"], b"HELLO 20x20", 1, 1) + red,
+            (screen, width, height, font["glyphs"], font["width"], font["height"], font["first"], b"HELLO 20x20", 1, 1) + green),
+        "crossfade": _alternate(operations.crossfade, (screen, a, b, 64), (screen, a, b, 192)),
+        "wipe": _alternate(operations.wipe, (screen, a, b, width, height, width // 2, 0), (screen, a, b, width, height, width // 2, 1)),
+        "dissolve": _alternate(operations.dissolve, (screen, a, b, 128, 1), (screen, a, b, 128, 2))
+    }
+
+def prepare_assets(directory):
+    """Converts the sprite sheets and fonts used by tiles into a directory"""
+    for source, output, options in sprites.recipes(root):
+        with open(os.path.join(directory, os.path.basename(output)), "wb") as handle:
+            handle.write(sprites.convert(source, **options))
+
+def load_font(path):
+    with open(path, "rb") as handle:
+        content = handle.read()
+    return {"first": content[3], "width": content[6], "height": content[7], "glyphs": content[8:]}
+
+def run(suites=SUITES, sizes=SIZES, backends=("numpy", "native"), select=None, frames=50, rounds=1, report=print):
+    """Runs the benchmarks and returns a dictionary of results indexed by case name, each one with the time
+    of a single call (a frame for tiles) in seconds. Cases are named suite.[backend.]name/WxH, select is a
+    list of shell-style patterns that limits the cases that are run. With multiple rounds the whole suite
+    is repeated and the best time of each case is kept, which evens out changes in machine load."""
+
+    results = {}
+    directory = tempfile.mkdtemp(prefix="benchmark")
+    prepare_assets(directory)
+    font = load_font(os.path.join(directory, "font.dat"))
+    cwd = os.getcwd()
+
+    def selected(name):
+        return select is None or any(fnmatch.fnmatch(name, pattern) for pattern in select)
+
+    def store(name, result):
+        previous = results.get(name)
+        if previous is None or "time" not in previous or ("time" in result and result["time"] < previous["time"]):
+            results[name] = result
+        if "time" in result:
+            report("%-52s %12s" % (name, format_time(result["time"])))
+        else:
+            report("%-52s %12s (%s)" % (name, "failed", result["error"]))
+
+    def record(name, function):
+        if not selected(name):
+            return
+        try:
+            elapsed, number = measure(function)
+            store(name, {"time": elapsed, "calls": number})
+        except Exception as e:
+            store(name, {"error": str(e)})
+
+    try:
+        for i in range(rounds):
+            if rounds > 1:
+                report("Round %d of %d" % (i + 1, rounds))
+            if "buffer" in suites:
+                env = emulator.Environment(root)
+                for width, height in sizes:
+                    for case, function in buffer_cases(env, width, height).items():
+                        record("buffer.%s/%dx%d" % (case, width, height), function)
+
+            if "operations" in suites:
+                for backend in backends:
+                    operations = emulator.create_operations(backend)
+                    for width, height in sizes:
+                        for case, function in operation_cases(operations, font, width, height).items():
+                            record("operations.%s.%s/%dx%d" % (backend, case, width, height), function)
+
+            if "sprites" in suites:
+                for source, _, recipe in sprites.recipes(root):
+                    if recipe.get("format") == "font":
+                        record("sprites.%s.font" % os.path.basename(source), lambda: sprites.convert(source, **recipe))
+                        continue
+                    for conversion, options in CONVERSIONS.items():
+                        record("sprites.%s.%s" % (os.path.basename(source), conversion),
+                            lambda: sprites.convert(source, recipe.get("size"), **options))
+
+            if "tiles" in suites:
+                server = emulator.FixtureServer(os.path.join(root, "tools", "fixtures"))
+                try:
+                    for backend in backends:
+                        for name in emulator.find_tiles():
+                            for width, height in sizes:
+                                case = "tiles.%s.%s/%dx%d" % (backend, name, width, height)
+                                if not selected(case):
+                                    continue
+                                try:
+                                    stats = emulator.render(name, frames, width=width, height=height, backend=backend,
+                                        routes=server.routes(), search=[directory])
+                                    store(case, {"time": stats["time"] / frames, "calls": frames})
+                                except Exception as e:
+                                    store(case, {"error": str(e)})
+                finally:
+                    server.close()
+    finally:
+        # Rendering tiles changes the working directory
+        os.chdir(cwd)
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+    return results
+
+def metadata():
+    """Describes the machine and the revision the results were measured on"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__
+    }
+
+def format_time(seconds):
+    if seconds < 1e-3:
+        return "%.2f us" % (seconds * 1e6)
+    if seconds < 1:
+        return "%.2f ms" % (seconds * 1e3)
+    return "%.2f s" % seconds
+
+def compare(baseline, current, threshold=0.2, missing=True):
+    """Compares two sets of results, returns a list of (name, baseline time, current time, ratio, status)
+    tuples. Cases that got slower by more than the threshold or fail now are regressions, cases that were
+    not run again are only listed if missing is set."""
+    rows = []
+    for name in sorted((set(baseline) if missing else set()) | set(current)):
+        old, new = baseline.get(name), current.get(name)
+        if new is None:
+            rows.append((name, old.get("time"), None, None, "missing"))
+        elif old is None or "time" not in old:
+            # Failing without a time to compare with is not a regression
+            rows.append((name, None, new.get("time"), None, "new" if "time" in new else "failing"))
+        elif "time" not in new:
+            rows.append((name, old["time"], None, None, "failed"))
+        else:
+            ratio = new["time"] / old["time"] if old["time"] > 0 else float("inf")
+            if ratio > 1 + threshold:
+                status = "regression"
+            elif ratio < 1 / (1 + threshold):
+                status = "faster"
+            else:
+                status = ""
+            rows.append((name, old["time"], new["time"], ratio, status))
+    return rows
+
+def print_comparison(rows, report=print):
+    report("%-52s %12s %12s %8s" % ("Case", "Baseline", "Current", "Change"))
+    for name, old, new, ratio, status in rows:
+        report("%-52s %12s %12s %8s %s" % (name, format_time(old) if old is not None else "-", format_time(new) if new is not None else "-",
+            "%+.0f%%" % ((ratio - 1) * 100) if ratio is not None else "-", status))
+    regressions = [row for row in rows if row[4] in ("regression", "failed")]
+    report("%d cases, %d faster, %d regressions" % (len(rows), len([row for row in rows if row[4] == "faster"]), len(regressions)))
+    return len(regressions) == 0
+
+def load(path):
+    with open(path, "r") as handle:
+        return json.load(handle)
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmarks the emulator, sprite conversion and tiles', prog="benchmark")
+    subparsers = parser.add_subparsers(help='commands', dest='action', title="Commands")
+
+    run_parser = subparsers.add_parser('run', help='Runs benchmarks and stores the results')
+    run_parser.add_argument('-o', '--output', default=None, help='Store results to a JSON file')
+    run_parser.add_argument('-s', '--suite', action='append', choices=SUITES, default=None, help='Run only the given suite, can be repeated')
+    run_parser.add_argument('-k', '--select', action='append', default=None, help='Run only cases matching a pattern, e.g. "operations.native.*/200x200", can be repeated')
+    run_parser.add_argument('--sizes', default=",".join("%dx%d" % size for size in SIZES), help='Panel sizes, defaults to %(default)s')
+    run_parser.add_argument('-b', '--backend', action='append', choices=("numpy", "native"), default=None, help='Implementation of pixmod, both by default')
+    run_parser.add_argument('-n', '--frames', type=int, default=50, help='Number of frames rendered for each tile')
+    run_parser.add_argument('-r', '--rounds', type=int, default=1, help='Repeat the whole suite and keep the best times, use more rounds on busy machines')
+    run_parser.add_argument('-c', '--compare', default=None, help='Compare results with a baseline')
+    run_parser.add_argument('-t', '--threshold', type=float, default=0.2, help='Relative slowdown reported as a regression')
+
+    compare_parser = subparsers.add_parser('compare', help='Compares results with a baseline, fails on regressions')
+    compare_parser.add_argument('baseline', help='Results used as the baseline')
+    compare_parser.add_argument('current', help='Results that are compared')
+    compare_parser.add_argument('-t', '--threshold', type=float, default=0.2, help='Relative slowdown reported as a regression')
+
+    args = parser.parse_args()
+
+    if args.action == "run":
+        try:
+            sizes = [tuple(int(v) for v in size.split("x")) for size in args.sizes.split(",")]
+        except ValueError:
+            parser.error("Sizes are given as WxH, separated by commas")
+        results = run(args.suite or SUITES, sizes, args.backend or ("numpy", "native"), args.select, args.frames, args.rounds)
+        if args.output is not None:
+            with open(args.output, "w") as handle:
+                json.dump({"meta": metadata(), "results": results}, handle, indent=2)
+        if args.compare is not None:
+            print()
+            # Only the selected cases are compared
+            if not print_comparison(compare(load(args.compare)["results"], results, args.threshold, False)):
+                sys.exit(1)
+    elif args.action == "compare":
+        if not print_comparison(compare(load(args.baseline)["results"], load(args.current)["results"], args.threshold)):
+            sys.exit(1)
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+
+    main()
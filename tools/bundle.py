@@ -0,0 +1,570 @@
+# Minifies core scripts and tiles and bundles tiles with the core modules they load
+
+import sys
+import os
+import re
+import argparse
+import subprocess
+
+root = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")
+
+KEYWORDS = set(["and", "break", "do", "else", "elseif", "end", "false", "for", "function", "goto", "if",
+    "in", "local", "nil", "not", "or", "repeat", "return", "then", "true", "until", "while"])
+
+OPERATORS = ["...", "..", "==", "~=", "<=", ">=", "//", "::", "<<", ">>", "+", "-", "*", "/", "%", "^",
+    "#", "&", "~", "|", "<", ">", "=", "(", ")", "{", "}", "[", "]", ";", ":", ",", "."]
+
+BINARY = set(["+", "-", "*", "/", "//", "%", "^", "..", "==", "~=", "<", "<=", ">", ">=", "and", "or",
+    "&", "|", "~", "<<", ">>"])
+
+UNARY = set(["-", "not", "#", "~"])
+
+# Global loader functions defined by core/main.lua and the modules they load
+LOADERS = {
+    "load_sprites": "sprites.lua",
+    "load_font": "font.lua"
+}
+
+class LuaError(Exception):
+    pass
+
+class Token():
+
+    def __init__(self, kind, text, line):
+        self.kind = kind
+        self.text = text
+        self.line = line
+        self.binding = None
+
+    def __repr__(self):
+        return "%s(%r)" % (self.kind, self.text)
+
+_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_NUMBER = re.compile(r"0[xX](?:[0-9a-fA-F]*\.?[0-9a-fA-F]*)(?:[pP][+-]?[0-9]+)?|(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?")
+_LONG = re.compile(r"\[(=*)\[")
+_SPACE = re.compile(r"\s+")
+
+def _long_bracket(source, i, line):
+    match = _LONG.match(source, i)
+    if match is None:
+        return None
+    end = source.find("]" + match.group(1) + "]", match.end())
+    if end == -1:
+        raise LuaError("Unfinished long bracket at line %d" % line)
+    return end + len(match.group(1)) + 2
+
+def tokenize(source, comments=False):
+    """Splits Lua source into tokens, comments are dropped unless requested"""
+    tokens = []
+    i = 0
+    line = 1
+    n = len(source)
+
+    while i < n:
+        match = _SPACE.match(source, i)
+        if match:
+            line += source.count("\n", i, match.end())
+            i = match.end()
+            continue
+
+        start = i
+
+        if source.startswith("--", i):
+            end = _long_bracket(source, i + 2, line)
+            if end is None:
+                end = source.find("\n", i)
+                end = n if end == -1 else end
+            if comments:
+                tokens.append(Token("comment", source[start:end], line))
+            line += source.count("\n", start, end)
+            i = end
+            continue
+
+        c = source[i]
+
+        if c == "[" and _LONG.match(source, i):
+            end = _long_bracket(source, i, line)
+            tokens.append(Token("string", source[start:end], line))
+            line += source.count("\n", start, end)
+            i = end
+            continue
+
+        if c in "\"'":
+            i += 1
+            while i < n and source[i] != c:
+                if source[i] == "\\":
+                    i += 1
+                elif source[i] == "\n":
+                    raise LuaError("Unfinished string at line %d" % line)
+                i += 1
+            if i >= n:
+                raise LuaError("Unfinished string at line %d" % line)
+            i += 1
+            tokens.append(Token("string", source[start:i], line))
+            line += source.count("\n", start, i)
+            continue
+
+        match = _NAME.match(source, i)
+        if match:
+            text = match.group(0)
+            tokens.append(Token("keyword" if text in KEYWORDS else "name", text, line))
+            i = match.end()
+            continue
+
+        match = _NUMBER.match(source, i)
+        if match:
+            # Lua reads letters and dots directly following a number as part of it
+            end = match.end()
+            while end < n and (source[end].isalnum() or source[end] in "_."):
+                end += 1
+            tokens.append(Token("number", source[start:end], line))
+            i = end
+            continue
+
+        for operator in OPERATORS:
+            if source.startswith(operator, i):
+                tokens.append(Token("op", operator, line))
+                i += len(operator)
+                break
+        else:
+            raise LuaError("Unexpected character %r at line %d" % (c, line))
+
+    tokens.append(Token("eof", "", line))
+    return tokens
+
+class Declaration():
+
+    def __init__(self, name, slot, fixed=False):
+        self.name = name
+        self.slot = slot
+        self.fixed = fixed
+
+class Parser():
+    """Recursive descent parser that only resolves names, every name token that refers to a local
+    variable is bound to its declaration. Names of globals are collected."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+        self.scopes = []
+        self.globals = set()
+        self.declarations = []
+
+    @property
+    def token(self):
+        return self.tokens[self.position]
+
+    def peek(self, offset=1):
+        return self.tokens[min(self.position + offset, len(self.tokens) - 1)]
+
+    def check(self, text, kind=None):
+        token = self.token
+        return token.text == text and token.kind in ((kind, ) if kind else ("op", "keyword"))
+
+    def accept(self, text):
+        if self.check(text):
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, text):
+        if not self.accept(text):
+            raise LuaError("Expected '%s' near '%s' at line %d" % (text, self.token.text, self.token.line))
+
+    def name(self):
+        token = self.token
+        if token.kind != "name":
+            raise LuaError("Expected name near '%s' at line %d" % (token.text, token.line))
+        self.position += 1
+        return token
+
+    def open(self):
+        self.scopes.append([])
+
+    def close(self):
+        self.scopes.pop()
+
+    def declare(self, token, fixed=False):
+        slot = sum(len(scope) for scope in self.scopes)
+        declaration = Declaration(token.text, slot, fixed)
+        self.scopes[-1].append(declaration)
+        self.declarations.append(declaration)
+        token.binding = declaration
+
+    def reference(self, token):
+        for scope in reversed(self.scopes):
+            for declaration in reversed(scope):
+                if declaration.name == token.text:
+                    token.binding = declaration
+                    return
+        self.globals.add(token.text)
+
+    def chunk(self):
+        self.open()
+        self.block()
+        self.close()
+        if self.token.kind != "eof":
+            raise LuaError("Unexpected '%s' at line %d" % (self.token.text, self.token.line))
+
+    def block_end(self):
+        token = self.token
+        return token.kind == "eof" or (token.kind == "keyword" and token.text in ("end", "else", "elseif", "until"))
+
+    def block(self):
+        while not self.block_end():
+            if self.check("return"):
+                self.position += 1
+                if not self.block_end() and not self.check(";"):
+                    self.explist()
+                self.accept(";")
+                return
+            self.statement()
+
+    def scoped_block(self):
+        self.open()
+        self.block()
+        self.close()
+
+    def statement(self):
+        if self.accept(";") or self.accept("break"):
+            return
+        if self.accept("::"):
+            self.name()
+            self.expect("::")
+        elif self.accept("goto"):
+            self.name()
+        elif self.accept("do"):
+            self.scoped_block()
+            self.expect("end")
+        elif self.accept("while"):
+            self.expression()
+            self.expect("do")
+            self.scoped_block()
+            self.expect("end")
+        elif self.accept("repeat"):
+            # The condition can see the locals of the body
+            self.open()
+            self.block()
+            self.expect("until")
+            self.expression()
+            self.close()
+        elif self.accept("if"):
+            self.expression()
+            self.expect("then")
+            self.scoped_block()
+            while self.accept("elseif"):
+                self.expression()
+                self.expect("then")
+                self.scoped_block()
+            if self.accept("else"):
+                self.scoped_block()
+            self.expect("end")
+        elif self.accept("for"):
+            names = [self.name()]
+            if self.accept("="):
+                self.expression()
+                self.expect(",")
+                self.expression()
+                if self.accept(","):
+                    self.expression()
+            else:
+                while self.accept(","):
+                    names.append(self.name())
+                self.expect("in")
+                self.explist()
+            self.expect("do")
+            self.open()
+            for name in names:
+                self.declare(name)
+            self.scoped_block()
+            self.close()
+            self.expect("end")
+        elif self.accept("function"):
+            self.reference(self.name())
+            method = False
+            while self.check(".") or self.check(":"):
+                method = self.check(":")
+                self.position += 1
+                self.name()
+                if method:
+                    break
+            self.body(method)
+        elif self.accept("local"):
+            if self.accept("function"):
+                self.declare(self.name())
+                self.body(False)
+            else:
+                names = [self.name()]
+                self.attribute()
+                while self.accept(","):
+                    names.append(self.name())
+                    self.attribute()
+                if self.accept("="):
+                    self.explist()
+                for name in names:
+                    self.declare(name)
+        else:
+            self.suffixed()
+            if self.check("=") or self.check(","):
+                while self.accept(","):
+                    self.suffixed()
+                self.expect("=")
+                self.explist()
+
+    def attribute(self):
+        if self.check("<") and self.peek().kind == "name" and self.peek(2).text == ">":
+            self.position += 3
+
+    def body(self, method):
+        self.open()
+        if method:
+            self.declare(Token("name", "self", self.token.line), True)
+        self.expect("(")
+        if not self.check(")"):
+            while True:
+                if self.accept("..."):
+                    break
+                self.declare(self.name())
+                if not self.accept(","):
+                    break
+        self.expect(")")
+        self.block()
+        self.close()
+        self.expect("end")
+
+    def explist(self):
+        self.expression()
+        while self.accept(","):
+            self.expression()
+
+    def expression(self):
+        self.operand()
+        while self.token.text in BINARY and self.token.kind in ("op", "keyword"):
+            self.position += 1
+            self.operand()
+
+    def operand(self):
+        while self.token.text in UNARY and self.token.kind in ("op", "keyword"):
+            self.position += 1
+        self.simple()
+
+    def simple(self):
+        token = self.token
+        if token.kind in ("number", "string") or (token.kind == "keyword" and token.text in ("nil", "true", "false")):
+            self.position += 1
+        elif self.accept("..."):
+            pass
+        elif self.accept("function"):
+            self.body(False)
+        elif self.check("{"):
+            self.table()
+        else:
+            self.suffixed()
+
+    def primary(self):
+        if self.accept("("):
+            self.expression()
+            self.expect(")")
+        else:
+            self.reference(self.name())
+
+    def suffixed(self):
+        self.primary()
+        while True:
+            if self.accept("."):
+                self.name()
+            elif self.accept("["):
+                self.expression()
+                self.expect("]")
+            elif self.accept(":"):
+                self.name()
+                self.arguments()
+            elif self.check("(") or self.check("{") or self.token.kind == "string":
+                self.arguments()
+            else:
+                return
+
+    def arguments(self):
+        if self.token.kind == "string":
+            self.position += 1
+        elif self.check("{"):
+            self.table()
+        else:
+            self.expect("(")
+            if not self.check(")"):
+                self.explist()
+            self.expect(")")
+
+    def table(self):
+        self.expect("{")
+        while not self.check("}"):
+            if self.accept("["):
+                self.expression()
+                self.expect("]")
+                self.expect("=")
+                self.expression()
+            elif self.token.kind == "name" and self.peek().text == "=" and self.peek().kind == "op":
+                self.position += 2
+                self.expression()
+            else:
+                self.expression()
+            if not self.accept(",") and not self.accept(";"):
+                break
+        self.expect("}")
+
+def _names(reserved):
+    """Generates short variable names that are not keywords or reserved names"""
+    first = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_"
+    rest = first + "0123456789"
+    length = 1
+    while True:
+        indices = [0] * length
+        while True:
+            name = first[indices[0]] + "".join(rest[i] for i in indices[1:])
+            if name not in KEYWORDS and name not in reserved:
+                yield name
+            position = length - 1
+            while position >= 0:
+                indices[position] += 1
+                if indices[position] < (len(first) if position == 0 else len(rest)):
+                    break
+                indices[position] = 0
+                position -= 1
+            if position < 0:
+                break
+        length += 1
+
+def _separated(left, right):
+    """Checks if two tokens need a space between them to be read back the same"""
+    try:
+        tokens = tokenize(left + right)
+    except LuaError:
+        return True
+    return len(tokens) != 3 or tokens[0].text != left or tokens[1].text != right
+
+def minify(source, rename=True):
+    """Removes comments and whitespace and optionally renames local variables to short names"""
+    tokens = tokenize(source)
+
+    if rename:
+        parser = Parser(tokens)
+        parser.chunk()
+        # Locals that keep their names must not be shadowed by renamed ones either
+        reserved = set(parser.globals) | set(d.name for d in parser.declarations if d.fixed)
+        generator = _names(reserved)
+        slots = []
+        for token in tokens:
+            if token.kind == "name" and token.binding is not None and not token.binding.fixed:
+                while len(slots) <= token.binding.slot:
+                    slots.append(next(generator))
+                token.text = slots[token.binding.slot]
+
+    output = []
+    previous = None
+    for token in tokens[:-1]:
+        if previous is not None and _separated(previous.text, token.text):
+            output.append(" ")
+        output.append(token.text)
+        previous = token
+
+    return "".join(output)
+
+def dependencies(source):
+    """Returns the core modules that are loaded by a tile through the global loader functions"""
+    parser = Parser(tokenize(source))
+    parser.chunk()
+    return [module for loader, module in LOADERS.items() if loader in parser.globals]
+
+def bundle(source, core):
+    """Prepends the core modules used by a tile as local loader functions, so that the tile is loaded
+    with a single require on the device"""
+    prelude = []
+    for loader, module in LOADERS.items():
+        if module not in dependencies(source):
+            continue
+        with open(os.path.join(core, module), "r") as handle:
+            prelude.append("local function %s()\n%s\nend\n" % (loader, handle.read()))
+    return "".join(prelude) + source
+
+def build(output, rename=True, luac=None, select=None):
+    """Minifies core scripts and bundled tiles into the output directory using their device names,
+    returns a list of (name, original size, minified size, compiled size) tuples"""
+    core = os.path.join(root, "core")
+    tiles = os.path.join(root, "tiles")
+
+    sources = {}
+
+    for e in sorted(os.listdir(core)):
+        if e.endswith(".lua"):
+            with open(os.path.join(core, e), "r") as handle:
+                sources[e] = (handle.read(), None)
+
+    for e in sorted(os.listdir(tiles)):
+        path = os.path.join(tiles, e, "main.lua")
+        if not os.path.isfile(path) or (select is not None and e not in select):
+            continue
+        with open(path, "r") as handle:
+            sources["tile_%s.lua" % e] = (handle.read(), core)
+
+    os.makedirs(output, exist_ok=True)
+
+    report = []
+
+    for name, (source, modules) in sources.items():
+        original = len(source.encode("utf-8"))
+        if modules is not None:
+            original += sum(os.path.getsize(os.path.join(modules, m)) for m in dependencies(source))
+            source = bundle(source, modules)
+        try:
+            content = minify(source, rename)
+        except LuaError as e:
+            raise LuaError("%s: %s" % (name, e))
+        destination = os.path.join(output, name)
+        with open(destination, "w") as handle:
+            handle.write(content)
+        compiled = None
+        # Boot script has to stay in source form
+        if luac is not None and name != "init.lua":
+            compiled = os.path.splitext(destination)[0] + ".lc"
+            subprocess.run([luac, "-o", compiled, destination], check=True)
+            compiled = os.path.getsize(compiled)
+        report.append((name, original, len(content.encode("utf-8")), compiled))
+
+    return report
+
+def print_report(report):
+    print("%-24s %8s %8s %6s %8s" % ("File", "Source", "Minified", "Ratio", "Compiled"))
+    for name, original, minified, compiled in report:
+        print("%-24s %8d %8d %5.0f%% %8s" % (name, original, minified, 100.0 * minified / original,
+            "-" if compiled is None else compiled))
+    original = sum(r[1] for r in report)
+    minified = sum(r[2] for r in report)
+    print("%-24s %8d %8d %5.0f%%" % ("Total", original, minified, 100.0 * minified / original))
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Minifies and bundles core scripts and tiles', prog="bundle")
+    parser.add_argument('-o', '--output', default=os.path.join(root, "build"), help='Output directory')
+    parser.add_argument('--no-rename', default=False, action='store_true', help='Keep names of local variables')
+    parser.add_argument('--luac', default=None, help='Cross compiler used to produce .lc files (luac.cross from the firmware build)')
+    parser.add_argument('tiles', nargs='*', help='Limit to the given tiles')
+
+    args = parser.parse_args()
+
+    luac = args.luac
+    if luac is None and "NODEMCU_FIRMWARE_SOURCE" in os.environ:
+        candidate = os.path.join(os.environ["NODEMCU_FIRMWARE_SOURCE"], "luac.cross")
+        if os.path.isfile(candidate):
+            luac = candidate
+
+    try:
+        report = build(args.output, not args.no_rename, luac, args.tiles if args.tiles else None)
+    except (LuaError, subprocess.CalledProcessError) as e:
+        print(e)
+        sys.exit(-1)
+
+    print_report(report)
+
+if __name__ == '__main__':
+
+    main()
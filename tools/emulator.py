@@ -4,11 +4,30 @@
 import sys
 import os
 import random
+import re
 import json
+import time
+import types
+import socket
+import struct
+import threading
+import collections
+import urllib.parse
+import http.server
 import requests
+import requests.adapters
 import concurrent.futures
 import traceback
 import typing
+import weakref
+import contextlib
+import heapq
+import mmap
+import shutil
+import hashlib
+import base64
+import select
+import tempfile
 
 import cv2 as cv
 import numpy as np
@@ -27,13 +46,116 @@ def exception_printer(func):
             raise e
     return inner_function
 
+class MemoryBudgetError(Exception):
+    """Raised when a tile uses more memory than the device budget"""
+    pass
+
+class Memory():
+    """Estimates the heap a tile would use on the device: the Lua heap above the baseline of the emulator,
+    pixel buffers (NumPy arrays here, Lua userdata on the device) and open file handles. Lua heap sizes of
+    the emulator and NodeMCU differ somewhat and Lupa allocates wrappers for calls into the emulated modules,
+    so the numbers are an approximation."""
+
+    # Heap used by an open file handle (SPIFFS descriptor and Lua userdata)
+    FILE_BYTES = 128
+    # Free heap reported by node.heap() if there is no budget, about what is left after boot on an ESP8266
+    HEAP = 40 * 1024
+
+    def __init__(self, lua, budget=None) -> None:
+        self._count = lua.eval('function() return collectgarbage("count") end')
+        # Userdata of Python objects is finalized in the first cycle and freed in the second one
+        self._collect = lua.eval('function(restart) collectgarbage("collect") collectgarbage("collect") if restart then collectgarbage("restart") end end')
+        self._stop = lua.eval('function() collectgarbage("stop") end')
+        self._baseline = 0
+        self._start = None
+        self._allocated = 0
+        self.budget = budget
+        self.buffers = 0
+        self.files = 0
+        self.peak = 0
+        self.peak_files = 0
+        self.frames = []
+
+    def baseline(self):
+        """Sets the current Lua heap size as the baseline, everything allocated afterwards is counted"""
+        self._collect(False)
+        self._baseline = self._count() * 1024
+
+    @contextlib.contextmanager
+    def excluded(self):
+        """Adds memory allocated by the emulator itself inside the block to the baseline"""
+        self._collect(False)
+        before = self._count()
+        yield
+        self._collect(False)
+        self._baseline += (self._count() - before) * 1024
+
+    def used(self):
+        return max(0, int(self._count() * 1024 - self._baseline)) + self.buffers + self.files * Memory.FILE_BYTES
+
+    def collect(self):
+        """Runs a full collection, unless the collector is stopped to count the allocations of a frame"""
+        if self._start is None:
+            self._collect(True)
+
+    def buffer(self, buffer):
+        size = buffer._buffer.nbytes
+        self.buffers += size
+        self._allocated += size
+        weakref.finalize(buffer, self._release, size)
+        return buffer
+
+    def _release(self, size):
+        self.buffers -= size
+
+    def file(self, file):
+        self.files += 1
+        self.peak_files = max(self.peak_files, self.files)
+        # Handles that are never closed are closed when they are collected, as on the device
+        file._closed = weakref.finalize(file, self._close)
+        return file
+
+    def _close(self):
+        self.files -= 1
+
+    def begin_frame(self):
+        """Stops the garbage collector, so that everything a frame allocates can be counted"""
+        self._stop()
+        self._start = self._count()
+        self._allocated = 0
+
+    def end_frame(self):
+        """Records the bytes allocated by the frame and the memory left in use after a full collection,
+        raises MemoryBudgetError if that exceeds the budget"""
+        self.frames.append((max(0, int((self._count() - self._start) * 1024)), self._allocated))
+        self._collect(True)
+        self._start = None
+        used = self.used()
+        self.peak = max(self.peak, used)
+        if self.budget is not None and used > self.budget:
+            raise MemoryBudgetError("%d bytes in use after frame %d, the budget is %d bytes" % (used, len(self.frames), self.budget))
+
+    def report(self):
+        totals = [heap + buffers for heap, buffers in self.frames]
+        return {
+            "memory": self.peak,
+            "allocated": max(totals) if totals else 0,
+            "mean_allocated": sum(totals) / len(totals) if totals else 0,
+            "buffers_allocated": max(buffers for _, buffers in self.frames) if self.frames else 0,
+            "files": self.peak_files
+        }
+
 class Environment():
 
-    def __init__(self, root, search=None) -> None:
+    def __init__(self, root, search=None, storage=None) -> None:
         self._lua = LuaRuntime(unpack_returned_tuples=True, encoding=None)
         self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=5)
         self._root = root
         self._search = search if search is not None else []
+        self._storage = storage
+        self._pending = collections.deque()
+        self._memory = Memory(self._lua)
+        self._resources = []
 
     @property
     def lua(self) -> LuaRuntime:
@@ -47,55 +169,755 @@ class Environment():
     def search(self) -> typing.List[str]:
         return self._search
 
+    @property
+    def storage(self) -> typing.Optional[str]:
+        """Directory that files opened for writing are stored to, None if the file system is read-only"""
+        return self._storage
+
     @property
     def executor(self) -> concurrent.futures.ThreadPoolExecutor:
         return self._executor
 
+    @property
+    def memory(self) -> Memory:
+        return self._memory
+
+    def schedule(self, function, *args):
+        """Queues a call from a background thread, Lua callbacks have to be run from the main loop"""
+        self._pending.append((function, args))
+
+    def dispatch(self):
+        """Runs queued calls, called by the main loop between frames"""
+        while self._pending:
+            function, args = self._pending.popleft()
+            function(*args)
+
+    def register(self, resource):
+        """Keeps track of a resource, e.g. a socket, that is closed together with the environment"""
+        self._resources.append(resource)
+        return resource
+
+    def close(self):
+        """Closes registered resources, so that another environment can use them"""
+        for resource in self._resources:
+            resource.close()
+        self._resources.clear()
+        self._executor.shutdown(wait=False)
+
 class Module():
 
     def __init__(self, environment: Environment) -> None:
         self.environment = environment
 
-class Node(Module):
+class EGC(Module):
+    """The node.egc submodule, reports the estimated device heap usage of the tile"""
+
+    NOT_ACTIVE = 0
+    ON_ALLOC_FAILURE = 1
+    ON_MEM_LIMIT = 2
+    ALWAYS = 4
 
     def __init__(self, environment: Environment) -> None:
         super().__init__(environment)
 
+    def setmode(self, mode, limit=0):
+        pass
+
+    def meminfo(self):
+        used = self.environment.memory.used()
+        return used, used
+
+class Node(Module):
+    """The node module. The boot reason is given as the raw code and the extended reason (1 and 0 after power-on),
+    a restart requested by a script is carried out by the Device after the current callback."""
+
+    def __init__(self, environment: Environment, reason=(1, 0)) -> None:
+        super().__init__(environment)
+        self.egc = EGC(environment)
+        self.reason = reason
+        self.onerror = None
+        self.restarting = False
+
     def random(self, a, b):
         return random.randint(a, b)  
 
+    def heap(self):
+        memory = self.environment.memory
+        # The firmware collects garbage before allocating, the heap it reports holds no garbage
+        memory.collect()
+        return (memory.budget if memory.budget is not None else Memory.HEAP) - memory.used()
+
+    def bootreason(self):
+        return self.reason
+
+    def chipid(self):
+        return 0x2020
+
+    def setonerror(self, handler=None):
+        self.onerror = handler
+
+    def restart(self):
+        self.restarting = True
+
+class Clock():
+    """Virtual time of an emulated device in milliseconds. Calls are queued with a delay and run in the order of
+    their deadlines as the clock advances, which does not have to keep up with real time."""
+
+    def __init__(self) -> None:
+        self.now = 0
+        self._queue = []
+        self._sequence = 0
+
+    def call(self, delay, function, *args):
+        # The sequence number keeps calls with the same deadline in the order they were queued
+        self._sequence += 1
+        heapq.heappush(self._queue, (self.now + max(0, delay), self._sequence, function, args))
+
+    def next(self):
+        """Returns the deadline of the next queued call or None if there are none"""
+        return self._queue[0][0] if self._queue else None
+
+    def advance(self):
+        """Moves the clock to the next queued call and returns the function and its arguments"""
+        deadline, _, function, args = heapq.heappop(self._queue)
+        self.now = max(self.now, deadline)
+        return function, args
+
+    def clear(self):
+        self._queue.clear()
+
+class Timer():
+    """Timer object returned by tmr.create(), stopping it invalidates calls that are already queued"""
+
+    def __init__(self, clock: Clock) -> None:
+        self._clock = clock
+        self._interval = 0
+        self._mode = Tmr.ALARM_SINGLE
+        self._callback = None
+        self._running = False
+        self._token = 0
+
+    def register(self, interval, mode, callback):
+        self.stop()
+        self._interval, self._mode, self._callback = interval, mode, callback
+
+    def alarm(self, interval, mode, callback):
+        self.register(interval, mode, callback)
+        return self.start()
+
+    def start(self):
+        if self._callback is None:
+            return False
+        self.stop()
+        self._running = True
+        # Intervals below a millisecond would stop the clock
+        self._clock.call(max(1, self._interval), self._fire, self._token)
+        return True
+
+    def stop(self):
+        running = self._running
+        self._running = False
+        self._token += 1
+        return running
+
+    def unregister(self):
+        self.stop()
+        self._callback = None
+
+    def interval(self, interval):
+        self._interval = interval
+        if self._running:
+            self.start()
+
+    def state(self):
+        if self._callback is None:
+            return None
+        return self._running, self._mode
+
+    def _fire(self, token):
+        if token != self._token:
+            return
+        callback = self._callback
+        if self._mode == Tmr.ALARM_AUTO:
+            # Queued before the callback runs, so that the callback can stop the timer
+            self._clock.call(max(1, self._interval), self._fire, self._token)
+        else:
+            self._running = False
+        if self._mode == Tmr.ALARM_SINGLE:
+            self._callback = None
+        callback(self)
+
+class Tmr(Module):
+    """The tmr module driven by a virtual clock, the microsecond counter wraps around like the one of the device"""
+
+    ALARM_SINGLE = 0
+    ALARM_SEMI = 1
+    ALARM_AUTO = 2
+
+    def __init__(self, environment: Environment, clock: Clock) -> None:
+        super().__init__(environment)
+        self._clock = clock
+        self._boot = clock.now
+
+    def create(self):
+        return Timer(self._clock)
+
+    def now(self):
+        return int((self._clock.now - self._boot) * 1000) & 0x7FFFFFFF
+
+    def time(self):
+        return int((self._clock.now - self._boot) / 1000)
+
+    def delay(self, us):
+        # Busy waiting blocks everything else on the device
+        self._clock.now += us / 1000
+
+    def wdclr(self):
+        pass
+
 class HTTP(Module):
+    """HTTP client that shares one pooled session, caches successful GET responses for a limited time and joins
+    identical requests that are already in progress. Requests for hosts listed in routes are sent to the given
+    base URL instead, e.g. to a local FixtureServer."""
 
-    def __init__(self, environment: Environment) -> None:
+    def __init__(self, environment: Environment, ttl=60, routes=None) -> None:
         super().__init__(environment)
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._ttl = ttl
+        self._routes = routes if routes is not None else {}
+        self._cache = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
 
     # http.get(url, headers, callback)
 
     def get(self, url, headers, callback):
         self.request(url, b"GET", headers, b"", callback)
 
+    # http.post(url, headers, body, callback)
+
+    def post(self, url, headers, body, callback):
+        self.request(url, b"POST", headers, body, callback)
+
+    # http.put(url, headers, body, callback)
+
+    def put(self, url, headers, body, callback):
+        self.request(url, b"PUT", headers, body, callback)
+
+    # http.delete(url, headers, body, callback)
+
+    def delete(self, url, headers, body, callback):
+        self.request(url, b"DELETE", headers, body, callback)
+
     # http.request(url, method, headers, body, callback)
 
     def request(self, url, method, headers, body, callback):
+        # Headers are given as a string of lines in the "Name: value" form
+        fields = {}
         if headers is not None:
-            headers = headers.decode("ascii").split("\n\r")
-        else:
-            headers = {}
+            for line in headers.decode("ascii").splitlines():
+                if ":" in line:
+                    key, value = line.split(":", 1)
+                    fields[key.strip()] = value.strip()
 
         url = url.decode("ascii")
-        method = method.decode("ascii")
+        method = method.decode("ascii").upper()
+        body = body if body else None
+
+        key = (method, url, tuple(sorted(fields.items())), body)
+        cacheable = method in ("GET", "HEAD")
+
+        with self._lock:
+            if cacheable and key in self._cache:
+                expires, result = self._cache[key]
+                if expires > time.monotonic():
+                    self.environment.schedule(self._deliver, callback, result)
+                    return
+                del self._cache[key]
+
+            future = self._inflight.get(key) if cacheable else None
+            started = future is None
+            if started:
+                future = self.environment.executor.submit(self._fetch, method, url, fields, body)
+                if cacheable:
+                    self._inflight[key] = future
+
+        # Callbacks of a finished future run right away, so they are added without holding the lock
+        if started and cacheable:
+            future.add_done_callback(lambda f: self._complete(key, f))
+        future.add_done_callback(lambda f: self.environment.schedule(self._finish, callback, f))
+
+    def _resolve(self, url):
+        parts = urllib.parse.urlsplit(url)
+        if parts.netloc in self._routes:
+            base = urllib.parse.urlsplit(self._routes[parts.netloc])
+            parts = parts._replace(scheme=base.scheme, netloc=base.netloc, path=base.path.rstrip("/") + parts.path)
+        return urllib.parse.urlunsplit(parts)
+
+    def _fetch(self, method, url, headers, body):
+        response = self._session.request(method, self._resolve(url), headers=headers, data=body, timeout=10)
+        return response.status_code, response.content, {k.lower(): v for k, v in response.headers.items()}
+
+    def _complete(self, key, future):
+        with self._lock:
+            self._inflight.pop(key, None)
+            if future.exception() is None and 200 <= future.result()[0] < 300:
+                self._cache[key] = (time.monotonic() + self._ttl, future.result())
+
+    def _finish(self, callback, future):
+        if future.exception() is not None:
+            print("Request failed: %s" % future.exception())
+            callback(-1, None, None)
+            return
+        self._deliver(callback, future.result())
+
+    def _deliver(self, callback, result):
+        status, content, headers = result
+        headers = self.environment.lua.table_from({k.encode("ascii"): v.encode("ascii", "replace") for k, v in headers.items()})
+        callback(status, content, headers)
+
+class FixtureServer():
+    """Local HTTP server that stands in for remote hosts. Responses are read from files stored in a directory per
+    host, e.g. fixtures/api.open-meteo.com/v1/forecast.json answers requests for /v1/forecast. Handlers can be
+    registered for individual paths, they receive the method, path, query, headers and body and return a status,
+    content and content type."""
+
+    def __init__(self, directory=None) -> None:
+        self._directory = directory if directory is not None else os.path.join(root, "tools", "fixtures")
+        self._handlers = {}
+
+        fixtures = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def handle_request(self):
+                fixtures._respond(self)
+
+            do_GET = do_HEAD = do_POST = do_PUT = do_DELETE = handle_request
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self) -> str:
+        return "http://127.0.0.1:%d" % self._server.server_address[1]
+
+    def route(self, host, path, handler):
+        self._handlers[(host, path)] = handler
+
+    def routes(self):
+        """Returns routes for the HTTP module, covering all hosts with fixtures or handlers"""
+        hosts = set(host for host, _ in self._handlers)
+        if os.path.isdir(self._directory):
+            hosts.update(e for e in os.listdir(self._directory) if os.path.isdir(os.path.join(self._directory, e)))
+        return {host: "%s/%s" % (self.url, host) for host in hosts}
+
+    def _respond(self, request):
+        parts = urllib.parse.urlsplit(request.path)
+        host, _, path = parts.path.lstrip("/").partition("/")
+        path = "/" + path
+        length = int(request.headers.get("Content-Length", 0))
+        body = request.rfile.read(length) if length > 0 else b""
+
+        status, content, content_type = 404, b"", "text/plain"
+
+        if (host, path) in self._handlers:
+            status, content, content_type = self._handlers[(host, path)](request.command, path, parts.query, dict(request.headers), body)
+        else:
+            base = os.path.realpath(os.path.join(self._directory, host))
+            filename = os.path.realpath(os.path.join(base, path.lstrip("/")))
+            if filename.startswith(base + os.sep):
+                for candidate in (filename, filename + ".json"):
+                    if os.path.isfile(candidate):
+                        with open(candidate, "rb") as handle:
+                            content = handle.read()
+                        status = 200
+                        content_type = "application/json" if candidate.endswith(".json") else "application/octet-stream"
+                        break
+
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(content)))
+        request.end_headers()
+        if request.command != "HEAD":
+            request.wfile.write(content)
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+class Socket():
+    """Base of emulated net sockets. Data is received in a background thread and events are passed to the Lua
+    callbacks from the main loop."""
+
+    def __init__(self, environment: Environment, handle) -> None:
+        self._environment = environment
+        self._handle = handle
+        self._callbacks = {}
+        self._closed = False
+        self._thread = None
+        environment.register(self)
+
+    def on(self, event, callback):
+        self._callbacks[event] = callback
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            # Wakes up the background thread, the port is only released once it stops using the socket
+            try:
+                self._handle.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            if self._thread is not None and self._thread is not threading.current_thread():
+                self._thread.join()
+            self._handle.close()
+
+    def _emit(self, event, *args):
+        callback = self._callbacks.get(event)
+        if callback is not None:
+            callback(self, *args)
+
+    def _start(self, target):
+        self._handle.settimeout(0.5)
+        self._thread = threading.Thread(target=target, daemon=True)
+        self._thread.start()
+
+class UDPSocket(Socket):
+
+    def __init__(self, environment: Environment) -> None:
+        super().__init__(environment, socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
+        self._handle.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    # udp:listen([port], [ip])
+
+    def listen(self, port=0, ip=None):
+        self._handle.bind((ip.decode("ascii") if ip else "0.0.0.0", port))
+        self._start(self._receive)
+
+    # udp:send(port, ip, data)
+
+    def send(self, port, ip, data):
+        self._handle.sendto(data, (ip.decode("ascii"), port))
 
-        @exception_printer
-        def handle():
-            session = requests.Session()
-            response = session.get(url)
-            #request = session.request(method, url, headers=headers)
-            #response = session.send(request.prepare(), stream=False)
-            headers = "\n\r".join(["%s: %s" % (k, v) for k, v in response.headers.items()]).encode("ascii")
-            callback(response.status_code, response.content, headers)
-  
-        self.environment.executor.submit(handle)
+    def _receive(self):
+        while not self._closed:
+            try:
+                data, (ip, port) = self._handle.recvfrom(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            self._environment.schedule(self._emit, b"receive", data, port, ip.encode("ascii"))
+
+class TCPSocket(Socket):
+
+    def __init__(self, environment: Environment, handle) -> None:
+        super().__init__(environment, handle)
+        self._start(self._receive)
+
+    def send(self, data):
+        self._handle.sendall(data)
+
+    def _receive(self):
+        while not self._closed:
+            try:
+                data = self._handle.recv(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                data = b""
+            if len(data) == 0:
+                self._environment.schedule(self._emit, b"disconnection")
+                return
+            self._environment.schedule(self._emit, b"receive", data)
+
+class TCPServer(Socket):
+
+    def __init__(self, environment: Environment) -> None:
+        super().__init__(environment, socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+        self._handle.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    # server:listen([port], [ip], function(socket))
+
+    def listen(self, *args):
+        callback = args[-1]
+        port = args[0] if len(args) > 1 else 0
+        ip = args[1].decode("ascii") if len(args) > 2 else "0.0.0.0"
+        self._handle.bind((ip, port))
+        self._handle.listen()
+        self._start(lambda: self._accept(callback))
+
+    def _accept(self, callback):
+        while not self._closed:
+            try:
+                handle, _ = self._handle.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            self._environment.schedule(self._connected, callback, handle)
+
+    def _connected(self, callback, handle):
+        # Callbacks for the connection are registered before any data is passed to them
+        callback(TCPSocket(self._environment, handle))
+
+class Net(Module):
+    """The net module, limited to a UDP socket and a TCP server that receive data in the background"""
 
+    TCP = 1
+    UDP = 2
+
+    def __init__(self, environment: Environment) -> None:
+        super().__init__(environment)
+
+    def createUDPSocket(self):
+        return UDPSocket(self.environment)
+
+    def createServer(self, type=TCP, timeout=None):
+        return TCPServer(self.environment)
+
+class WS2812(Module):
+    """The ws2812 module, written buffers are passed to a callback"""
+
+    def __init__(self, environment: Environment, write) -> None:
+        super().__init__(environment)
+        self._write = write
+
+    def init(self, mode=None):
+        pass
+
+    def write(self, buffer):
+        self._write(buffer)
+
+class Station():
+    """The wifi.sta submodule. Connecting succeeds if the configured SSID is the one of the emulated access
+    point, otherwise a disconnection is reported after every attempt until wifi.sta.disconnect() is called."""
+
+    IDLE = 0
+    CONNECTING = 1
+    APNOTFOUND = 3
+    GOTIP = 5
+
+    # Virtual time it takes to associate, to get an address and to give up looking for the access point
+    ASSOCIATE = 1000
+    DHCP = 500
+    RETRY = 3000
+
+    def __init__(self, wifi) -> None:
+        self._wifi = wifi
+        self._ssid = None
+        self._status = Station.IDLE
+        self._token = 0
+
+    def config(self, table):
+        self._ssid = table[b"ssid"]
+        if table[b"auto"] is not False:
+            self.connect()
+        return True
+
+    def connect(self):
+        if self._ssid is None:
+            return
+        self._token += 1
+        self._status = Station.CONNECTING
+        self._attempt(self._token)
+
+    def disconnect(self):
+        connected = self._status == Station.GOTIP
+        self._token += 1
+        self._status = Station.IDLE
+        if connected:
+            self._wifi.eventmon.emit(EventMonitor.STA_DISCONNECTED, SSID=self._ssid, reason=Wifi.REASONS["ASSOC_LEAVE"])
+
+    def status(self):
+        return self._status
+
+    def getip(self):
+        if self._status != Station.GOTIP:
+            return None
+        return b"192.168.4.20", b"255.255.255.0", b"192.168.4.1"
+
+    def _attempt(self, token):
+        clock = self._wifi.clock
+        if self._ssid == self._wifi.ssid:
+            clock.call(Station.ASSOCIATE, self._connected, token)
+        else:
+            clock.call(Station.RETRY, self._failed, token)
+
+    def _connected(self, token):
+        if token != self._token:
+            return
+        self._wifi.eventmon.emit(EventMonitor.STA_CONNECTED, SSID=self._ssid, BSSID=b"02:00:00:00:20:20", channel=1)
+        self._wifi.clock.call(Station.DHCP, self._addressed, token)
+
+    def _addressed(self, token):
+        if token != self._token:
+            return
+        self._status = Station.GOTIP
+        ip, netmask, gateway = self.getip()
+        self._wifi.eventmon.emit(EventMonitor.STA_GOT_IP, IP=ip, netmask=netmask, gateway=gateway)
+
+    def _failed(self, token):
+        if token != self._token:
+            return
+        self._status = Station.APNOTFOUND
+        # The device keeps trying in the background
+        self._attempt(token)
+        self._wifi.eventmon.emit(EventMonitor.STA_DISCONNECTED, SSID=self._ssid, reason=Wifi.REASONS["NO_AP_FOUND"])
+
+class EventMonitor():
+    """The wifi.eventmon submodule, events are passed to registered callbacks as tables"""
+
+    STA_CONNECTED = 0
+    STA_DISCONNECTED = 1
+    STA_AUTHMODE_CHANGE = 2
+    STA_GOT_IP = 3
+    STA_DHCP_TIMEOUT = 4
+
+    def __init__(self, wifi) -> None:
+        self._wifi = wifi
+        self._callbacks = {}
+        self.reason = wifi.environment.lua.table_from({k.encode("ascii"): v for k, v in Wifi.REASONS.items()})
+
+    def register(self, event, callback=None):
+        self._callbacks[event] = callback
+
+    def unregister(self, event):
+        self._callbacks.pop(event, None)
+
+    def emit(self, event, **values):
+        # Events are delivered from the main loop like on the device, never from within the call causing them
+        self._wifi.clock.call(0, self._deliver, event, values)
+
+    def _deliver(self, event, values):
+        callback = self._callbacks.get(event)
+        if callback is not None:
+            callback(self._wifi.environment.lua.table_from({k.encode("ascii"): v for k, v in values.items()}))
+
+class Wifi(Module):
+    """The wifi module in station mode, connecting and its events follow the virtual clock"""
+
+    NULLMODE = 0
+    STATION = 1
+    SOFTAP = 2
+    STATIONAP = 3
+
+    REASONS = {
+        "UNSPECIFIED": 1, "AUTH_EXPIRE": 2, "AUTH_LEAVE": 3, "ASSOC_EXPIRE": 4, "ASSOC_TOOMANY": 5,
+        "NOT_AUTHED": 6, "NOT_ASSOCED": 7, "ASSOC_LEAVE": 8, "ASSOC_NOT_AUTHED": 9, "BEACON_TIMEOUT": 200,
+        "NO_AP_FOUND": 201, "AUTH_FAIL": 202, "ASSOC_FAIL": 203, "HANDSHAKE_TIMEOUT": 204
+    }
+
+    def __init__(self, environment: Environment, clock: Clock, ssid=None) -> None:
+        super().__init__(environment)
+        self.clock = clock
+        self.ssid = ssid
+        self.mode = Wifi.NULLMODE
+        self.sta = Station(self)
+        self.eventmon = EventMonitor(self)
+
+    def setmode(self, mode, save=True):
+        self.mode = mode
+        return mode
+
+    def getmode(self):
+        return self.mode
+
+class MDNS(Module):
+    """The mdns module, the registered host name is only recorded"""
+
+    def __init__(self, environment: Environment) -> None:
+        super().__init__(environment)
+        self.hostname = None
+
+    def register(self, hostname, attributes=None):
+        self.hostname = hostname
+
+    def close(self):
+        self.hostname = None
+
+class UART(Module):
+    """The uart module of a device with a serial console. Data received while a callback is registered with
+    uart.on("data", ...) is passed to it, the interpreter only gets it as well if run_input is set."""
+
+    def __init__(self, environment: Environment, write) -> None:
+        super().__init__(environment)
+        self._write = write
+        self._pending = bytearray()
+        self.callback = None
+        self.size = 0
+        self.interpret = True
+
+    # uart.on("data", [number or end character], [function], [run_input]), a size of 0 passes every chunk
+
+    def on(self, method, size=0, callback=None, run_input=1):
+        if method != b"data":
+            return
+        self._pending.clear()
+        self.callback = callback
+        self.size = size
+        self.interpret = callback is None or run_input != 0
+
+    def write(self, id, *data):
+        for d in data:
+            self._write(d if isinstance(d, bytes) else bytes([int(d) & 0xFF]))
+
+    def receive(self, data):
+        """Returns the chunks of received data that are due for the callback"""
+        if self.size == 0:
+            return [data]
+        self._pending += data
+        chunks = []
+        while True:
+            if isinstance(self.size, bytes):
+                end = self._pending.find(self.size)
+                end = end + 1 if end >= 0 else 0
+            else:
+                end = self.size if len(self._pending) >= self.size else 0
+            if end == 0:
+                return chunks
+            chunks.append(bytes(self._pending[:end]))
+            del self._pending[:end]
+
+class Crypto(Module):
+    """The crypto module, digests are returned in binary form"""
+
+    def __init__(self, environment: Environment, filesystem) -> None:
+        super().__init__(environment)
+        self._filesystem = filesystem
+
+    def hash(self, algorithm, data):
+        return hashlib.new(algorithm.decode("ascii").lower(), data).digest()
+
+    def fhash(self, algorithm, filename):
+        # Read without opening the file through the module, which would replace the file opened last
+        path = self._filesystem._paths().get(filename)
+        if path is None:
+            return None
+        return self.hash(algorithm, self._filesystem._map(path))
+
+class Encoder(Module):
+    """The encoder module"""
+
+    def toHex(self, data):
+        return data.hex().encode("ascii")
+
+    def fromHex(self, data):
+        return bytes.fromhex(data.decode("ascii"))
+
+    def toBase64(self, data):
+        return base64.b64encode(data)
+
+    def fromBase64(self, data):
+        return base64.b64decode(data)
 
 class JSON(Module):
 
@@ -110,37 +932,221 @@ class JSON(Module):
             return json.dumps(o).encode("ascii")
 
     class JSONDecoder():
+        """Incremental decoder compatible with the sjson module, the input is parsed as it is written and
+        only an unfinished token is kept between writes. Lua tables are built directly. Supported options
+        are depth (maximum nesting, 20 by default), null (value used for null, entries are skipped if not
+        given) and metatable (set on all created tables, its checkpath function is called with every new
+        table and its path and the table is discarded if it returns false)."""
+
+        _SPACE = re.compile(rb"[ \t\r\n]*")
+        _STRING = re.compile(rb'["\\]')
+        _NUMBER = re.compile(rb"[0-9eE+\-.]*")
+        _LITERAL = re.compile(rb"[a-z]*")
+        _ESCAPES = {b'"': '"', b"\\": "\\", b"/": "/", b"b": "\b", b"f": "\f", b"n": "\n", b"r": "\r", b"t": "\t"}
+        _LITERALS = {b"true": True, b"false": False, b"null": None}
+
+        # What the parser is waiting for
+        VALUE, FIRST, KEY, COLON, NEXT, DONE = range(6)
 
         def __init__(self, environment, options):
             self._environment = environment
-            self._buffer = b""
+            self._depth = 20
+            self._null = None
+            self._metatable = None
+            if options is not None:
+                if options[b"depth"] is not None:
+                    self._depth = int(options[b"depth"])
+                self._null = options[b"null"]
+                self._metatable = options[b"metatable"]
+            self._stack = []
+            self._expect = JSON.JSONDecoder.VALUE
+            self._mode = None
+            self._token = bytearray()
+            self._escape = False
+            self._complete = False
+            self._result = None
+
+        def _error(self, message):
+            raise ValueError("JSON error: %s" % message)
+
+        def _open(self, array):
+            if len(self._stack) >= self._depth:
+                self._error("too deeply nested")
+            lua = self._environment.lua
+            table = lua.table()
+            keep = len(self._stack) == 0 or self._stack[-1]["keep"]
+            path = []
+            if self._stack:
+                parent = self._stack[-1]
+                path = parent["path"] + [parent["index"] + 1 if parent["array"] else parent["key"]]
+            if self._metatable is not None:
+                lua.globals().setmetatable(table, self._metatable)
+                checkpath = self._metatable[b"checkpath"]
+                if keep and checkpath is not None:
+                    keep = bool(checkpath(table, lua.table_from(path)))
+            self._stack.append({"table": table, "array": array, "index": 0, "key": None, "path": path, "keep": keep})
+            self._expect = JSON.JSONDecoder.FIRST
+
+        def _close(self, array):
+            if not self._stack or self._stack[-1]["array"] != array:
+                self._error("unexpected %s" % ("]" if array else "}"))
+            frame = self._stack.pop()
+            # An empty container leaves FIRST behind, the finished table is the value of its parent
+            self._expect = JSON.JSONDecoder.VALUE
+            self._value(frame["table"], frame["keep"])
+
+        def _value(self, value, keep=True):
+            if not self._stack:
+                self._result = value if keep else None
+                self._complete = True
+                self._expect = JSON.JSONDecoder.DONE
+                return
+            frame = self._stack[-1]
+            if frame["array"]:
+                frame["index"] += 1
+                key = frame["index"]
+            elif self._expect == JSON.JSONDecoder.KEY or self._expect == JSON.JSONDecoder.FIRST:
+                if not isinstance(value, bytes):
+                    self._error("object keys must be strings")
+                frame["key"] = value
+                self._expect = JSON.JSONDecoder.COLON
+                return
+            else:
+                key = frame["key"]
+            if value is None:
+                value = self._null
+            if keep and frame["keep"] and value is not None:
+                frame["table"][key] = value
+            self._expect = JSON.JSONDecoder.NEXT
+
+        def _string(self, raw):
+            parts = []
+            i = 0
+            while True:
+                j = raw.find(b"\\", i)
+                if j == -1:
+                    parts.append(raw[i:].decode("utf-8"))
+                    break
+                parts.append(raw[i:j].decode("utf-8"))
+                c = raw[j + 1:j + 2]
+                if c == b"u":
+                    code = int(raw[j + 2:j + 6], 16)
+                    j += 6
+                    if 0xD800 <= code < 0xDC00 and raw[j:j + 2] == b"\\u":
+                        code = 0x10000 + ((code - 0xD800) << 10) + (int(raw[j + 2:j + 6], 16) - 0xDC00)
+                        j += 6
+                    parts.append(chr(code))
+                    i = j
+                elif c in JSON.JSONDecoder._ESCAPES:
+                    parts.append(JSON.JSONDecoder._ESCAPES[c])
+                    i = j + 2
+                else:
+                    self._error("invalid escape")
+            return "".join(parts).encode("utf-8", "surrogatepass")
+
+        def _finish(self):
+            token = bytes(self._token)
+            self._token.clear()
+            mode, self._mode = self._mode, None
+            if mode == "number":
+                try:
+                    value = float(token) if any(c in token for c in b".eE") else int(token)
+                except ValueError:
+                    self._error("invalid number %s" % token.decode("ascii"))
+            else:
+                if token not in JSON.JSONDecoder._LITERALS:
+                    self._error("invalid literal %s" % token.decode("ascii"))
+                value = JSON.JSONDecoder._LITERALS[token]
+            self._value(value)
 
         def write(self, s):
-            self._buffer += s
+            i = 0
+            n = len(s)
+            while i < n:
+                if self._mode == "string":
+                    if self._escape:
+                        self._token += s[i:i + 1]
+                        self._escape = False
+                        i += 1
+                        continue
+                    match = JSON.JSONDecoder._STRING.search(s, i)
+                    if match is None:
+                        self._token += s[i:]
+                        break
+                    j = match.start()
+                    if s[j] == 0x5C: # backslash, the escaped character may be in the next chunk
+                        self._token += s[i:j + 2]
+                        self._escape = j + 1 >= n
+                        i = j + 2
+                        continue
+                    self._token += s[i:j]
+                    i = j + 1
+                    self._mode = None
+                    value = self._string(bytes(self._token))
+                    self._token.clear()
+                    self._value(value)
+                    continue
+                if self._mode is not None:
+                    pattern = JSON.JSONDecoder._NUMBER if self._mode == "number" else JSON.JSONDecoder._LITERAL
+                    j = pattern.match(s, i).end()
+                    self._token += s[i:j]
+                    i = j
+                    if i < n:
+                        self._finish()
+                    continue
+
+                i = JSON.JSONDecoder._SPACE.match(s, i).end()
+                if i >= n:
+                    break
+                c = s[i:i + 1]
+                i += 1
+                expect = self._expect
+
+                if expect == JSON.JSONDecoder.DONE:
+                    self._error("unexpected data after the end")
+                elif expect == JSON.JSONDecoder.COLON:
+                    if c != b":":
+                        self._error("expected :")
+                    self._expect = JSON.JSONDecoder.VALUE
+                elif expect == JSON.JSONDecoder.NEXT and c == b",":
+                    self._expect = JSON.JSONDecoder.VALUE if self._stack[-1]["array"] else JSON.JSONDecoder.KEY
+                elif c == b"}" and (expect == JSON.JSONDecoder.NEXT or (expect == JSON.JSONDecoder.FIRST and not self._stack[-1]["array"])):
+                    self._close(False)
+                elif c == b"]" and (expect == JSON.JSONDecoder.NEXT or (expect == JSON.JSONDecoder.FIRST and self._stack[-1]["array"])):
+                    self._close(True)
+                elif expect == JSON.JSONDecoder.NEXT:
+                    self._error("expected , near %s" % c.decode("latin-1"))
+                elif c == b'"':
+                    self._mode = "string"
+                elif expect == JSON.JSONDecoder.KEY or (expect == JSON.JSONDecoder.FIRST and not self._stack[-1]["array"]):
+                    self._error("expected a key near %s" % c.decode("latin-1"))
+                elif c == b"{":
+                    self._open(False)
+                elif c == b"[":
+                    self._open(True)
+                elif c in b"-0123456789":
+                    self._mode = "number"
+                    self._token += c
+                elif c in b"tfn":
+                    self._mode = "literal"
+                    self._token += c
+                else:
+                    self._error("unexpected %s" % c.decode("latin-1"))
+
+            return self._result if self._complete else None
 
         def result(self):
-            def convert(obj):
-                c = {}
-                for k, v in obj.items():
-                    if isinstance(k, str):
-                        k = k.encode("ascii")
-                    if isinstance(v, dict):
-                        v = convert(v)
-                    if isinstance(v, str):
-                        v = v.encode("ascii")
-                    c[k] = v
-                return self._environment.lua.table_from(c)
-
-            o = json.loads(self._buffer)
-            self._buffer = b""
-
-            o = convert(o)
-            return o
-
-    def encoder(self, options):
+            # A number at the top level only ends with the input
+            if self._mode is not None and self._mode != "string" and not self._stack:
+                self._finish()
+            if not self._complete:
+                self._error("incomplete input")
+            return self._result
+
+    def encoder(self, options=None):
         return JSON.JSONEncoder(self.environment, options)
 
-    def decoder(self, options):
+    def decoder(self, options=None):
         return JSON.JSONDecoder(self.environment, options)
 
     @exception_printer
@@ -155,39 +1161,236 @@ class JSON(Module):
         return e.read(o)
 
 class File():
+    """An open file. Files opened for reading are served from a memory mapping shared by all of their handles,
+    reads copy the requested bytes straight from it into the returned string. Files opened for writing use a
+    regular file handle."""
 
-    def __init__(self, handle):
+    def __init__(self, handle=None, data=None):
         self._handle = handle
-
-    def seek(self, mode, position):
-        if mode == b"set":
-            self._handle.seek(position)
-
-    def read(self, count):
-        data = self._handle.read(count)
-        return data
+        self._data = data
+        self._position = 0
+        self._closed = None
+
+    WHENCE = {b"set": os.SEEK_SET, b"cur": os.SEEK_CUR, b"end": os.SEEK_END}
+
+    def seek(self, whence=b"cur", offset=0):
+        if self._data is None:
+            return self._handle.seek(offset, File.WHENCE[whence])
+        if whence == b"set":
+            self._position = max(0, offset)
+        elif whence == b"cur":
+            self._position = max(0, self._position + offset)
+        else:
+            self._position = max(0, len(self._data) + offset)
+        return self._position
+
+    # file:read([n_or_char]), reads the given number of bytes or up to and including the given character
+
+    def read(self, count=1024):
+        if self._data is None:
+            if isinstance(count, bytes):
+                data = bytearray()
+                while not data.endswith(count):
+                    byte = self._handle.read(1)
+                    if not byte:
+                        break
+                    data += byte
+                data = bytes(data)
+            else:
+                data = self._handle.read(count)
+            return data if data else None
+
+        start = self._position
+        if isinstance(count, bytes):
+            end = self._data.find(count, start)
+            end = len(self._data) if end < 0 else end + 1
+        else:
+            end = start + count
+        data = self._data[start:end]
+        self._position = start + len(data)
+        return data if data else None
+
+    def readline(self):
+        return self.read(b"\n")
+
+    def write(self, data):
+        if self._handle is None:
+            return None
+        self._handle.write(data)
+        return True
+
+    def writeline(self, data):
+        return self.write(data + b"\n")
+
+    def flush(self):
+        if self._handle is not None:
+            self._handle.flush()
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+        self._data = None
+        if self._closed is not None:
+            self._closed()
 
 class Filesystem(Module):
+    """The file module. Files are looked up in an index of the storage and search directories of the environment,
+    which is built once and updated when files are written, removed or renamed. Files opened for reading are
+    memory mapped once for the lifetime of the environment. Like on the device, opening a missing file returns
+    nil, files can only be written if the environment has a storage directory. The functions of the module work
+    on the file opened last."""
 
     def __init__(self, environment: Environment) -> None:
         super().__init__(environment)
+        self._current = None
+        self._index = None
+        self._mappings = {}
+        self._match = None
+
+    def _paths(self):
+        if self._index is None:
+            index = {}
+            directories = ([self.environment.storage] if self.environment.storage else []) + self.environment.search
+            # Directories that come first take precedence
+            for dir in reversed(directories):
+                if not os.path.isdir(dir):
+                    continue
+                for name in os.listdir(dir):
+                    if os.path.isfile(os.path.join(dir, name)):
+                        index[name.encode("utf-8")] = os.path.join(dir, name)
+            self._index = index
+        return self._index
+
+    def refresh(self):
+        """Rebuilds the index and the mappings, e.g. after files were changed outside of the environment"""
+        self._index = None
+        self._mappings = {}
+
+    def _map(self, path):
+        data = self._mappings.get(path)
+        if data is None:
+            with open(path, "rb") as handle:
+                # Empty files can not be mapped
+                data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(handle.fileno()).st_size > 0 else b""
+            self._mappings[path] = data
+        return data
 
-    def open(self, filename, mode):
-        absolute = None
-        for dir in self.environment.search:
-            if os.path.isfile(os.path.join(dir, filename.decode("ascii"))):
-                absolute = os.path.join(dir, filename.decode("ascii"))
-                break
+    def _writable(self, filename):
+        # Changes to a file go to the storage directory, handles still reading the old content of it fail
+        if self.environment.storage is None:
+            return None
+        path = os.path.join(self.environment.storage, filename.decode("utf-8"))
+        data = self._mappings.pop(path, None)
+        if isinstance(data, mmap.mmap):
+            data.close()
+        self._index = None
+        return path
+
+    def open(self, filename, mode=b"r"):
+        mode = mode.decode("ascii")
+        if mode[0] in "wa" or "+" in mode:
+            source = self._paths().get(filename)
+            if mode[0] == "r" and source is None:
+                return None
+            path = self._writable(filename)
+            if path is None:
+                return None
+            if mode[0] in "ra" and source is not None and source != path:
+                # Files from other directories are copied to the storage before they are changed
+                shutil.copyfile(source, path)
+            file = File(handle=open(path, mode.replace("b", "") + "b"))
+        else:
+            path = self._paths().get(filename)
+            if path is None:
+                return None
+            file = File(data=self._map(path))
+
+        self._current = self.environment.memory.file(file)
+        return self._current
 
-        if absolute is None:
-            raise IOError("File {} not found".format(filename))
+    def close(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
 
-        return File(open(absolute, mode.decode("ascii") + "b"))
+    def read(self, count=1024):
+        return self._current.read(count) if self._current is not None else None
+
+    def readline(self):
+        return self._current.readline() if self._current is not None else None
+
+    def write(self, data):
+        return self._current.write(data) if self._current is not None else None
+
+    def writeline(self, data):
+        return self._current.writeline(data) if self._current is not None else None
+
+    def seek(self, whence=b"cur", offset=0):
+        return self._current.seek(whence, offset) if self._current is not None else None
+
+    def flush(self):
+        if self._current is not None:
+            self._current.flush()
+
+    def exists(self, filename):
+        return filename in self._paths()
+
+    # file.list([pattern]), returns a table of file names and sizes, optionally matching a Lua pattern
+
+    def list(self, pattern=None):
+        if pattern is not None and self._match is None:
+            self._match = self.environment.lua.eval("string.match")
+        files = {}
+        for name, path in self._paths().items():
+            if pattern is None or self._match(name, pattern) is not None:
+                files[name] = os.path.getsize(path)
+        return self.environment.lua.table_from(files)
+
+    def remove(self, filename):
+        if self.environment.storage is not None and os.path.isfile(os.path.join(self.environment.storage, filename.decode("utf-8"))):
+            os.remove(self._writable(filename))
+
+    def format(self):
+        if self.environment.storage is not None:
+            for name in os.listdir(self.environment.storage):
+                if os.path.isfile(os.path.join(self.environment.storage, name)):
+                    os.remove(self._writable(name.encode("utf-8")))
+
+    def rename(self, old, new):
+        if self.exists(new) or self.environment.storage is None or not os.path.isfile(os.path.join(self.environment.storage, old.decode("utf-8"))):
+            return False
+        os.rename(self._writable(old), self._writable(new))
+        return True
 
 class Buffer():
 
-    def __init__(self, size, channels=3):
+    # Applies a mapping function to a batch of pixels inside Lua, so that the Lua/Python boundary is only
+    # crossed once per batch. Returns mapped pixels and the number of channels set for each pixel.
+    BATCH_MAP = """
+    function(f, source, k, n, m)
+        local byte, char, floor, min = string.byte, string.char, math.floor, math.min
+        local unpack = table.unpack or unpack
+        local result, counts = {}, {}
+        for i = 0, n - 1 do
+            local values = {f(byte(source, i * k + 1, i * k + k))}
+            local count = min(#values, m)
+            local pixel = {}
+            for c = 1, m do
+                if c <= count then pixel[c] = floor(values[c]) % 256 else pixel[c] = 0 end
+            end
+            result[i + 1] = char(unpack(pixel))
+            counts[i + 1] = char(count)
+        end
+        return table.concat(result), table.concat(counts)
+    end
+    """
+
+    def __init__(self, size, channels=3, batch=None, memory=None):
         self._buffer = np.zeros((size, channels), dtype=np.uint8)
+        self._batch = batch
+        self._memory = memory
+        if memory is not None:
+            memory.buffer(self)
 
     @staticmethod
     def newBuffer(size, channels):
@@ -199,23 +1402,14 @@ class Buffer():
         if i < 0 or i >= self._buffer.shape[0]:
             raise RuntimeError("Out of bounds - index %d not within 1-%d" % (i+1, self._buffer.shape[0]))
 
-        if isinstance(args[0], bytes):
-            data = np.frombuffer(args[0], dtype=np.uint8)
-            data = data.reshape((int(data.shape[0] / self.channels()), self.channels()))
+        if isinstance(args[0], (bytes, bytearray, memoryview)):
+            # Pixels are copied once, straight from the string into the buffer
+            data = np.frombuffer(args[0], dtype=np.uint8).reshape((-1, self._buffer.shape[1]))
 
             if data.shape[0] > self._buffer.shape[0] - i:
                 raise RuntimeError("Out of bounds - index %d not within 1-%d" % (i+1, self._buffer.shape[0]))
 
-            buffer_start = min(max(i, 0), self._buffer.shape[0])
-            buffer_end = min(max(data.shape[0] + buffer_start, 0), self._buffer.shape[0])
-            data_start = min(max(-buffer_start + i, 0), data.shape[0])
-            data_end = min(max(buffer_end - buffer_start , 0), data.shape[0])
-
-            length = buffer_end - buffer_start
-
-            if length < 1:
-                return
-            self._buffer[buffer_start:buffer_end, :] = data[data_start:data_end, :]
+            self._buffer[i:i + data.shape[0]] = data
         else:
             if len(args) == 1 and isinstance(args[0], (tuple, list)):
                 args = args[0]
@@ -234,8 +1428,12 @@ class Buffer():
     def dump(self):
         return self._buffer.flatten().tobytes()
 
-    def fade(self, d):
-        self._buffer = np.clip(self._buffer.astype(np.int16) / d, 0, 255).astype(np.uint8)
+    def fade(self, d, direction=0):
+        # Integer arithmetic in place, the same as the pixbuf module, values are divided unless fading in
+        if direction == Pixbuf.FADE_IN:
+            np.copyto(self._buffer, np.minimum(self._buffer.astype(np.uint32) * int(d), 255), casting="unsafe")
+        else:
+            np.floor_divide(self._buffer, d, out=self._buffer, casting="unsafe")
 
     def size(self):
         return self._buffer.shape[0]
@@ -248,24 +1446,91 @@ class Buffer():
         length = input.size()
         self._buffer[offset-1:length+offset-1, :] = input._buffer
 
-    def map(self, f, b1, o1 = 1, end = -1, b2 = None, o2 = -1):
-        if end < 0:
-            end = b1.size() + o1 + end
-        for i in range(0, end - o1 + 1):
+    def _palette(self, table):
+        # Converts a Lua table indexed by pixel values to a lookup table
+        values = np.zeros((256, self.channels()), dtype=np.uint8)
+        counts = np.zeros((256, ), dtype=np.int64)
+        for k, v in table.items():
+            v = list(v.values()) if lupa.lua_type(v) == "table" else [v]
+            count = min(len(v), self.channels())
+            values[int(k), :count] = [int(c) % 256 for c in v[:count]]
+            counts[int(k)] = count
+        return values, counts
+
+    def _map_batch(self, f, args):
+        data, counts = self._batch(f, args.tobytes(), args.shape[1], args.shape[0], self.channels())
+        values = np.frombuffer(data, dtype=np.uint8).reshape((args.shape[0], self.channels()))
+        return values, np.frombuffer(counts, dtype=np.uint8)
+
+    def _map_pixels(self, f, b1, o1, n, b2, o2):
+        for i in range(0, n):
             args = b1._buffer[i + o1-1, :].tolist()
             if b2 is not None:
                 args += b2._buffer[i + o2-1, :].tolist()
             self.set(i + 1, *f(*args))
 
+    def map(self, f, b1, o1 = 1, end = -1, b2 = None, o2 = -1):
+        if end < 0:
+            end = b1.size() + o1 + end
+        n = end - o1 + 1
+
+        if n < 1:
+            return
+
+        if lupa.lua_type(f) != "table" and self._batch is None:
+            self._map_pixels(f, b1, o1, n, b2, o2)
+            return
+
+        if n > self._buffer.shape[0]:
+            raise RuntimeError("Out of bounds - index %d not within 1-%d" % (n, self._buffer.shape[0]))
+
+        positions = np.arange(n)
+        args = b1._buffer[positions + o1 - 1, :]
+        if b2 is not None:
+            args = np.hstack((args, b2._buffer[positions + o2 - 1, :]))
+
+        if lupa.lua_type(f) == "table":
+            if args.shape[1] != 1:
+                raise RuntimeError("Palette mapping requires a single channel source")
+            values, counts = self._palette(f)
+            values, counts = values[args[:, 0]], counts[args[:, 0]]
+        elif args.shape[1] == 1:
+            # Single channel sources have at most 256 distinct values, the function is only called once for each of them
+            unique, inverse = np.unique(args[:, 0], return_inverse=True)
+            values, counts = self._map_batch(f, unique.reshape((-1, 1)))
+            values, counts = values[inverse], counts[inverse]
+        else:
+            values, counts = self._map_batch(f, np.ascontiguousarray(args))
+
+        selection = np.arange(self.channels()) < counts[:, np.newaxis]
+        self._buffer[:n, :][selection] = values[selection]
+
     def sub(self, i, j = -1):
-        view = Buffer(0, 1)
+        view = Buffer(0, 1, self._batch)
         if i < 0:
             i = self.size() + i
         if j < 0:
             j = self.size() + j
         view._buffer = self._buffer[i:j, :]
+        # The device copies the pixels to a new buffer
+        view._memory = self._memory
+        if self._memory is not None:
+            self._memory.buffer(view)
         return view
 
+class Pixbuf(Module):
+    """The pixbuf module, creates buffers that can run mapping functions in batches in the Lua runtime"""
+
+    FADE_OUT = 0
+    FADE_IN = 1
+
+    def __init__(self, environment: Environment) -> None:
+        super().__init__(environment)
+        self._batch = environment.lua.eval(Buffer.BATCH_MAP)
+
+    def newBuffer(self, size, channels):
+        return Buffer(size, channels, self._batch, self.environment.memory)
+
 class Operations():
     """CTypes wrapper for the custom pixmod module"""
     
@@ -289,80 +1554,615 @@ class Operations():
         
         # Define the function signature
         self._lib.set.argtypes = [ctypes.POINTER(ctypes.c_uint8), ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int]
-        self._lib.set.restype = None
+        self._lib.set.restype = ctypes.c_int
         
         self._lib.line.argtypes = [ctypes.POINTER(ctypes.c_uint8), ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int]
-        self._lib.line.restype = None
+        self._lib.line.restype = ctypes.c_int
         
         self._lib.add.argtypes = [ctypes.POINTER(ctypes.c_uint8), ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int]
-        self._lib.add.restype = None
+        self._lib.add.restype = ctypes.c_int
         
         self._lib.fill.argtypes = [ctypes.POINTER(ctypes.c_uint8), ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int]
-        self._lib.fill.restype = None
+        self._lib.fill.restype = ctypes.c_int
         
         self._lib.blit.argtypes = [ctypes.POINTER(ctypes.c_uint8), ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_uint8), ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int]
-        self._lib.blit.restype = None
+        self._lib.blit.restype = ctypes.c_int
         
         self._lib.blit_color.argtypes = [ctypes.POINTER(ctypes.c_uint8), ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_uint8), 
                                          ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int]
-        self._lib.blit_color.restype = None
+        self._lib.blit_color.restype = ctypes.c_int
+
+        self._lib.blit_mask.argtypes = [ctypes.POINTER(ctypes.c_uint8), ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_uint8), ctypes.c_int, ctypes.c_int, ctypes.c_int,
+                                        ctypes.POINTER(ctypes.c_uint8), ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int]
+        self._lib.blit_mask.restype = ctypes.c_int
+
+        self._lib.life.argtypes = [ctypes.POINTER(ctypes.c_uint8), ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_uint8), ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int)]
+        self._lib.life.restype = ctypes.c_int
+
+        self._lib.decode.argtypes = [ctypes.POINTER(ctypes.c_uint8), ctypes.c_int, ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.POINTER(ctypes.c_int)]
+        self._lib.decode.restype = ctypes.c_int
+
+        self._lib.decode_rect.argtypes = [ctypes.POINTER(ctypes.c_uint8), ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+                                          ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.POINTER(ctypes.c_int)]
+        self._lib.decode_rect.restype = ctypes.c_int
+
+        self._lib.text.argtypes = [ctypes.POINTER(ctypes.c_uint8), ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+                                   ctypes.c_char_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int)]
+        self._lib.text.restype = ctypes.c_int
+
+        self._lib.crossfade.argtypes = [ctypes.POINTER(ctypes.c_uint8), ctypes.POINTER(ctypes.c_uint8), ctypes.POINTER(ctypes.c_uint8), ctypes.c_int, ctypes.c_int]
+        self._lib.crossfade.restype = ctypes.c_int
+
+        self._lib.wipe.argtypes = [ctypes.POINTER(ctypes.c_uint8), ctypes.POINTER(ctypes.c_uint8), ctypes.POINTER(ctypes.c_uint8), ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int]
+        self._lib.wipe.restype = ctypes.c_int
+
+        self._lib.dissolve.argtypes = [ctypes.POINTER(ctypes.c_uint8), ctypes.POINTER(ctypes.c_uint8), ctypes.POINTER(ctypes.c_uint8), ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int]
+        self._lib.dissolve.restype = ctypes.c_int
         
     def set(self, buffer, w, h, x, y, r, g, b):
         import ctypes
         buf = buffer._buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8))
-        self._lib.set(buf, w, h, buffer.channels(), x, y, r, g, b)
+        return bool(self._lib.set(buf, w, h, buffer.channels(), x, y, r, g, b))
         
     def line(self, buffer, w, h, x1, y1, x2, y2, r, g, b):
         import ctypes
         buf = buffer._buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8))
-        self._lib.line(buf, w, h, buffer.channels(), x1, y1, x2, y2, r, g, b)
+        return bool(self._lib.line(buf, w, h, buffer.channels(), x1, y1, x2, y2, r, g, b))
 
     def add(self, buffer, w, h, value):
         import ctypes
         buf = buffer._buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8))
-        self._lib.add(buf, w, h, buffer.channels(), value)
+        return bool(self._lib.add(buf, w, h, buffer.channels(), value))
 
     def fill(self, buffer, w, h, rx, ry, rw, rh, r, g, b):
         import ctypes
         buf = buffer._buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8))
-        self._lib.fill(buf, w, h, buffer.channels(), rx, ry, rw, rh, r, g, b)
+        return bool(self._lib.fill(buf, w, h, buffer.channels(), rx, ry, rw, rh, r, g, b))
         
     def blit(self, src, src_w, src_h, dst, dst_w, dst_h, x, y, w, h, dx, dy):
         import ctypes
         src_buf = src._buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8))
         dst_buf = dst._buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8))
-        self._lib.blit(src_buf, src_w, src_h, src.channels(), dst_buf, dst_w, dst_h, dst.channels(), x, y, w, h, dx, dy)
+        return bool(self._lib.blit(src_buf, src_w, src_h, src.channels(), dst_buf, dst_w, dst_h, dst.channels(), x, y, w, h, dx, dy))
 
     def blit_color(self, src, src_w, src_h, dst, dst_w, dst_h, x, y, w, h, dx, dy, r, g, b):
         import ctypes
         src_buf = src._buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8))
         dst_buf = dst._buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8))
-        self._lib.blit_color(src_buf, src_w, src_h, src.channels(), dst_buf, dst_w, dst_h, dst.channels(), x, y, w, h, dx, dy, r, g, b)
+        return bool(self._lib.blit_color(src_buf, src_w, src_h, src.channels(), dst_buf, dst_w, dst_h, dst.channels(), x, y, w, h, dx, dy, r, g, b))
 
-    def blit_mask(self, buffer, buffer2, w, h, x, y, w2, h2, r, g, b):
+    def blit_mask(self, src, src_w, src_h, dst, dst_w, dst_h, mask, mask_w, mask_h, x, y, w, h, dx, dy):
+        import ctypes
+        src_buf = src._buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8))
+        dst_buf = dst._buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8))
+        mask_buf = mask._buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8))
+        return bool(self._lib.blit_mask(src_buf, src_w, src_h, src.channels(), dst_buf, dst_w, dst_h, dst.channels(), mask_buf, mask_w, mask_h, x, y, w, h, dx, dy))
+
+    def life(self, world, scratch, w, h, birth=0x08, survive=0x0C):
+        import ctypes
+        world_buf = world._buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8))
+        scratch_buf = scratch._buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8))
+        changed = ctypes.c_int(0)
+        alive = self._lib.life(world_buf, w, h, world.channels(), scratch_buf, scratch.channels(), birth, survive, ctypes.byref(changed))
+        return alive, bool(changed.value)
+
+    def decode(self, buffer, position, data, palette):
+        import ctypes
+        if position < 1 or position > buffer.size():
+            raise RuntimeError("Out of bounds - index %d not within 1-%d" % (position, buffer.size()))
+        buf = buffer._buffer[position-1:, :].ctypes.data_as(ctypes.POINTER(ctypes.c_uint8))
+        changed = ctypes.c_int(0)
+        count = self._lib.decode(buf, buffer.size() - position + 1, buffer.channels(), data, len(data), palette, len(palette) // buffer.channels(), ctypes.byref(changed))
+        return count, bool(changed.value)
+
+    def decode_rect(self, buffer, w, h, x, y, rw, rh, data, palette):
         import ctypes
         buf = buffer._buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8))
-        buf2 = buffer2._buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8))
-        self._lib.blit_mask(buf, w, h, buffer.channels(), x, y, w2, h2, buf2, r, g, b)
+        changed = ctypes.c_int(0)
+        count = self._lib.decode_rect(buf, w, h, buffer.channels(), x, y, rw, rh, data, len(data), palette, len(palette) // buffer.channels(), ctypes.byref(changed))
+        return count, bool(changed.value)
 
-def main():
+    def text(self, buffer, w, h, glyphs, gw, gh, first, text, x, y, r, g, b, spacing=0):
+        import ctypes
+        if gw <= 0 or gh <= 0:
+            raise RuntimeError("Invalid glyph size %dx%d" % (gw, gh))
+        buf = buffer._buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8))
+        changed = ctypes.c_int(0)
+        end = self._lib.text(buf, w, h, buffer.channels(), glyphs, len(glyphs), gw, gh, first, text, len(text), x, y, r, g, b, spacing, ctypes.byref(changed))
+        return end, bool(changed.value)
 
-    import argparse
-    
-    parser = argparse.ArgumentParser(description="Emulator for the Pixelflut firmware")
-    parser.add_argument("name", type=str, help="The name of the tileset to emulate")
-    parser.add_argument("-s", "--speed", type=int, default=10, help="The speed of the emulator (FPS)")
+    @staticmethod
+    def _sources(dst, a, b):
+        import ctypes
+        for source in (a, b):
+            if source._buffer.shape != dst._buffer.shape:
+                raise RuntimeError("Buffers differ in size")
+        return [buffer._buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8)) for buffer in (dst, a, b)]
 
-    args = parser.parse_args()
+    def crossfade(self, dst, a, b, alpha):
+        return bool(self._lib.crossfade(*self._sources(dst, a, b), dst._buffer.size, alpha))
+
+    def wipe(self, dst, a, b, w, h, position, direction=0):
+        buffers = self._sources(dst, a, b)
+        if w <= 0 or h <= 0 or w * h > dst.size():
+            raise RuntimeError("Invalid size %dx%d" % (w, h))
+        return bool(self._lib.wipe(*buffers, w, h, dst.channels(), position, direction))
+
+    def dissolve(self, dst, a, b, amount, seed=0):
+        return bool(self._lib.dissolve(*self._sources(dst, a, b), dst.size(), dst.channels(), amount, seed))
 
-    name = args.name
+class NumpyOperations():
+    """Pure NumPy implementation of the custom pixmod module, produces the same results as the native code. Like the
+    native code, drawing operations report whether any pixel of the destination changed."""
 
-    env = Environment(os.path.join(root, "tiles", name), [os.path.join(root, "tiles", name), os.path.join(root, "core")])
+    def __init__(self) -> None:
+        self._arrays = {}
+
+    def _scratch(self, name, shape, dtype):
+        # Temporary arrays are kept between calls, blending operations run for every frame of a transition
+        key = (name, shape, np.dtype(dtype))
+        if key not in self._arrays:
+            self._arrays[key] = np.empty(shape, dtype=dtype)
+        return self._arrays[key]
+
+    @staticmethod
+    def _view(buffer, w, h, bpp=None):
+        # Interpret the beginning of the buffer as a w x h image, the same way as wrap_buffer does
+        if bpp is None:
+            bpp = buffer.channels()
+        return buffer._buffer.reshape(-1)[:w * h * bpp].reshape((h, w, bpp))
+
+    @staticmethod
+    def _color(bpp, r, g, b):
+        # Byte layout of a packed color as written by _pixmod_set
+        r, g, b = (min(max(v, 0), 255) for v in (r, g, b))
+        return np.array([b, g, r, 0][:bpp], dtype=np.uint8)
+
+    @staticmethod
+    def _convert(pixels, bpp):
+        # Conversion between pixel formats follows _pixmod_get followed by _pixmod_set
+        if pixels.shape[-1] == bpp:
+            return pixels
+        converted = np.zeros(pixels.shape[:-1] + (bpp, ), dtype=np.uint8)
+        n = min(bpp, pixels.shape[-1])
+        converted[..., :n] = pixels[..., :n]
+        return converted
 
-    def load_script(lua, filename):
-        with open(filename, "r") as source:
-            source = source.read()
-            lua.execute(source)
+    @staticmethod
+    def _write(target, values, selection=None):
+        # Writes values to the target view or to the selected pixels of it, returns True if any pixel changed
+        if selection is not None:
+            changed = bool(np.any(target[selection] != values))
+            target[selection] = values
+        else:
+            changed = bool(np.any(target != values))
+            target[...] = values
+        return changed
+
+    @staticmethod
+    def _clip(src_w, src_h, dst_w, dst_h, x, y, w, h, dx, dy):
+        # Same clipping as in _pixmod_blit, all coordinates are zero-based
+        def intersection(r1, r2):
+            ix = max(r1[0], r2[0])
+            iy = max(r1[1], r2[1])
+            return (ix, iy, min(r1[0] + r1[2], r2[0] + r2[2]) - ix, min(r1[1] + r1[3], r2[1] + r2[3]) - iy)
+
+        src_clip = intersection((x, y, w, h), (0, 0, src_w, src_h))
+        dst_clip = intersection((dx, dy, w, h), (0, 0, dst_w, dst_h))
+
+        clip = intersection((src_clip[0] - x, src_clip[1] - y, src_clip[2], src_clip[3]),
+                            (dst_clip[0] - dx, dst_clip[1] - dy, dst_clip[2], dst_clip[3]))
+
+        if clip[2] <= 0 or clip[3] <= 0:
+            return None
+
+        return (x + clip[0], y + clip[1], dst_clip[0], dst_clip[1], clip[2], clip[3])
+
+    def set(self, buffer, w, h, x, y, r, g, b):
+        x, y = x - 1, y - 1
+        if x < 0 or x >= w or y < 0 or y >= h:
+            return False
+        view = self._view(buffer, w, h)
+        return self._write(view[y:y+1, x:x+1, :], self._color(view.shape[2], r, g, b))
+
+    def line(self, buffer, w, h, x1, y1, x2, y2, r, g, b):
+        view = self._view(buffer, w, h)
+        x0, y0, x1, y1 = x1 - 1, y1 - 1, x2 - 1, y2 - 1
+
+        # Bresenham's algorithm, pixels are written all at once
+        dx = abs(x1 - x0)
+        dy = abs(y1 - y0)
+        sx = 1 if x0 < x1 else -1
+        sy = 1 if y0 < y1 else -1
+        err = dx - dy
+
+        pixels = []
+        while True:
+            if x0 >= 0 and x0 < w and y0 >= 0 and y0 < h:
+                pixels.append(y0 * w + x0)
+            if x0 == x1 and y0 == y1:
+                break
+            e2 = 2 * err
+            if e2 > -dy:
+                err -= dy
+                x0 += sx
+            if e2 < dx:
+                err += dx
+                y0 += sy
+
+        if len(pixels) == 0:
+            return False
+        return self._write(view.reshape((w * h, view.shape[2])), self._color(view.shape[2], r, g, b), pixels)
+
+    def add(self, buffer, w, h, value):
+        view = self._view(buffer, w, h)
+        channels = min(view.shape[2], 3)
+        result = np.zeros_like(view)
+        result[:, :, :channels] = np.clip(view[:, :, :channels].astype(np.int32) + value, 0, 255)
+        # Only three color components survive the unpacking and packing of colors
+        return self._write(view, result)
+
+    def fill(self, buffer, w, h, rx, ry, rw, rh, r, g, b):
+        view = self._view(buffer, w, h)
+        x0, y0 = max(rx - 1, 0), max(ry - 1, 0)
+        x1, y1 = min(rx - 1 + rw, w), min(ry - 1 + rh, h)
+        if x1 <= x0 or y1 <= y0:
+            return False
+        return self._write(view[y0:y1, x0:x1, :], self._color(view.shape[2], r, g, b))
+
+    def blit(self, src, src_w, src_h, dst, dst_w, dst_h, x, y, w, h, dx, dy):
+        clip = self._clip(src_w, src_h, dst_w, dst_h, x - 1, y - 1, w, h, dx - 1, dy - 1)
+        if clip is None:
+            return False
+        sx, sy, tx, ty, cw, ch = clip
+        src_view = self._view(src, src_w, src_h)
+        dst_view = self._view(dst, dst_w, dst_h)
+        # Overlapping regions are handled by NumPy the same way as the reverse copy in _pixmod_copy
+        return self._write(dst_view[ty:ty+ch, tx:tx+cw, :], self._convert(src_view[sy:sy+ch, sx:sx+cw, :], dst_view.shape[2]))
+
+    def blit_color(self, src, src_w, src_h, dst, dst_w, dst_h, x, y, w, h, dx, dy, r, g, b):
+        clip = self._clip(src_w, src_h, dst_w, dst_h, x - 1, y - 1, w, h, dx - 1, dy - 1)
+        if clip is None:
+            return False
+        sx, sy, tx, ty, cw, ch = clip
+        mask_view = self._view(src, src_w, src_h)
+        dst_view = self._view(dst, dst_w, dst_h)
+        if mask_view.shape[2] == 1:
+            mask = mask_view[sy:sy+ch, sx:sx+cw, 0] != 0
+        else:
+            mask = np.any(mask_view[sy:sy+ch, sx:sx+cw, :] != 0, axis=2)
+        return self._write(dst_view[ty:ty+ch, tx:tx+cw, :], self._color(dst_view.shape[2], r, g, b), mask)
+
+    def blit_mask(self, src, src_w, src_h, dst, dst_w, dst_h, mask, mask_w, mask_h, x, y, w, h, dx, dy):
+        # Source and mask must have the same dimensions
+        if src_w != mask_w or src_h != mask_h:
+            return False
+        clip = self._clip(src_w, src_h, dst_w, dst_h, x - 1, y - 1, w, h, dx - 1, dy - 1)
+        if clip is None:
+            return False
+        sx, sy, tx, ty, cw, ch = clip
+        src_view = self._view(src, src_w, src_h)
+        dst_view = self._view(dst, dst_w, dst_h)
+        # Mask is always interpreted as a single channel buffer
+        mask_view = self._view(mask, mask_w, mask_h, 1)
+        selection = mask_view[sy:sy+ch, sx:sx+cw, 0] != 0
+        return self._write(dst_view[ty:ty+ch, tx:tx+cw, :], self._convert(src_view[sy:sy+ch, sx:sx+cw, :][selection], dst_view.shape[2]), selection)
+
+    def life(self, world, scratch, w, h, birth=0x08, survive=0x0C):
+        world_view = self._view(world, w, h)
+        scratch_view = self._view(scratch, w, h)
+
+        # Count living neighbours using shifted views of a padded world
+        alive = np.pad(np.any(world_view != 0, axis=2), 1)
+        neighbours = np.zeros((h, w), dtype=np.int32)
+        for i in range(3):
+            for j in range(3):
+                if i != 1 or j != 1:
+                    neighbours += alive[i:i+h, j:j+w]
+
+        rule = np.where(alive[1:-1, 1:-1], survive, birth)
+        state = ((rule >> neighbours) & 1).astype(np.uint8)
+
+        scratch_view[:, :, :] = 0
+        scratch_view[:, :, 0] = state
+        changed = self._write(world_view, self._convert(scratch_view, world_view.shape[2]))
+
+        return int(np.count_nonzero(state)), changed
+
+    @staticmethod
+    def _palette(palette, bpp):
+        palette = np.frombuffer(palette, dtype=np.uint8)
+        return palette[:(len(palette) // bpp) * bpp].reshape((-1, bpp))
+
+    @staticmethod
+    def _indices(data, colors):
+        # Expands run-length encoded palette indices, see _decoder_next for details of the encoding
+        data = np.frombuffer(data, dtype=np.uint8)
+
+        # Indices take two bytes if the palette has more than 256 colors
+        size = 2 if colors > 256 else 1
+        symbols = np.dtype("<u2") if size == 2 else np.dtype(np.uint8)
+
+        # Collect runs and literal sequences, then expand them all at once
+        pieces = []
+        i = 0
+        while i < len(data):
+            control = int(data[i])
+            i += 1
+            if control < 128:
+                literal = data[i:i+(control+1)*size]
+                pieces.append(literal[:(len(literal) // size) * size].view(symbols))
+                i += (control + 1) * size
+            else:
+                if i + size > len(data):
+                    break
+                pieces.append(np.full(control - 126, data[i:i+size].view(symbols)[0], dtype=symbols))
+                i += size
+
+        if len(pieces) == 0:
+            return np.zeros((0, ), dtype=symbols)
+
+        return np.concatenate(pieces)
+
+    def decode(self, buffer, position, data, palette):
+        if position < 1 or position > buffer.size():
+            raise RuntimeError("Out of bounds - index %d not within 1-%d" % (position, buffer.size()))
+
+        palette = self._palette(palette, buffer.channels())
+        indices = self._indices(data, palette.shape[0])[:buffer.size() - position + 1]
+        valid = indices < palette.shape[0]
+        return len(indices), self._write(buffer._buffer[position-1:position-1+len(indices), :], palette[indices[valid]], valid)
+
+    def decode_rect(self, buffer, w, h, x, y, rw, rh, data, palette):
+        if rw <= 0 or rh <= 0:
+            return 0, False
+
+        view = self._view(buffer, w, h)
+        palette = self._palette(palette, buffer.channels())
+        indices = self._indices(data, palette.shape[0])[:rw * rh]
+
+        pixels = np.arange(len(indices))
+        px = x - 1 + pixels % rw
+        py = y - 1 + pixels // rw
+        valid = (indices < palette.shape[0]) & (px >= 0) & (px < w) & (py >= 0) & (py < h)
+        return len(indices), self._write(view, palette[indices[valid]], (py[valid], px[valid]))
+
+    def text(self, buffer, w, h, glyphs, gw, gh, first, text, x, y, r, g, b, spacing=0):
+        if gw <= 0 or gh <= 0:
+            raise RuntimeError("Invalid glyph size %dx%d" % (gw, gh))
+
+        advance = gw + spacing
+        end = x + len(text) * advance
+        x, y = x - 1, y - 1
+
+        # Unpack the bit-packed glyph table, see _pixmod_text for the layout
+        stride = (gw * gh + 7) // 8
+        count = len(glyphs) // stride
+        bits = np.unpackbits(np.frombuffer(glyphs, dtype=np.uint8)[:count * stride].reshape((count, stride)), axis=1)
+        bitmaps = bits[:, :gw * gh].reshape((count, gh, gw)).astype(bool)
+
+        view = self._view(buffer, w, h)
+        color = self._color(view.shape[2], r, g, b)
+        changed = False
+
+        for i, code in enumerate(np.frombuffer(text, dtype=np.uint8)):
+            index = int(code) - first
+            gx = x + i * advance
+            if gx >= w:
+                break
+            if index < 0 or index >= count or gx + gw <= 0:
+                continue
+            clip = self._clip(gw, gh, w, h, 0, 0, gw, gh, gx, y)
+            if clip is None:
+                continue
+            sx, sy, tx, ty, cw, ch = clip
+            changed = self._write(view[ty:ty+ch, tx:tx+cw, :], color, bitmaps[index, sy:sy+ch, sx:sx+cw]) or changed
+
+        return end, changed
+
+    @staticmethod
+    def _sources(dst, a, b):
+        for source in (a, b):
+            if source._buffer.shape != dst._buffer.shape:
+                raise RuntimeError("Buffers differ in size")
+        return dst._buffer, a._buffer, b._buffer
+
+    def _select(self, dst, a, b, selection):
+        # Takes selected pixels from the second buffer and the rest from the first one, see _pixmod_select
+        result = self._scratch("select", dst.shape, np.uint8)
+        np.copyto(result, a)
+        np.copyto(result, b, where=selection[:, np.newaxis])
+        difference = self._scratch("difference", dst.shape, bool)
+        changed = bool(np.not_equal(dst, result, out=difference).any())
+        np.copyto(dst, result)
+        return changed
+
+    def crossfade(self, dst, a, b, alpha):
+        dst, a, b = self._sources(dst, a, b)
+        alpha = min(max(alpha, 0), 256)
+        # Integer blending in 16 bits, the same as _pixmod_crossfade
+        result = self._scratch("blend", dst.shape, np.uint16)
+        weighted = self._scratch("weighted", dst.shape, np.uint16)
+        np.multiply(a, 256 - alpha, out=result, dtype=np.uint16)
+        np.multiply(b, alpha, out=weighted, dtype=np.uint16)
+        result += weighted
+        result >>= 8
+        difference = self._scratch("difference", dst.shape, bool)
+        changed = bool(np.not_equal(dst, result, out=difference).any())
+        np.copyto(dst, result, casting="unsafe")
+        return changed
+
+    def _coordinates(self, w, h, direction):
+        # Distance of pixels from the edge where a wipe starts, see _pixmod_wipe
+        key = ("coordinates", w, h, direction)
+        if key not in self._arrays:
+            y, x = np.divmod(np.arange(w * h), w)
+            self._arrays[key] = {1: w - 1 - x, 2: y, 3: h - 1 - y}.get(direction, x)
+        return self._arrays[key]
+
+    def wipe(self, dst, a, b, w, h, position, direction=0):
+        self._sources(dst, a, b)
+        if w <= 0 or h <= 0 or w * h > dst.size():
+            raise RuntimeError("Invalid size %dx%d" % (w, h))
+        views = [self._view(buffer, w, h).reshape((w * h, -1)) for buffer in (dst, a, b)]
+        selection = self._scratch("selection", (w * h, ), bool)
+        np.less(self._coordinates(w, h, direction), position, out=selection)
+        return self._select(*views, selection)
+
+    def _thresholds(self, npix, seed):
+        # Same hash as _dissolve_threshold, computed once for each buffer size and seed
+        key = ("thresholds", npix, seed & 0xFFFFFFFF)
+        if key not in self._arrays:
+            with np.errstate(over="ignore"):
+                h = (np.arange(npix, dtype=np.uint32) ^ np.uint32(seed & 0xFFFFFFFF)) * np.uint32(2654435761)
+                h ^= h >> np.uint32(15)
+                h *= np.uint32(2246822519)
+                h ^= h >> np.uint32(13)
+            self._arrays[key] = (h & 0xFF).astype(np.int32)
+        return self._arrays[key]
+
+    def dissolve(self, dst, a, b, amount, seed=0):
+        dst, a, b = self._sources(dst, a, b)
+        selection = self._scratch("selection", (dst.shape[0], ), bool)
+        np.less(self._thresholds(dst.shape[0], seed), amount, out=selection)
+        return self._select(dst, a, b, selection)
+
+def create_operations(backend="numpy"):
+    """Creates an implementation of the pixmod module, either the NumPy one or the ctypes wrapper for native code"""
+    if backend == "numpy":
+        return NumpyOperations()
+    if backend == "native":
+        return Operations()
+    raise ValueError("Unknown pixmod backend %s" % backend)
+
+class Profiler():
+    """Records call counts and wall time of instrumented functions for each frame of a tile"""
+
+    BUFFER_METHODS = ("set", "get", "fill", "dump", "fade", "size", "channels", "replace", "map", "sub")
+    OPERATIONS_METHODS = ("set", "line", "add", "fill", "blit", "blit_color", "blit_mask", "life", "decode", "decode_rect", "text", "crossfade", "wipe", "dissolve")
+    FILE_METHODS = ("seek", "read", "readline", "write", "close")
+
+    class Buffers():
+        """Replacement for the pixbuf module that creates instrumented buffers"""
+
+        FADE_OUT = Pixbuf.FADE_OUT
+        FADE_IN = Pixbuf.FADE_IN
+
+        def __init__(self, profiler, pixbuf):
+            self._profiler = profiler
+            self._pixbuf = pixbuf
+
+        def newBuffer(self, size, channels):
+            return self._profiler.buffer(self._pixbuf.newBuffer(size, channels))
+
+    def __init__(self, name, budget=0.1):
+        self._name = name
+        self._budget = budget
+        self._stack = []
+        self._frames = []
+        self._stacks = {}
+        self._calls = {}
+
+    def wrap(self, name, function, result=None):
+        """Returns a profiled version of a function, the optional result callback is applied to returned values"""
+        def inner_function(*args, **kwargs):
+            self._stack.append(name)
+            start = time.perf_counter()
+            try:
+                value = function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self._record(name, ";".join(self._stack), elapsed)
+                self._stack.pop()
+            if result is not None:
+                value = result(value)
+            return value
+        return inner_function
+
+    @staticmethod
+    def _bind(obj, method, function):
+        # Lupa only drops the explicit self argument of colon calls for bound methods
+        setattr(obj, method, types.MethodType(lambda _, *args: function(*args), obj))
+
+    def instrument(self, obj, prefix, methods):
+        """Replaces the given methods of an object with profiled versions"""
+        for method in methods:
+            self._bind(obj, method, self.wrap(prefix + "." + method, getattr(obj, method)))
+        return obj
+
+    def buffer(self, buffer):
+        self.instrument(buffer, "Buffer", Profiler.BUFFER_METHODS)
+        # Views are buffers as well
+        self._bind(buffer, "sub", self.wrap("Buffer.sub", Buffer.sub.__get__(buffer), self.buffer))
+        return buffer
+
+    def operations(self, operations):
+        return self.instrument(operations, "Operations", Profiler.OPERATIONS_METHODS)
+
+    def filesystem(self, filesystem):
+        self._bind(filesystem, "open", self.wrap("Filesystem.open", filesystem.open, lambda f: self.instrument(f, "File", Profiler.FILE_METHODS) if f is not None else f))
+        return filesystem
+
+    def begin_frame(self):
+        self._frames.append({"time": 0, "calls": {}})
+
+    def end_frame(self, elapsed):
+        self._frames[-1]["time"] = elapsed
+
+    def _record(self, name, stack, elapsed):
+        self._stacks[stack] = self._stacks.get(stack, 0) + elapsed
+        calls = self._frames[-1]["calls"] if len(self._frames) > 0 else self._calls
+        count, total = calls.get(name, (0, 0))
+        calls[name] = (count + 1, total + elapsed)
+
+    def report(self):
+        """Returns a summary of the profile with totals, per-frame data and frames that exceed the time budget"""
+        totals = {}
+        for calls in [self._calls] + [frame["calls"] for frame in self._frames]:
+            for name, (count, elapsed) in calls.items():
+                total = totals.setdefault(name, {"count": 0, "time": 0})
+                total["count"] += count
+                total["time"] += elapsed
+
+        times = [frame["time"] for frame in self._frames]
+
+        return {
+            "name": self._name,
+            "budget": self._budget,
+            "frames": len(self._frames),
+            "max_frame_time": max(times) if len(times) > 0 else 0,
+            "mean_frame_time": sum(times) / len(times) if len(times) > 0 else 0,
+            "over_budget": [i for i, t in enumerate(times) if t > self._budget],
+            "setup": {name: {"count": c, "time": t} for name, (c, t) in self._calls.items()},
+            "totals": totals,
+            "per_frame": [{"time": frame["time"], "calls": {name: {"count": c, "time": t} for name, (c, t) in frame["calls"].items()}} for frame in self._frames]
+        }
+
+    def folded(self):
+        """Returns stacks in the folded format used by flame graph tools, values are self times in microseconds"""
+        children = {}
+        for stack, elapsed in self._stacks.items():
+            if ";" in stack:
+                parent = stack.rsplit(";", 1)[0]
+                children[parent] = children.get(parent, 0) + elapsed
+
+        lines = []
+        for stack, elapsed in sorted(self._stacks.items()):
+            value = int(round((elapsed - children.get(stack, 0)) * 1e6))
+            if value > 0:
+                lines.append("%s;%s %d" % (self._name, stack, value))
+        return "\n".join(lines) + "\n"
+
+    def save(self, directory):
+        """Writes the JSON report and the flame graph stacks of the tile to a directory"""
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, self._name + ".json"), "w") as handle:
+            json.dump(self.report(), handle, indent=2)
+        with open(os.path.join(directory, self._name + ".folded"), "w") as handle:
+            handle.write(self.folded())
+
+def _modules(env, backend="numpy", profiler=None, routes=None):
+    """Registers the emulated NodeMCU modules that tiles use in the environment"""
 
     def get_type(obj):
         if isinstance(obj, Buffer):
@@ -372,48 +2172,1020 @@ def main():
     
         return lupa.lua_type(obj)
 
-    env.lua.globals()[b"pixbuf"] = Buffer
-    env.lua.globals()[b"pixmod"] = Operations()
+    pixbuf = Pixbuf(env)
+    pixmod = create_operations(backend)
+    filesystem = Filesystem(env)
+
+    if profiler is not None:
+        pixbuf = Profiler.Buffers(profiler, pixbuf)
+        pixmod = profiler.operations(pixmod)
+        filesystem = profiler.filesystem(filesystem)
+
+    env.lua.globals()[b"pixbuf"] = pixbuf
+    env.lua.globals()[b"pixmod"] = pixmod
     env.lua.globals()[b"sjson"] = JSON(env)
-    env.lua.globals()[b"http"] = HTTP(env)
+    env.lua.globals()[b"http"] = HTTP(env, routes=routes)
+    env.lua.globals()[b"net"] = Net(env)
 
     env.lua.globals()[b"node"] = Node(env)
-    env.lua.globals()[b"file"] = Filesystem(env)
+    env.lua.globals()[b"file"] = filesystem
+    env.lua.globals()[b"crypto"] = Crypto(env, filesystem)
+    env.lua.globals()[b"encoder"] = Encoder(env)
 
-    os.chdir(os.path.join(root, "tiles", name))
+    os.chdir(env.root)
 
     env.lua.globals()[b"type"] = get_type
 
+def _install(env, backend="numpy", profiler=None, routes=None):
+    """Registers the emulated NodeMCU modules in the environment and loads the core scripts"""
+
+    _modules(env, backend, profiler, routes)
+
+    # Core scripts are counted, they are loaded on the device as well
+    env.memory.baseline()
 
     env.lua.execute('dofile("%s")' % os.path.join(root, "core", "utilities.lua"))
     env.lua.execute('package.loaded["sprites"] = dofile("%s")' % os.path.join(root, "core", "sprites.lua"))
     env.lua.execute('package.loaded["font"] = dofile("%s")' % os.path.join(root, "core", "font.lua"))
+    env.lua.execute('package.loaded["transition"] = dofile("%s")' % os.path.join(root, "core", "transition.lua"))
 
     env.lua.execute('function load_sprites() return package.loaded["sprites"] end')
     env.lua.execute('function load_font() return package.loaded["font"] end')
 
-    screen = env.lua.eval('Screen.create(20, 20)')    
+def load_tile(name, width=20, height=20, backend="numpy", profiler=None, routes=None, search=None):
+    """Creates an environment for the given tile, loads the core scripts and returns the environment,
+    the main function of the tile and the screen object. Routes redirect HTTP requests for the given
+    hosts, see FixtureServer. Files are also looked up in the additional search directories."""
+
+    tile_root = os.path.join(root, "tiles", name)
+
+    env = Environment(tile_root, [tile_root, os.path.join(root, "core")] + (search or []))
+
+    _install(env, backend, profiler, routes)
+
+    screen = env.lua.eval('Screen.create(%d, %d)' % (width, height))
     main, _ = env.lua.eval('require("%s")' % os.path.join("main"))
 
+    return env, main, screen
+
+def frame_image(screen, scale=1):
+    """Converts the screen buffer to an RGB image, optionally scaled up by an integer factor"""
+    image = np.reshape(screen.buffer._buffer, (screen.height, screen.width, 3))
+    image = image[:, :, (1, 0, 2)] # We are working with GRB ordering
+    if scale > 1:
+        image = np.repeat(np.repeat(image, scale, axis=0), scale, axis=1)
+    return np.ascontiguousarray(image)
+
+class FrameWriter():
+    """Base class for storing rendered frames to disk"""
+
+    def __init__(self, path):
+        self._path = path
+
+    def write(self, screen):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+class RawWriter(FrameWriter):
+    """Writes raw GRB frames one after another to a single file"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._handle = open(path, "wb")
+
+    def write(self, screen):
+        self._handle.write(screen.buffer.dump())
+
+    def close(self):
+        self._handle.close()
+
+class PNGWriter(FrameWriter):
+    """Writes each frame as a numbered PNG image to a directory"""
+
+    def __init__(self, path, scale=1):
+        super().__init__(path)
+        self._scale = scale
+        self._index = 0
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, screen):
+        image = cv.cvtColor(frame_image(screen, self._scale), cv.COLOR_RGB2BGR)
+        cv.imwrite(os.path.join(self._path, "%05d.png" % self._index), image)
+        self._index += 1
+
+class GIFWriter(FrameWriter):
+    """Collects frames and writes them as an animated GIF when closed"""
+
+    def __init__(self, path, scale=1, speed=10):
+        super().__init__(path)
+        self._scale = scale
+        self._duration = int(1000 / speed) if speed > 0 else 100
+        self._frames = []
+
+    def write(self, screen):
+        from PIL import Image
+        self._frames.append(Image.fromarray(frame_image(screen, self._scale)))
+
+    def close(self):
+        if len(self._frames) == 0:
+            return
+        self._frames[0].save(self._path, save_all=True, append_images=self._frames[1:], duration=self._duration, loop=0)
+
+class StreamWriter(FrameWriter):
+    """Streams frames to panels running the stream tile, given as udp://host:port or tcp://host:port. Each packet
+    starts with a header (magic, type, sequence number of the frame, sequence number of the frame it is based on,
+    index of the part and number of parts of the frame), followed by spans of pixels, each one given by the index
+    of its first pixel, the number of pixels and their GRB values. Keyframes contain all pixels, deltas only the
+    pixels that changed since the previous frame and are ignored by receivers that missed it. Packets are sent as
+    UDP datagrams or over TCP with a two byte length prefix. Frames are sent at the given speed."""
+
+    MAGIC = b"PF"
+    HEADER = struct.Struct("<2sBHHBB")
+    SPAN = struct.Struct("<HB")
+    LENGTH = struct.Struct("<H")
+    KEYFRAME = 0
+    DELTA = 1
+    PORT = 5005
+    # Keeps datagrams below the usual MTU
+    PAYLOAD = 1400
+
+    def __init__(self, targets, keyframe=50, speed=10):
+        super().__init__(None)
+        self._targets = [self._connect(target) for target in targets]
+        self._keyframe = keyframe
+        self._interval = 1 / speed if speed > 0 else 0
+        self._previous = None
+        self._sequence = 0
+        self._count = 0
+        self._deadline = None
+
+    @staticmethod
+    def _connect(target):
+        parts = urllib.parse.urlsplit(target if "://" in target else "udp://" + target)
+        address = (parts.hostname, parts.port or StreamWriter.PORT)
+        if parts.scheme == "tcp":
+            handle = socket.create_connection(address)
+            handle.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return handle, None
+        if parts.scheme == "udp":
+            handle = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            handle.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            return handle, address
+        raise ValueError("Unknown stream protocol %s" % parts.scheme)
+
+    @staticmethod
+    def _spans(changed):
+        # Pixels in gaps of one are included, sending them costs as much as the header of a new span
+        indices = np.flatnonzero(changed)
+        if len(indices) == 0:
+            return []
+        breaks = np.flatnonzero(np.diff(indices) > 2)
+        starts = np.concatenate(([indices[0]], indices[breaks + 1]))
+        ends = np.concatenate((indices[breaks] + 1, [indices[-1] + 1]))
+        return [(s, min(s + 255, end)) for start, end in zip(starts, ends) for s in range(start, end, 255)]
+
+    def _packets(self, kind, base, frame, spans):
+        payloads = [bytearray()]
+        for start, end in spans:
+            span = self.SPAN.pack(start, end - start) + frame[start:end].tobytes()
+            if len(payloads[-1]) + len(span) > self.PAYLOAD:
+                payloads.append(bytearray())
+            payloads[-1] += span
+        if len(payloads) > 255:
+            raise ValueError("Frame too large for streaming")
+        return [self.HEADER.pack(self.MAGIC, kind, self._sequence, base, i, len(payloads)) + payload for i, payload in enumerate(payloads)]
+
+    def encode(self, frame):
+        """Returns packets for the next frame, given as an array of pixels"""
+        size = frame.shape[0]
+        kind = self.KEYFRAME
+        spans = [(start, min(start + 255, size)) for start in range(0, size, 255)]
+
+        if self._previous is not None and (self._keyframe < 1 or self._count < self._keyframe):
+            changed = np.any(frame != self._previous, axis=1)
+            delta = self._spans(changed)
+            # A delta that is not smaller than a keyframe is not worth the risk of being dropped
+            if sum(end - start for start, end in delta) + len(delta) < size + len(spans):
+                kind, spans = self.DELTA, delta
+
+        if kind == self.KEYFRAME:
+            self._count = 0
+
+        base = self._sequence
+        self._sequence = (self._sequence + 1) % 65536
+        self._previous = frame.copy()
+        self._count += 1
+
+        return self._packets(kind, base, frame, spans)
+
+    def write(self, screen):
+        packets = self.encode(screen.buffer._buffer)
+
+        if self._deadline is not None:
+            delay = self._deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        self._deadline = max(self._deadline or 0, time.perf_counter()) + self._interval
+
+        for handle, address in self._targets:
+            for packet in packets:
+                if address is None:
+                    handle.sendall(self.LENGTH.pack(len(packet)) + packet)
+                else:
+                    handle.sendto(packet, address)
+
+    def close(self):
+        for handle, _ in self._targets:
+            handle.close()
+
+def create_writer(path, format="raw", scale=1, speed=10):
+    if format == "raw":
+        return RawWriter(path)
+    if format == "png":
+        return PNGWriter(path, scale)
+    if format == "gif":
+        return GIFWriter(path, scale, speed)
+    raise ValueError("Unknown frame format %s" % format)
+
+def render(name, frames, writer=None, width=20, height=20, backend="numpy", profiler=None, routes=None, memory=None, search=None):
+    """Renders the given number of frames of a tile without a window and without any delay, returns timing and
+    memory statistics. Raises MemoryBudgetError if the tile uses more than the given number of bytes."""
+
+    env, main, screen = load_tile(name, width, height, backend, profiler, routes, search)
+    env.memory.budget = memory
+
+    if profiler is not None:
+        main = profiler.wrap("main", main)
+
+    state = None
+    elapsed = 0
+    updates = 0
+
+    for _ in range(frames):
+        if profiler is not None:
+            profiler.begin_frame()
+        env.memory.begin_frame()
+        start = time.perf_counter()
+        env.dispatch()
+        state = main(state, screen)
+        duration = time.perf_counter() - start
+        elapsed += duration
+        if profiler is not None:
+            profiler.end_frame(duration)
+        env.memory.end_frame()
+        # Frames are stored even if unchanged, but only changed ones would be written to LEDs
+        if screen.flush(screen):
+            updates += 1
+        if writer is not None:
+            writer.write(screen)
+
+    if writer is not None:
+        writer.close()
+
+    env.close()
+
+    stats = {"name": name, "frames": frames, "updates": updates, "time": elapsed, "fps": frames / elapsed if elapsed > 0 else float("inf")}
+    stats.update(env.memory.report())
+
+    return stats
+
+def play(frames, writer=None, seed=None, width=20, height=20, backend="numpy", routes=None, framerate=10, memory=None):
+    """Runs all tiles in the order chosen by the device scheduler (core/scheduler.lua) using the playlist that
+    manage.py uploads, without a window, without transitions and without any delay. The same seed replays the
+    same schedule. Returns the schedule, a list with the first frame, name, number of frames and the time spent
+    switching to each tile (starting it and rendering its first frame), and timing and memory statistics."""
+    from _manifest import playlist, format_playlist
+
+    if seed is not None:
+        random.seed(seed)
+
+    entries = playlist(root)
+    search = [os.path.join(root, "tiles", e["name"][len("tile_"):]) for e in entries]
+
+    env = Environment(root, search + [os.path.join(root, "core")])
+
+    _install(env, backend, routes=routes)
+    env.memory.budget = memory
+
+    env.lua.execute('package.loaded["scheduler"] = dofile("%s")' % os.path.join(root, "core", "scheduler.lua"))
+
+    # Tiles are loaded with require by their device names, the loaders are not counted as the device reads files
+    with env.memory.excluded():
+        preload = env.lua.eval("package.preload")
+        for entry, directory in zip(entries, search):
+            preload[entry["name"].encode("utf-8")] = env.lua.eval('loadfile("%s")' % os.path.join(directory, "main.lua"))
+
+    names = env.lua.table(*[entry["name"].encode("utf-8") for entry in entries])
+    scheduler = env.lua.eval("Scheduler").create(names, env.lua.execute(format_playlist(entries)), framerate)
+    screen = env.lua.eval('Screen.create(%d, %d)' % (width, height))
+
+    schedule = []
+    state = None
+    elapsed = 0
+    slowest = 0
+    updates = 0
+
+    for frame in range(frames):
+        env.memory.begin_frame()
+        start = time.perf_counter()
+        if state is None:
+            started = scheduler.start(scheduler)
+            if started is None:
+                raise RuntimeError("No tiles to show")
+            entry, main = started
+            schedule.append([frame, entry[b"name"].decode("utf-8"), 0, 0])
+            screen.clear(screen)
+        env.dispatch()
+        state = main(state, screen)
+        if schedule[-1][2] == 0:
+            schedule[-1][3] = time.perf_counter() - start
+        schedule[-1][2] += 1
+        # The tile is replaced on the next frame when it ends or its time is up
+        if scheduler.tick(scheduler):
+            state = None
+        duration = time.perf_counter() - start
+        elapsed += duration
+        slowest = max(slowest, duration)
+        env.memory.end_frame()
+        if screen.flush(screen):
+            updates += 1
+        if writer is not None:
+            writer.write(screen)
+
+    if writer is not None:
+        writer.close()
+
+    env.close()
+
+    stats = {"name": "playlist", "frames": frames, "updates": updates, "time": elapsed, "fps": frames / elapsed if elapsed > 0 else float("inf"),
+        "slowest": slowest, "switch": max(s[3] for s in schedule)}
+    stats.update(env.memory.report())
+
+    return schedule, stats
+
+class SerialLine():
+    """Serial port of an emulated device, a pseudo terminal that manage.py and terminal programs open like the
+    USB serial adapter of a board. Output is dropped while nobody reads it."""
+
+    def __init__(self) -> None:
+        import tty
+
+        self._master, self._slave = os.openpty()
+        # The device echoes input itself, the slave end is kept open so that programs can reconnect
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self.name = os.ttyname(self._slave)
+
+    def receive(self, timeout):
+        """Returns data received within the timeout, an empty string if there is none"""
+        readable, _, _ = select.select([self._master], [], [], timeout)
+        if not readable:
+            return b""
+        try:
+            return os.read(self._master, 4096)
+        except (BlockingIOError, OSError):
+            return b""
+
+    def write(self, data):
+        try:
+            os.write(self._master, data)
+        except (BlockingIOError, OSError):
+            pass
+
+    def close(self):
+        os.close(self._master)
+        os.close(self._slave)
+
+class TelnetLine():
+    """TCP port of an emulated device that serves the interpreter to one connection at a time, like the telnet
+    server manage.py connects to with host:port. A later connection replaces the earlier one. With hangup set,
+    the first connection is closed once that many bytes were received, as if the link broke off."""
+
+    def __init__(self, host="127.0.0.1", port=9091, hangup=None) -> None:
+        self._server = socket.create_server((host, port))
+        self._connection = None
+        self._hangup = hangup
+        self._received = 0
+        self.name = "%s:%d" % self._server.getsockname()[:2]
+
+    def receive(self, timeout):
+        """Returns data received within the timeout, an empty string if there is none"""
+        sockets = [self._server] + ([self._connection] if self._connection is not None else [])
+        readable, _, _ = select.select(sockets, [], [], timeout)
+        if self._server in readable:
+            self._disconnect()
+            self._connection, _ = self._server.accept()
+            # The interpreter echoes input byte by byte
+            self._connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return b""
+        if not readable:
+            return b""
+        try:
+            data = self._connection.recv(4096)
+        except OSError:
+            data = b""
+        if self._hangup is not None and data:
+            self._received += len(data)
+            if self._received >= self._hangup:
+                self._hangup = None
+                data = b""
+        if not data:
+            self._disconnect()
+        return data
+
+    def write(self, data):
+        if self._connection is None:
+            return
+        try:
+            self._connection.sendall(data)
+        except OSError:
+            self._disconnect()
+
+    def _disconnect(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def close(self):
+        self._disconnect()
+        self._server.close()
+
+class Device():
+    """Boots the unmodified core on an emulated device: init.lua starts main.lua, which finds the tiles and runs
+    them with its own timers. The flash holds the files that manage.py uploads, with sprite sheets as sprites.py
+    last converted them, and keeps files written by scripts across restarts. Timers and wifi events follow a
+    virtual clock that can run faster than real time. Errors in callbacks are passed to the handler set with
+    node.setonerror, without one the device restarts. Buffers written to the LEDs are passed to the writer.
+
+    With a serial line (or a TelnetLine) the device runs the interactive interpreter of the firmware on it, so
+    that manage.py can work with it as with a board. Bytes passed to uart.on callbacks at the offsets to corrupt or drop are
+    flipped or lost, e.g. to try out retransmissions of binary uploads."""
+
+    PRINT = """
+    function(write)
+        print = function(...)
+            local parts = {}
+            for i = 1, select("#", ...) do parts[i] = tostring((select(i, ...))) end
+            write(table.concat(parts, "\t"))
+        end
+    end
+    """
+
+    # Runs a line entered on the console, returns false if the statement continues on the next line
+    INTERPRET = """
+    function(line)
+        local f, e = load((line:gsub("^=", "return ")), "stdin")
+        if f == nil then
+            if e:sub(-5) == "<eof>" then return false end
+            print(e)
+            return true
+        end
+        local result = table.pack(pcall(f))
+        if not result[1] then
+            print(result[2])
+        elseif result.n > 1 then
+            print(table.unpack(result, 2, result.n))
+        end
+        return true
+    end
+    """
+
+    # Boot reason after node.restart() or an unhandled error, a software restart
+    RESTART = (2, 4)
+
+    def __init__(self, width=20, height=20, backend="numpy", routes=None, memory=None, ssid=None, writer=None, console=print,
+            line=None, corrupt=(), drop=()) -> None:
+        from _manifest import device_files, playlist, format_playlist
+
+        self.width = width
+        self.height = height
+        self.clock = Clock()
+        self.boots = []
+        self.errors = []
+        self.switches = []
+        self.writes = 0
+        self.halted = None
+        self._backend = backend
+        self._routes = routes
+        self._memory = memory
+        self._ssid = ssid
+        self._writer = writer
+        self._console = console
+        self._line = line
+        self._corrupt = set(corrupt)
+        self._drop = set(drop)
+        self._received = 0
+        self._input = bytearray()
+        self._statement = b""
+        self._previous = None
+        self._timebase = None
+        self._env = None
+        self._node = None
+        self._hooked = False
+        self._written = 0
+        self._stall = (0, 0)
+        self._peak = 0
+        self._cwd = os.getcwd()
+
+        self.flash = tempfile.mkdtemp(prefix="flash")
+        for name, path in device_files(root).items():
+            shutil.copyfile(path, os.path.join(self.flash, name))
+        with open(os.path.join(self.flash, "playlist.lua"), "w", encoding="utf-8") as handle:
+            handle.write(format_playlist(playlist(root)))
+        if ssid is not None:
+            with open(os.path.join(self.flash, "_config.lua"), "w") as handle:
+                handle.write("WIFI_SSID = %s\nWIFI_PASSWORD = \"\"\n" % json.dumps(ssid))
+
+    @property
+    def env(self) -> Environment:
+        return self._env
+
+    def boot(self, reason=(1, 0)):
+        """Starts the device from scratch with a new Lua state and runs init.lua like the firmware does"""
+        if self._env is not None:
+            self._shutdown()
+            # The tile that was shown ends with the restart
+            self.switches.append((self.clock.now, None))
+
+        self.clock.clear()
+        self.boots.append((self.clock.now, reason))
+        self.halted = None
+        self._hooked = False
+
+        env = Environment(self.flash, [self.flash], storage=self.flash)
+        _modules(env, self._backend, routes=self._routes)
+        self._node = Node(env, reason)
+        env.lua.globals()[b"node"] = self._node
+        env.lua.globals()[b"tmr"] = Tmr(env, self.clock)
+        env.lua.globals()[b"ws2812"] = WS2812(env, self._write)
+        env.lua.globals()[b"wifi"] = Wifi(env, self.clock, self._ssid.encode("utf-8") if self._ssid is not None else None)
+        env.lua.globals()[b"mdns"] = MDNS(env)
+        self._uart = UART(env, self._send)
+        env.lua.globals()[b"uart"] = self._uart
+        env.lua.eval(self.PRINT)(self._print)
+        env.memory.budget = self._memory
+        self._env = env
+        self._interpret = env.lua.eval(self.INTERPRET)
+        self._input.clear()
+        self._statement = b""
+
+        # Everything loaded by the core is counted
+        env.memory.baseline()
+        self._call(env.lua.eval("dofile"), b"init.lua")
+        self._send(b"> ")
+
+    def run(self, duration, speed=0):
+        """Advances the virtual clock by the given number of seconds, running callbacks as they are due. With a
+        speed of 0 the clock runs as fast as possible, otherwise at the given multiple of real time."""
+        if self._env is None:
+            self.boot()
+        elif self._node.restarting:
+            self.boot(self.RESTART)
+
+        end = self.clock.now + duration * 1000
+        self._timebase = (time.perf_counter(), self.clock.now, speed)
+
+        while True:
+            deadline = self.clock.next()
+            due = deadline is not None and deadline <= end
+            # With a serial line the device keeps waiting for commands until the end
+            if not due and self._line is None:
+                break
+            if speed > 0 and self._wait(deadline if due else end):
+                # Commands may have queued calls that are due before the one waited for
+                pass
+            elif not due:
+                break
+            else:
+                function, args = self.clock.advance()
+                self._call(function, *args)
+                self._call(self._env.dispatch)
+            self._hook()
+            if self._node.restarting:
+                self.boot(self.RESTART)
+
+        # Nothing is scheduled any more, the device only reacts to network traffic
+        if self.clock.next() is None and self.halted is None:
+            self.halted = self.clock.now
+        self.clock.now = max(self.clock.now, end)
+
+    def report(self):
+        """Returns the virtual time, boots, errors, LED writes, the longest time without a write and the time the
+        device halted in seconds, the number of times each tile was shown and for how long"""
+        stall, since = self._stall
+        if self.clock.now - self._written > stall:
+            stall, since = self.clock.now - self._written, self._written
+
+        tiles = {}
+        ends = [switch[0] for switch in self.switches[1:]] + [self.clock.now]
+        for (start, name), end in zip(self.switches, ends):
+            if name is not None:
+                tile = tiles.setdefault(name, {"shown": 0, "time": 0})
+                tile["shown"] += 1
+                tile["time"] += (end - start) / 1000
+
+        report = {"name": "device", "time": self.clock.now / 1000, "boots": len(self.boots), "errors": len(self.errors),
+            "writes": self.writes, "stall": stall / 1000, "stall_start": since / 1000,
+            "halted": self.halted / 1000 if self.halted is not None else None, "tiles": tiles}
+        if self._memory is not None:
+            report["memory"] = max(self._peak, self._env.memory.report()["memory"] if self._env is not None else 0)
+        return report
+
+    def close(self):
+        if self._env is not None:
+            self._shutdown()
+            self._env = None
+        if self._writer is not None:
+            self._writer.close()
+        # The environment works in the flash directory
+        os.chdir(self._cwd)
+        shutil.rmtree(self.flash, ignore_errors=True)
+
+    def _shutdown(self):
+        if self._memory is not None:
+            self._peak = max(self._peak, self._env.memory.report()["memory"])
+        self._env.close()
+
+    def _call(self, function, *args):
+        memory = self._env.memory
+        if memory.budget is not None:
+            memory.begin_frame()
+        error = None
+        result = None
+        try:
+            result = function(*args)
+        except Exception as e:
+            error = str(e)
+        if memory.budget is not None:
+            try:
+                memory.end_frame()
+            except MemoryBudgetError as e:
+                # On the device the allocation itself fails
+                error = error or "not enough memory (%s)" % e
+        if error is not None:
+            self._fail(error)
+        return result
+
+    def _fail(self, message):
+        self.errors.append((self.clock.now, message))
+        handler = self._node.onerror
+        if handler is not None:
+            try:
+                handler(message.encode("utf-8"))
+                return
+            except Exception as e:
+                self.errors.append((self.clock.now, str(e)))
+        self._print(message.encode("utf-8"))
+        self._node.restart()
+
+    def _wait(self, target):
+        # Network events and input on the serial line are handled while waiting for the given virtual time,
+        # returns True as soon as input was received
+        start, origin, speed = self._timebase
+        deadline = start + (target - origin) / 1000 / speed
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return False
+            if self._line is None:
+                time.sleep(min(remaining, 0.01))
+            else:
+                data = self._line.receive(min(remaining, 0.01))
+                if data:
+                    self.clock.now = max(self.clock.now, origin + (time.perf_counter() - start) * speed * 1000)
+                    self._receive(data)
+                    return True
+            self._call(self._env.dispatch)
+
+    def _receive(self, data):
+        # Input goes to the uart callback or to the interpreter, which echoes it and runs complete lines
+        i, delivered = 0, 0
+        while i < len(data) and not self._node.restarting:
+            uart = self._uart
+            if uart.callback is not None and i >= delivered:
+                interpret = uart.interpret
+                for chunk in uart.receive(self._garble(data[i:])):
+                    self._call(uart.callback, chunk)
+                if not interpret:
+                    return
+                delivered = len(data)
+            byte = data[i:i + 1]
+            i += 1
+            previous, self._previous = self._previous, byte
+            if byte == b"\n" and previous == b"\r":
+                continue
+            self._send(byte)
+            if byte not in b"\r\n":
+                self._input += byte
+                continue
+            self._send(b"\n")
+            statement = self._statement + bytes(self._input)
+            self._input.clear()
+            if self._call(self._interpret, statement) is False:
+                self._statement = statement + b"\n"
+                self._send(b">> ")
+            else:
+                self._statement = b""
+                self._send(b"> ")
+
+    def _garble(self, data):
+        # Bytes are counted from the first one passed to a uart callback
+        first = self._received
+        self._received += len(data)
+        if not any(first <= offset < self._received for offset in self._corrupt | self._drop):
+            return data
+        garbled = bytearray()
+        for offset, byte in enumerate(data, first):
+            if offset not in self._drop:
+                garbled.append(byte ^ 0x01 if offset in self._corrupt else byte)
+        return bytes(garbled)
+
+    def _send(self, data):
+        if self._line is not None:
+            self._line.write(data)
+
+    def _hook(self):
+        # Tile switches are recorded by wrapping Scheduler.start once main.lua has loaded the scheduler
+        if self._hooked:
+            return
+        scheduler = self._env.lua.globals()[b"Scheduler"]
+        if scheduler is None:
+            return
+        start = scheduler[b"start"]
+
+        def hooked(this, index=None):
+            result = start(this, index)
+            if result is not None:
+                self.switches.append((self.clock.now, result[0][b"name"].decode("utf-8")))
+            return result
+
+        scheduler[b"start"] = hooked
+        self._hooked = True
+
+    def _write(self, buffer):
+        if self.clock.now - self._written > self._stall[0]:
+            self._stall = (self.clock.now - self._written, self._written)
+        self._written = self.clock.now
+        self.writes += 1
+        if self._writer is not None:
+            self._writer.write(types.SimpleNamespace(buffer=buffer, width=self.width, height=self.height))
+
+    def _print(self, text):
+        self._console("%10.3f %s" % (self.clock.now / 1000, text.decode("utf-8", "replace")))
+        self._send(text + b"\n")
+
+def find_tiles():
+    """Lists names of all tiles in the tiles directory"""
+    tiles_root = os.path.join(root, "tiles")
+    return sorted([e for e in os.listdir(tiles_root) if os.path.isfile(os.path.join(tiles_root, e, "main.lua"))])
+
+_extensions = {"raw": ".grb", "png": "", "gif": ".gif"}
+
+def _render_worker(name, frames, output, format, scale, speed, backend, profile, budget, fixtures, memory):
+    writer = None
+    if output is not None:
+        writer = create_writer(os.path.join(output, name + _extensions[format]), format, scale, speed)
+    profiler = Profiler(name, budget) if profile is not None else None
+    server = FixtureServer(fixtures) if fixtures is not None else None
+    try:
+        stats = render(name, frames, writer, backend=backend, profiler=profiler, routes=server.routes() if server else None, memory=memory)
+    finally:
+        if server is not None:
+            server.close()
+    if profiler is not None:
+        profiler.save(profile)
+        stats["over_budget"] = len(profiler.report()["over_budget"])
+    return stats
+
+def render_all(names, frames, output=None, format="raw", scale=1, speed=10, workers=None, backend="numpy", profile=None, budget=0.1, fixtures=None, memory=None):
+    """Renders multiple tiles in parallel, each one in its own environment in a separate worker process. Frames of
+    each tile are stored to the output directory together with a summary of timing results, which are also returned
+    as a dictionary indexed by tile name. If a profile directory is given, a profiler report is stored for each tile.
+    If a fixtures directory is given, each worker answers HTTP requests from it using a FixtureServer. Tiles that
+    use more than the memory budget in bytes fail."""
+
+    # Make sure that the native library is built before workers start using it
+    if backend == "native":
+        Operations()
+
+    if output is not None:
+        os.makedirs(output, exist_ok=True)
+
+    results = {}
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_render_worker, name, frames, output, format, scale, speed, backend, profile, budget, fixtures, memory): name for name in names}
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = {"name": name, "frames": 0, "time": 0, "fps": 0, "error": str(e)}
+
+    if output is not None:
+        with open(os.path.join(output, "summary.json"), "w") as handle:
+            json.dump(results, handle, indent=2)
+
+    return results
+
+def main():
+
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Emulator for the Pixelflut firmware")
+    parser.add_argument("name", type=str, nargs="*", help="The name of the tileset to emulate, multiple tiles are rendered in parallel in headless mode")
+    parser.add_argument("-s", "--speed", type=int, default=10, help="The speed of the emulator (FPS)")
+    parser.add_argument("-n", "--frames", type=int, default=0, help="Render the given number of frames in headless mode as fast as possible")
+    parser.add_argument("-o", "--output", type=str, default=None, help="Store frames rendered in headless mode to a file or directory")
+    parser.add_argument("-f", "--format", choices=("raw", "png", "gif"), default="raw", help="Format of stored frames (raw GRB stream, PNG sequence or animated GIF)")
+    parser.add_argument("--scale", type=int, default=1, help="Scale factor for stored PNG and GIF frames")
+    parser.add_argument("-a", "--all", action="store_true", help="Render all available tiles in headless mode")
+    parser.add_argument("-b", "--backend", choices=("numpy", "native"), default="numpy", help="Implementation of the pixmod module (NumPy or native code compiled with GCC)")
+    parser.add_argument("-p", "--profile", type=str, default=None, help="Profile tiles in headless mode and store reports to the given directory")
+    parser.add_argument("--budget", type=float, default=100, help="Time budget for a single frame in milliseconds, used by the profiler")
+    parser.add_argument("-m", "--memory", type=float, default=None, help="Device memory budget in KB, rendering a tile fails if it uses more")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes used for rendering multiple tiles")
+    parser.add_argument("--stream", type=str, action="append", default=[], help="Stream frames to a panel running the stream tile, given as udp://host:port or tcp://host:port, can be repeated")
+    parser.add_argument("--keyframe", type=int, default=50, help="Number of frames between streamed keyframes")
+    parser.add_argument("--playlist", action="store_true", help="Render all tiles in headless mode in the order chosen by the device scheduler")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for random numbers, the playlist is replayed in the same order with the same seed")
+    parser.add_argument("--device", type=float, default=None, help="Boot the full core on an emulated device and run it in headless mode for the given number of seconds of virtual time")
+    parser.add_argument("--clock", type=float, default=0, help="Speed of the virtual clock of the device relative to real time, 0 runs it as fast as possible")
+    parser.add_argument("--wifi", type=str, default=None, help="Name of the access point the emulated device is configured to connect to")
+    parser.add_argument("--serial", action="store_true", help="Run the interpreter of the emulated device on a pseudo terminal, which manage.py can use as the port of a board")
+    parser.add_argument("--telnet", type=str, default=None, help="Run the interpreter of the emulated device on a TCP port given as [host:]port, which manage.py can use as host:port")
+    parser.add_argument("--hangup", type=int, default=None, help="Close the first connection to the telnet port after the given number of received bytes")
+    parser.add_argument("--corrupt", type=int, action="append", default=[], help="Flip the byte at the given offset of the data received by uart.on callbacks of the device, can be repeated")
+    parser.add_argument("--drop", type=int, action="append", default=[], help="Drop the byte at the given offset of the data received by uart.on callbacks of the device, can be repeated")
+    parser.add_argument("--offline", type=str, nargs="?", default=None, const=os.path.join(root, "tools", "fixtures"), help="Answer HTTP requests from a fixtures directory instead of the network")
+
+    args = parser.parse_args()
+
+    names = find_tiles() if args.all else args.name
+
+    if len(names) == 0 and not args.playlist and args.device is None:
+        parser.error("No tiles given")
+
+    profile = os.path.abspath(args.profile) if args.profile is not None else None
+    budget = args.budget / 1000
+    memory = int(args.memory * 1024) if args.memory is not None else None
+
+    def print_stats(stats):
+        if "error" in stats:
+            print("%s: failed (%s)" % (stats["name"], stats["error"]))
+            return
+        print("%s: %d frames in %.3fs (%.1f FPS), %d changed" % (stats["name"], stats["frames"], stats["time"], stats["fps"], stats["updates"]))
+        print("%s: %.1f KB peak memory, up to %.1f KB allocated per frame (%.1f KB of buffers), %d files open" % (stats["name"],
+            stats["memory"] / 1024, stats["allocated"] / 1024, stats["buffers_allocated"] / 1024, stats["files"]))
+        if "over_budget" in stats:
+            print("%s: %d frames over the %.0f ms budget" % (stats["name"], stats["over_budget"], args.budget))
+
+    if args.device is not None:
+        if names or args.playlist:
+            parser.error("The device runs all tiles with its own scheduler")
+        if args.stream and args.output is not None:
+            parser.error("Frames can either be streamed or stored")
+        if args.seed is not None:
+            random.seed(args.seed)
+        server = FixtureServer(os.path.abspath(args.offline)) if args.offline is not None else None
+        writer = None
+        if args.output is not None:
+            writer = create_writer(os.path.abspath(args.output), args.format, args.scale, args.speed)
+        if args.stream:
+            writer = StreamWriter(args.stream, args.keyframe, args.speed)
+        line = None
+        if args.serial or args.telnet is not None:
+            if args.serial and args.telnet is not None:
+                parser.error("The interpreter runs either on a serial line or on a telnet port")
+            if args.clock <= 0:
+                parser.error("The serial line needs a clock that follows real time, see --clock")
+            if args.serial:
+                line = SerialLine()
+            else:
+                host, _, port = args.telnet.rpartition(":")
+                line = TelnetLine(host or "127.0.0.1", int(port), args.hangup)
+            print("device: serial line on %s" % line.name, flush=True)
+        device = Device(backend=args.backend, routes=server.routes() if server else None, memory=memory, ssid=args.wifi, writer=writer,
+            line=line, corrupt=args.corrupt, drop=args.drop)
+        start = time.perf_counter()
+        try:
+            device.run(args.device, args.clock)
+        finally:
+            device.close()
+            if server is not None:
+                server.close()
+            if line is not None:
+                line.close()
+        report = device.report()
+        print("device: %.1f s in %.1f s, %d boots, %d errors, %d LED writes" % (report["time"], time.perf_counter() - start,
+            report["boots"], report["errors"], report["writes"]))
+        print("device: longest time without LED writes %.1f s, starting at %.1f s" % (report["stall"], report["stall_start"]))
+        if "memory" in report:
+            print("device: %.1f KB peak memory" % (report["memory"] / 1024))
+        for name, tile in sorted(report["tiles"].items()):
+            print("%-20s shown %3d times, %8.1f s" % (name, tile["shown"], tile["time"]))
+        if report["halted"] is not None:
+            print("device: halted at %.1f s" % report["halted"])
+        # Restarts, unhandled errors and halts fail the run, so that it can be used to check for regressions. On a
+        # serial line they are usually caused by the commands.
+        if line is None and (report["boots"] > 1 or report["errors"] > 0 or report["halted"] is not None):
+            sys.exit(-1)
+        return
+
+    if args.playlist:
+        if args.frames < 1 or names:
+            parser.error("The playlist is rendered in headless mode instead of the given tiles")
+        if args.stream and args.output is not None:
+            parser.error("Frames can either be streamed or stored")
+        server = FixtureServer(os.path.abspath(args.offline)) if args.offline is not None else None
+        writer = None
+        if args.output is not None:
+            writer = create_writer(os.path.abspath(args.output), args.format, args.scale, args.speed)
+        if args.stream:
+            writer = StreamWriter(args.stream, args.keyframe, args.speed)
+        try:
+            schedule, stats = play(args.frames, writer, args.seed, backend=args.backend, routes=server.routes() if server else None, framerate=args.speed, memory=memory)
+        except MemoryBudgetError as e:
+            print_stats({"name": "playlist", "error": str(e)})
+            sys.exit(-1)
+        finally:
+            if server is not None:
+                server.close()
+        for first, name, count, switch in schedule:
+            print("%6d %-20s %6d frames, switched in %.1f ms" % (first, name, count, switch * 1000))
+        print_stats(stats)
+        print("%s: slowest frame %.1f ms, slowest switch %.1f ms" % (stats["name"], stats["slowest"] * 1000, stats["switch"] * 1000))
+        return
+
+    if len(names) > 1:
+        if args.frames < 1:
+            parser.error("Multiple tiles can only be rendered in headless mode")
+        if args.stream:
+            parser.error("Only a single tile can be streamed")
+        output = os.path.abspath(args.output) if args.output is not None else None
+        fixtures = os.path.abspath(args.offline) if args.offline is not None else None
+        results = render_all(names, args.frames, output, args.format, args.scale, args.speed, args.jobs, args.backend, profile, budget, fixtures, memory)
+        for name in names:
+            print_stats(results[name])
+        if any("error" in stats for stats in results.values()):
+            sys.exit(-1)
+        return
+
+    name = names[0]
+
+    server = FixtureServer(os.path.abspath(args.offline)) if args.offline is not None else None
+    routes = server.routes() if server is not None else None
+
+    if args.stream and args.output is not None:
+        parser.error("Frames can either be streamed or stored")
+
+    if args.frames > 0:
+        writer = None
+        if args.output is not None:
+            writer = create_writer(os.path.abspath(args.output), args.format, args.scale, args.speed)
+        if args.stream:
+            writer = StreamWriter(args.stream, args.keyframe, args.speed)
+        profiler = Profiler(name, budget) if profile is not None else None
+        try:
+            stats = render(name, args.frames, writer, backend=args.backend, profiler=profiler, routes=routes, memory=memory)
+        except MemoryBudgetError as e:
+            print_stats({"name": name, "error": str(e)})
+            sys.exit(-1)
+        if profiler is not None:
+            profiler.save(profile)
+            stats["over_budget"] = len(profiler.report()["over_budget"])
+        print_stats(stats)
+        return
+
+    env, main, screen = load_tile(name, backend=args.backend, routes=routes)
+
     state = None
 
+    writer = StreamWriter(args.stream, args.keyframe, args.speed) if args.stream else None
+
     delay = int(1000 / args.speed) if args.speed > 0 else 0
 
     while True:
+        env.dispatch()
         state = main(state, screen)
 
-        image = np.reshape(screen.buffer._buffer, (screen.height, screen.width, 3))
-        image = image[:, :, (1, 0, 2)] # We are working with GRB ordering
-        image = cv.cvtColor(image, cv.COLOR_RGB2BGR)
-        image = cv.resize(image, (400, 400), -1, -1, interpolation=cv.INTER_NEAREST)
+        if writer is not None:
+            writer.write(screen)
 
-        cv.imshow("Screen", image)
+        # Only changed frames are displayed again, the window keeps showing the last one
+        if screen.flush(screen):
+            image = cv.cvtColor(frame_image(screen), cv.COLOR_RGB2BGR)
+            image = cv.resize(image, (400, 400), -1, -1, interpolation=cv.INTER_NEAREST)
+            cv.imshow("Screen", image)
 
         if cv.waitKey(delay) == 27:
             break
 
-
-if __name__ == "__main__":
-    main()
+    if writer is not None:
+        writer.close()
 
 
+if __name__ == "__main__":
+    main()
\ No newline at end of file
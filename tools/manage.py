@@ -9,9 +9,11 @@ import traceback
 import argparse
 import os
 import logging
-from time import sleep
 from cmd import Cmd
 
+from _transport import create_transport
+from _manifest import core_files, device_files, playlist, format_playlist
+
 
 logger = logging.getLogger("manage")
 
@@ -81,16 +83,18 @@ def progress(iteration, total, prefix = '', suffix = '', decimals = 1, length =
     if iteration == total: 
         print()
 
-def command(serial, data, check=True):
+def command(transport, data, check=True, wait=True):
     if isinstance(data, str):
         data = data.encode("utf-8")
 
-    if serial.inWaiting() > 0:
-        serial.flushInput()
-    serial.write(data)
-    sleep(0.05)
+    if transport.inWaiting() > 0:
+        transport.flushInput()
+    transport.write(data)
     if check:
-        _echocheck(serial, data)
+        _echocheck(transport, data)
+    if wait:
+        # Returns as soon as the prompt shows up instead of waiting for a timeout
+        return transport.response(None if check else data).decode("utf-8", "replace")
 
 def _echocheck(serial, expected):
     i = 0
@@ -102,16 +106,6 @@ def _echocheck(serial, expected):
         i+=1
         keep += char
 
-def _read(transport):
-    buffer = bytearray()
-    while True:
-        char = transport.read(1)
-        if len(char) == 0:
-            break
-        buffer += char
-
-    return buffer.decode("utf-8").strip()
-
 def find_tiles(root):
     import json
     from os.path import isdir, isfile, join
@@ -134,15 +128,8 @@ def find_tiles(root):
 
 
 def run_info(transport):
-    transport.raw("=node.chipid()\r", 0)
-    id=""
-    while True:
-        char = transport.read(1)
-        if char == '' or char == chr(62):
-            break
-        if char.isdigit():
-            id += char
-    print("\n"+id)
+    response = command(transport, "=node.chipid()\r")
+    print("".join(char for char in response if char.isdigit()))
 
 def run_wifi_config(transport, ssid, passphrase):
 
@@ -156,9 +143,44 @@ def run_hostname_config(transport, name):
     push(transport, name, "hostname")
 
 
-def push(transport, content, name):
+def _verify(transport, name, content):
     import hashlib
 
+    sha1 = hashlib.sha1()
+    sha1.update(content)
+    inhash = sha1.hexdigest()
+
+    outhash = command(transport, 'print(encoder.toHex(crypto.fhash("sha1","%s"))) \r' % name)
+    outhash = outhash.split("\n")[0].strip()
+
+    if inhash != outhash:
+        raise IOError("File copy failed %s != %s" % (inhash, outhash))
+
+def _pipeline(transport, commands, window, done):
+    """Sends commands without waiting for the previous ones to finish, with at most window of them in
+    flight, and calls done with the index of every command that finished without output"""
+    import asyncio
+    from _transport import AsyncTransport
+
+    async def send(pipeline, i, data):
+        response = await pipeline.command(data)
+        if len(response) > 0:
+            raise IOError("Command failed: %s" % response.decode("utf-8", "replace"))
+        done(i)
+
+    async def run():
+        pipeline = AsyncTransport(transport, window)
+        try:
+            await asyncio.gather(*[send(pipeline, i, data) for i, data in enumerate(commands)])
+        finally:
+            pipeline.close()
+
+    if transport.inWaiting() > 0:
+        transport.flushInput()
+    asyncio.run(run())
+
+def push(transport, content, name, report=progress, window=1):
+
     transport.timeout = 3
     transport.interCharTimeout = 3
 
@@ -167,44 +189,139 @@ def push(transport, content, name):
     if isinstance(content, str):
         content = content.encode("utf-8")
 
-    sha1 = hashlib.sha1()
-    sha1.update(content)
-    inhash = sha1.hexdigest()
-
     command(transport, "if run then run(-1) end\r", False)
 
     command(transport, "file.open(\"" + name + "\", \"w\")\r")
  
-    position = 0
+    writes = []
+    for position in range(0, len(content), buffer_len):
+        bytes = ["%d" % i for i in content[position:position+buffer_len]]
+        writes.append("file.write(string.char(" + ",".join(bytes) + "))\r")
 
-    while position < len(content):
-        bytes = ["%d" % i for i in content[position:min(len(content), position+buffer_len)]]
-        command(transport, "file.write(string.char(" + ",".join(bytes) + "))\r")
-        position += buffer_len
-        progress(position, len(content), prefix="Copy", length=10)
+    written = lambda i: report(min((i + 1) * buffer_len, len(content)), len(content), prefix="Copy", length=10)
+
+    if window > 1:
+        # Every write is a round trip, keeping a few of them in flight hides the latency of the link
+        _pipeline(transport, writes, window, written)
+    else:
+        for i, data in enumerate(writes):
+            command(transport, data)
+            written(i)
 
     command(transport, "file.flush()\r")
     command(transport, "file.close()\r")
-    command(transport, 'print(encoder.toHex(crypto.fhash("sha1","%s"))) \r' % name)
 
-    outhash = _read(transport)
-    outhash = outhash.split("\n")[0].strip()
+    _verify(transport, name, content)
+
+# Receiver for binary uploads, takes over the UART until the whole file is received. Every block is
+# followed by its SHA1 digest and acknowledged with A if the digest matches or N if the block has to be
+# sent again. Incomplete blocks are dropped after a timeout. Lines are kept short because of the
+# limited input buffer of the interpreter.
+RECEIVER = [
+    '_rx=function(n,s,b)',
+    'local f,q,d,t=file.open(n,"w"),"",0,tmr.create()',
+    'local function k() return math.min(b,s-d)+20 end',
+    't:register(500,tmr.ALARM_SEMI,function() if #q>0 then q="" uart.write(0,"N") end end)',
+    'uart.on("data",0,function(x)',
+    't:stop() q=q..x',
+    'while d<s and #q>=k() do',
+    'local m=k() local c=q:sub(1,m-20)',
+    'if crypto.hash("sha1",c)==q:sub(m-19,m) then f:write(c) d=d+#c uart.write(0,"A") else uart.write(0,"N") end',
+    'q=q:sub(m+1)',
+    'end',
+    'if d>=s then f:close() uart.on("data") _rx=nil uart.write(0,"D") else t:start() end',
+    'end,0)',
+    'uart.write(0,"R")',
+    'end'
+]
+
+def _expect(transport, accepted):
+    # Skips anything that is not a protocol response, e.g. prompts of the interpreter
+    while True:
+        char = transport.read(1)
+        if len(char) == 0:
+            return None
+        if char in accepted:
+            return char
 
-    if inhash != outhash:
-        raise IOError("File copy failed %s != %s" % (inhash, outhash))
+def push_fast(transport, content, name, block=1024, retries=5, report=progress):
+    import hashlib
+
+    transport.timeout = 3
+    transport.interCharTimeout = 3
+
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+
+    if len(content) == 0:
+        push(transport, content, name, report)
+        return
+
+    command(transport, "if run then run(-1) end\r", False)
+
+    for line in RECEIVER:
+        command(transport, line + "\r")
+
+    command(transport, '_rx("%s",%d,%d)\r' % (name, len(content), block), wait=False)
+
+    if _expect(transport, b"R") is None:
+        raise IOError("Receiver did not start")
+
+    position = 0
+
+    while position < len(content):
+        data = content[position:min(len(content), position+block)]
+        for _ in range(retries):
+            transport.write(data + hashlib.sha1(data).digest())
+            reply = _expect(transport, b"AN")
+            if reply == b"A":
+                break
+            if reply is None:
+                # Wait for the receiver to drop the incomplete block
+                _expect(transport, b"N")
+        else:
+            raise IOError("Block at position %d was not accepted" % position)
+        position += len(data)
+        report(position, len(content), prefix="Copy", length=10)
+
+    if _expect(transport, b"D") is None:
+        raise IOError("Receiver did not finish")
 
-def copy(transport, source, name=None):
+    _verify(transport, name, content)
+
+def copy(transport, source, name=None, fast=False, block=1024, report=progress, compile=False, window=1):
 
     if name is None:
         name = os.path.basename(source)
 
     with open(source, "rb") as filehandle:
-        push(transport, filehandle.read(), name)
+        if fast:
+            push_fast(transport, filehandle.read(), name, block, report=report)
+        else:
+            push(transport, filehandle.read(), name, report, window)
+
+    if not name.endswith(".lua"):
+        return
+    # The boot script is only run in source form. A compiled file of an older version would be loaded
+    # instead of the new source.
+    if compile and name != "init.lua":
+        run_compile(transport, name)
+    else:
+        command(transport, 'file.remove("%s")\r' % compiled_name(name))
+
+def compiled_name(name):
+    return os.path.splitext(name)[0] + ".lc"
+
+def run_compile(transport, name):
+    # The source is kept next to the compiled file, which is loaded first, so that sync can compare it
+    response = command(transport, 'node.compile("%s")\r' % name)
+    if len(response) > 0:
+        raise IOError("Compiling %s failed: %s" % (name, response))
 
 @exception_catch
-def run_copy(transport, source, name=None):
+def run_copy(transport, source, name=None, fast=False, block=1024, compile=False, window=1):
 
-    copy(transport, source, name)
+    copy(transport, source, name, fast, block, compile=compile, window=window)
 
 @exception_catch
 def run_remove(transport, name):
@@ -222,7 +339,7 @@ def run_terminal(transport):
 
         while True:
 
-            terminal = Miniterm(transport, echo=False, filters=["default"])
+            terminal = Miniterm(transport.serial, echo=False, filters=["default"])
             terminal.exit_character = chr(0x1b)
             terminal.raw = False
             terminal.set_rx_encoding("UTF-8")
@@ -248,35 +365,207 @@ def run_format(transport):
 
 @exception_catch
 def run_restart(transport):
-    command(transport, "node.restart()\r", False)
+    command(transport, "node.restart()\r", False, False)
 
 def run_list(transport):
 
-    command(transport, "local l = file.list();for k,v in pairs(l) do print(k..' ('..v .. ' bytes)'); end\r", False)
-    file_list = []
-    fn = bytearray()
-    while True:
-        char = transport.read(1)
-        if len(char) == 0 or char[0] == 62:
-            break
-        if char not in [b'\r', b'\n']:
-            fn += char
-        else:
-            if len(fn) > 0:
-                name = fn.decode("utf-8").strip()
-                file_list.append(name)
-            fn = bytearray()
+    response = command(transport, "local l = file.list();for k,v in pairs(l) do print(k..' ('..v .. ' bytes)'); end\r")
+    file_list = [line.strip() for line in response.split("\n") if len(line.strip()) > 0]
 
     for item in file_list:
         print(item)
 
+# Files with device specific configuration that are never considered stale
+PRESERVED = ["hostname", "_config.lua"]
+
+def manifest(base, bundled=False):
+    from os.path import join
+    from sprites import build
+
+    # Sprite sheets are converted from their images first, unchanged ones come from the cache
+    build(base)
+
+    files = device_files(base)
+    files["playlist.lua"] = write_playlist(base, join(base, "build", "playlist.lua"))
+
+    if bundled:
+        # Scripts are replaced with their minified versions, tiles bundled with the core modules they load
+        import bundle
+        for name, _, _, _ in bundle.build(join(base, "build")):
+            files[name] = join(base, "build", name)
+
+    return files
+
+def write_playlist(base, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write(format_playlist(playlist(base)))
+    return path
+
+def remote_hashes(transport):
+    import re
+
+    transport.timeout = 3
+    transport.interCharTimeout = 3
+
+    response = command(transport, "for k in pairs(file.list()) do print(k..' '..encoder.toHex(crypto.fhash('sha1',k))) end\r")
+
+    pattern = re.compile(r"^(\S+) ([0-9a-f]{40})$")
+    hashes = {}
+
+    for line in response.split("\n"):
+        match = pattern.match(line.strip())
+        if match:
+            hashes[match.group(1)] = match.group(2)
+
+    return hashes
+
+def difference(transport, local, compile=False):
+    import hashlib
+
+    remote = remote_hashes(transport)
+
+    upload = []
+    for name, path in local.items():
+        with open(path, "rb") as filehandle:
+            if remote.get(name) != hashlib.sha1(filehandle.read()).hexdigest():
+                upload.append(name)
+            elif compile and name.endswith(".lua") and name != "init.lua" and compiled_name(name) not in remote:
+                upload.append(name)
+
+    # Compiled files stay as long as their sources are part of the device
+    sources = set(compiled_name(name) for name in local if name.endswith(".lua"))
+    stale = [name for name in remote if name not in local and name not in sources and name not in PRESERVED]
+
+    return upload, stale
+
+def run_sync(transport, fast=False, block=1024, dry=False, restart=False, window=1, compile=False, bundled=False):
+
+    local = manifest(os.path.join(root, ".."), bundled)
+    upload, stale = difference(transport, local, compile)
+
+    for name in upload:
+        print("Upload %s" % name)
+        if not dry:
+            copy(transport, local[name], name, fast, block, compile=compile, window=window)
+
+    for name in stale:
+        print("Remove %s" % name)
+        if not dry:
+            run_remove(transport, name)
+
+    print("%d changed, %d removed, %d unchanged" % (len(upload), len(stale), len(local) - len(upload)))
+
+    if restart and not dry and (upload or stale):
+        run_restart(transport)
+
+def read_inventory(path):
+
+    hosts = []
+
+    with open(path, "r") as handle:
+        for line in handle:
+            line = line.split("#")[0].strip()
+            if line:
+                hosts.append(line)
+
+    return hosts
+
+def deploy(host, local, prune=True, fast=False, block=1024, retries=3, restart=False, status=print, window=1):
+    import time
+
+    quiet = lambda *args, **kwargs: None
+    result = {"host": host, "uploaded": 0, "removed": 0, "attempts": 0, "error": None}
+    start = time.time()
+
+    for attempt in range(1, retries + 1):
+        result["attempts"] = attempt
+        transport = None
+        try:
+            transport = create_transport(host)
+            # Files uploaded by a failed attempt are already in place and are skipped on retry
+            upload, stale = difference(transport, local)
+            if not prune:
+                stale = []
+
+            for i, name in enumerate(upload):
+                status("%s: upload %s (%d/%d)" % (host, name, i + 1, len(upload)))
+                copy(transport, local[name], name, fast, block, report=quiet, window=window)
+                result["uploaded"] += 1
+
+            for name in stale:
+                status("%s: remove %s" % (host, name))
+                run_remove(transport, name)
+                result["removed"] += 1
+
+            if restart and (upload or stale):
+                run_restart(transport)
+
+            result["error"] = None
+            status("%s: done" % host)
+            break
+        except Exception as e:
+            result["error"] = str(e)
+            status("%s: attempt %d failed: %s" % (host, attempt, e))
+        finally:
+            if transport is not None:
+                transport.close()
+
+    result["time"] = time.time() - start
+
+    return result
+
+def run_fleet(hosts, files=None, jobs=4, retries=3, restart=False, window=4):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    if files:
+        local = {}
+        for f in files:
+            if f.find("=") != -1:
+                f, name = f.split("=")
+            else:
+                name = os.path.basename(f)
+            local[name] = f
+    else:
+        local = manifest(os.path.join(root, ".."))
+
+    lock = threading.Lock()
+
+    def status(message):
+        with lock:
+            print(message)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(deploy, host, local, not files, retries=retries, restart=restart, status=status,
+            window=window) for host in hosts]
+        results = [future.result() for future in futures]
+
+    print()
+    print("%-24s %-8s %8s %8s %8s %8s" % ("Host", "Status", "Uploaded", "Removed", "Attempts", "Time"))
+    for result in results:
+        print("%-24s %-8s %8d %8d %8d %7.1fs" % (result["host"], "failed" if result["error"] else "ok",
+            result["uploaded"], result["removed"], result["attempts"], result["time"]))
+
+    failed = [result for result in results if result["error"]]
+    for result in failed:
+        print("%s: %s" % (result["host"], result["error"]))
+
+    print("%d of %d devices updated" % (len(results) - len(failed), len(results)))
+
+    return len(failed) == 0
+
 def run_init(transport):
 
-    format(transport)
-    
-    copy(transport, os.path.join(root, "..", "core", "main.lua"))
-    copy(transport, os.path.join(root, "..", "core", "utilities.lua"))
-    copy(transport, os.path.join(root , "..", "core", "init.lua"))
+    from sprites import build
+
+    run_format(transport)
+
+    # All core modules are needed to boot, tiles are added with sync
+    base = os.path.join(root, "..")
+    build(base)
+    for name, path in core_files(base).items():
+        copy(transport, path, name)
 
     run_restart(transport)
 
@@ -301,8 +590,30 @@ def main():
     push_parser.add_argument("--force", "-f", default=False, help="Force upload even if file exists", required=False, action='store_true')
     push_parser.add_argument('-c', '--compile', action='store_true',  help='Compile lua to lc after upload')
     push_parser.add_argument('-r', '--restart', action='store_true',  help='Restart MCU after upload')
+    push_parser.add_argument('--fast', action='store_true',  help='Upload binary blocks using a receiver on the device')
+    push_parser.add_argument('--block', type=int, default=1024,  help='Block size for fast uploads')
+    push_parser.add_argument('--window', type=int, default=1,  help='Number of writes in flight')
     push_parser.add_argument('files', nargs=argparse.REMAINDER, help='Files to upload')
 
+    sync_parser = subparsers.add_parser('sync', help='Uploads changed core and tile files, removes stale ones')
+    sync_parser.add_argument('-n', '--dry-run', action='store_true',  help='Only report the differences')
+    sync_parser.add_argument('-r', '--restart', action='store_true',  help='Restart MCU if anything changed')
+    sync_parser.add_argument('--fast', action='store_true',  help='Upload binary blocks using a receiver on the device')
+    sync_parser.add_argument('--block', type=int, default=1024,  help='Block size for fast uploads')
+    sync_parser.add_argument('--window', type=int, default=1,  help='Number of writes in flight')
+    sync_parser.add_argument('-c', '--compile', action='store_true',  help='Compile lua to lc after upload')
+    sync_parser.add_argument('--bundle', action='store_true',  help='Upload minified scripts and bundled tiles built by bundle.py')
+
+    fleet_parser = subparsers.add_parser('fleet', help='Deploys to many devices over TCP in parallel')
+    fleet_parser.add_argument('inventory', help='File with one host[:port] per line')
+    fleet_parser.add_argument('-j', '--jobs', type=int, default=4,  help='Number of devices updated at once')
+    fleet_parser.add_argument('--retries', type=int, default=3,  help='Attempts per device')
+    fleet_parser.add_argument('-r', '--restart', action='store_true',  help='Restart MCU if anything changed')
+    fleet_parser.add_argument('--window', type=int, default=4,  help='Number of writes in flight')
+    fleet_parser.add_argument('files', nargs=argparse.REMAINDER, help='Files to upload, synchronizes core and tiles if omitted')
+
+    playlist_parser = subparsers.add_parser('playlist', help='Prints the playlist compiled from tile.json files, uploaded by sync')
+
     rm_parser = subparsers.add_parser('rm', help='Removes files from the device')
     rm_parser.add_argument('files', nargs=argparse.REMAINDER, help='Files to remove')
 
@@ -321,18 +632,31 @@ def main():
     else:
         logger.addHandler(logging.StreamHandler())
 
+    if args.action == "fleet":
+        hosts = read_inventory(args.inventory)
+        if not run_fleet(hosts, args.files, args.jobs, args.retries, args.restart, args.window):
+            sys.exit(-1)
+        return
+
+    if args.action == "playlist":
+        print(format_playlist(playlist(os.path.join(root, ".."))), end="")
+        return
+
     try:
 
-        transport = serial.serial_for_url(
-            args.port, args.baud)
+        transport = create_transport(args.port, args.baud)
 
         if args.action == "copy":
             for f in args.files:
                 if f.find("=") != -1:
                     f, name = f.split("=")
-                    run_copy(transport, f, name)
+                    run_copy(transport, f, name, args.fast, args.block, args.compile, args.window)
                 else:
-                    run_copy(transport, f)
+                    run_copy(transport, f, fast=args.fast, block=args.block, compile=args.compile,
+                        window=args.window)
+        elif args.action == "sync":
+            run_sync(transport, args.fast, args.block, args.dry_run, args.restart, args.window, args.compile,
+                args.bundle)
         elif args.action == "init":
             run_init(transport)
         elif args.action == "restart":
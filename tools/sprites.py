@@ -1,15 +1,306 @@
 # Reading an animated GIF file using Python Image Processing Library - Pillow
 
-import sys
 import os
+import json
 import struct
+import hashlib
 import argparse
+import concurrent.futures
 
 from PIL import Image, ImageColor
-from PIL import GifImagePlugin
 
 import numpy as np
 
+# Magic and versions of the indexed, run-length encoded sprite format
+COMPRESSED_MAGIC = b"PX"
+COMPRESSED_VERSION = 2
+# Version with frames stored as keyframes or as changes to the previous frame
+DELTA_VERSION = 3
+
+KEYFRAME = 0
+DELTA = 1
+
+# Magic and version of the bit-packed font format
+FONT_MAGIC = b"FN"
+FONT_VERSION = 1
+
+# Sprite sheets of the core, tiles declare theirs in the "sprites" entry of their tile.json
+CORE_SPRITES = {"font.png": {"format": "font", "size": [4, 6]}}
+
+def encode_rle(indices, size=1):
+    """Encodes a sequence of palette indices, each stored with the given number of bytes. A control byte
+    c < 128 is followed by c + 1 literal indices, a control byte c >= 128 is followed by a single index
+    that is repeated c - 126 times."""
+    indices = np.asarray(indices)
+    content = bytearray()
+
+    if len(indices) == 0:
+        return bytes(content)
+
+    # Literals are consecutive indices, so they are copied from the encoded indices when flushed. Runs of
+    # equal indices are found at once and only literals are counted one by one.
+    raw = indices.astype("<u%d" % size).tobytes()
+    starts = np.concatenate(([0], np.flatnonzero(indices[1:] != indices[:-1]) + 1))
+    lengths = np.diff(np.append(starts, len(indices)))
+
+    position = 0
+    literal = 0
+
+    def flush():
+        if literal > 0:
+            content.append(literal - 1)
+            content.extend(raw[(position - literal) * size:position * size])
+
+    for length in lengths.tolist():
+        while length > 0:
+            count = min(length, 129)
+            # Runs of two only pay off if they do not interrupt a literal sequence
+            if count >= 3 or (count == 2 and literal == 0):
+                flush()
+                literal = 0
+                content.append(count + 126)
+                content.extend(raw[position * size:(position + 1) * size])
+                position += count
+                length -= count
+            else:
+                literal += 1
+                position += 1
+                length -= 1
+                if literal == 128:
+                    flush()
+                    literal = 0
+
+    flush()
+    return bytes(content)
+
+def encode_delta(previous, current, size=1):
+    """Encodes changes between two frames of palette indices as a list of rectangles, one for each band
+    of consecutive changed rows. Returns None if the changes can not be represented."""
+    changed = previous != current
+    rows = np.flatnonzero(np.any(changed, axis=1))
+
+    bands = np.split(rows, np.flatnonzero(np.diff(rows) > 1) + 1) if len(rows) > 0 else []
+    if len(bands) > 255:
+        return None
+
+    content = bytearray((DELTA, len(bands)))
+    for band in bands:
+        columns = np.flatnonzero(np.any(changed[band[0]:band[-1]+1, :], axis=0))
+        x, y, w, h = int(columns[0]), int(band[0]), int(columns[-1] - columns[0] + 1), len(band)
+        data = encode_rle(current[y:y+h, x:x+w].reshape(-1), size)
+        if len(data) > 65535:
+            return None
+        content += struct.pack("<5H", x, y, w, h, len(data)) + data
+
+    return bytes(content)
+
+def compress(frames, size, delta=False, keyframe=0):
+    """Packs frames into the indexed format: header, palette, frame offsets and run-length encoded frames.
+    Indices are stored in one byte for palettes of up to 256 colors and in two bytes otherwise. With delta
+    encoding every frame is prefixed with its type and stored as changes to the previous frame whenever
+    that is smaller than a keyframe, keyframes can also be forced at a fixed interval."""
+    channels = frames[0].shape[2]
+    pixels = np.concatenate([frame.reshape((-1, channels)) for frame in frames])
+
+    # Colors packed into integers sort like rows of channels, which is a lot faster than unique rows
+    keys = np.zeros(len(pixels), dtype=np.uint32)
+    for channel in range(channels):
+        keys = (keys << 8) | pixels[:, channel]
+    colors, indices = np.unique(keys, return_inverse=True)
+    palette = (colors[:, None] >> np.arange(8 * (channels - 1), -1, -8, dtype=np.uint32)) & 0xFF
+
+    if palette.shape[0] > 65535:
+        raise ValueError("Too many colors (%d) for an indexed sprite sheet" % palette.shape[0])
+
+    width = 1 if palette.shape[0] <= 256 else 2
+    indices = indices.reshape((len(frames), size[1], size[0]))
+
+    encoded = []
+    for i, frame in enumerate(indices):
+        data = encode_rle(frame.reshape(-1), width)
+        if delta:
+            data = bytes((KEYFRAME, )) + data
+            if i > 0 and (keyframe < 1 or i % keyframe != 0):
+                changes = encode_delta(indices[i-1], frame, width)
+                if changes is not None and len(changes) < len(data):
+                    data = changes
+        encoded.append(data)
+
+    offsets = np.cumsum([0] + [len(e) for e in encoded])
+
+    version = DELTA_VERSION if delta else COMPRESSED_VERSION
+    header = COMPRESSED_MAGIC + struct.pack("<BB4H", version, channels, len(frames), size[0], size[1], palette.shape[0])
+
+    return header + palette.astype(np.uint8).tobytes() + struct.pack("<%dI" % len(offsets), *offsets) + b"".join(encoded)
+
+def pack_font(glyphs, size, first=32):
+    """Packs glyph masks into the font format: header followed by glyphs starting with the given character
+    code, each one a bitmap in row-major order with the most significant bit first, padded to whole bytes."""
+    glyphs = glyphs[first:]
+    if len(glyphs) == 0 or len(glyphs) > 65535:
+        raise ValueError("Invalid number of glyphs (%d)" % len(glyphs))
+    if size[0] > 255 or size[1] > 255:
+        raise ValueError("Glyphs are too large")
+
+    header = FONT_MAGIC + struct.pack("<BBHBB", FONT_VERSION, first, len(glyphs), size[0], size[1])
+
+    return header + b"".join([np.packbits(glyph.reshape(-1)).tobytes() for glyph in glyphs])
+
+def decode(filename, background="black", alpha=False):
+    """Decodes all frames of an image or an animated GIF into an array of shape (frames, height, width, channels).
+    Frames are composed onto the background color and returned as RGB, or returned as RGBA if alpha is set."""
+    source = Image.open(filename)
+
+    background = None if alpha else Image.new("RGBA", source.size, ImageColor.getrgb(background))
+
+    frames = []
+    for i in range(getattr(source, "n_frames", 1)):
+        source.seek(i)
+        frame = source.convert("RGBA")
+        if alpha:
+            frames.append(np.asarray(frame))
+        else:
+            frames.append(np.asarray(Image.alpha_composite(background, frame))[:, :, 0:3])
+
+    return np.stack(frames)
+
+def split(frames, size):
+    """Splits frames into tiles of the given size, returns an array of shape (tiles, frames, height, width,
+    channels) with tiles in row-major order"""
+    count, height, width, channels = frames.shape
+    tile_width, tile_height = size
+
+    assert width % tile_width == 0
+    assert height % tile_height == 0
+
+    tiles = frames.reshape((count, height // tile_height, tile_height, width // tile_width, tile_width, channels))
+    return tiles.transpose((1, 3, 0, 2, 4, 5)).reshape((-1, count, tile_height, tile_width, channels))
+
+def convert_colors(pixels, format="grb"):
+    """Converts an array of RGB pixels to the given format, the W channel is the mean of the other channels"""
+    if format in ("grb", "grbw"):
+        pixels = pixels[..., (1, 0, 2)]
+    if format in ("rgbw", "grbw"):
+        white = pixels.sum(axis=-1, dtype=np.uint16) // 3
+        pixels = np.concatenate((pixels, white[..., np.newaxis].astype(np.uint8)), axis=-1)
+    return pixels
+
+def convert(filename, size=None, format="grb", background="black", selection=None, indexed=False, delta=False, keyframe=0, first=32):
+    """Converts an image or an animated GIF to the content of a sprite sheet or font file. The image is split
+    into tiles of the given size (the whole image by default), selection limits the tiles used. Frames are
+    stored in the indexed format if indexed or delta is set, see compress."""
+    frames = decode(filename, background, format == "font")
+
+    tile_width = frames.shape[2] if size is None or size[0] is None else size[0]
+    tile_height = frames.shape[1] if size is None or size[1] is None else size[1]
+    size = (tile_width, tile_height)
+
+    tiles = split(frames, size)
+
+    if selection is not None:
+        tiles = tiles[[tile for tile in range(len(tiles)) if tile in selection]]
+
+    # Frames of each tile follow each other
+    content = tiles.reshape((-1, ) + tiles.shape[2:])
+
+    if format == "font":
+        return pack_font(content[:, :, :, 3] > 0, size, first)
+
+    content = convert_colors(content, format)
+
+    if indexed or delta:
+        return compress(content, size, delta, keyframe)
+    else:
+        return struct.pack("3H", len(content), *size) + np.ascontiguousarray(content).tobytes()
+
+def cache_key(filename, options):
+    """Hashes the content of an image, the conversion options and the converter itself"""
+    digest = hashlib.sha256()
+    for path in (__file__, filename):
+        with open(path, "rb") as handle:
+            digest.update(handle.read())
+    digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+def _convert_job(filename, options):
+    return convert(filename, **options)
+
+def convert_all(jobs, cache=None, workers=None):
+    """Converts images to sprite sheets in parallel worker processes. Jobs are tuples of an image, an output
+    file and a dictionary of arguments of convert. Results are stored in the cache directory under the hash
+    of their inputs, unchanged images are not converted again. Outputs are only written if their content
+    changes. Returns a dictionary that tells for each output if it was converted, taken from the cache or
+    already up to date."""
+    results = {}
+    pending = {}
+
+    def store(output, content, status):
+        previous = None
+        if os.path.isfile(output):
+            with open(output, "rb") as handle:
+                previous = handle.read()
+        if previous == content:
+            status = "unchanged"
+        else:
+            with open(output, "wb") as handle:
+                handle.write(content)
+        results[output] = status
+
+    for filename, output, options in jobs:
+        key = cache_key(filename, options) if cache is not None else None
+        if key is not None and os.path.isfile(os.path.join(cache, key)):
+            with open(os.path.join(cache, key), "rb") as handle:
+                store(output, handle.read(), "cached")
+        else:
+            pending[output] = (filename, options, key)
+
+    def finish(output, content):
+        key = pending[output][2]
+        if key is not None:
+            os.makedirs(cache, exist_ok=True)
+            with open(os.path.join(cache, key), "wb") as handle:
+                handle.write(content)
+        store(output, content, "converted")
+
+    # Starting workers takes longer than a single conversion
+    if len(pending) == 1 or workers == 1:
+        for output, (filename, options, _) in pending.items():
+            finish(output, convert(filename, **options))
+    elif pending:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_convert_job, filename, options): output for output, (filename, options, _) in pending.items()}
+            for future in concurrent.futures.as_completed(futures):
+                finish(futures[future], future.result())
+
+    return results
+
+def recipes(base):
+    """Lists sprite sheets of the core and the tiles as jobs for convert_all, each .dat file is stored next
+    to its image. Tiles declare their sprite sheets in tile.json as a dictionary of image names and
+    arguments of convert, e.g. "sprites": {"mario.gif": {"size": [21, 21], "delta": true}}."""
+    jobs = []
+
+    def add(directory, sprites):
+        for image, options in sorted(sprites.items()):
+            jobs.append((os.path.join(directory, image), os.path.join(directory, os.path.splitext(image)[0] + ".dat"), options))
+
+    add(os.path.join(base, "core"), CORE_SPRITES)
+
+    tiles = os.path.join(base, "tiles")
+    for e in sorted(os.listdir(tiles)):
+        manifest = os.path.join(tiles, e, "tile.json")
+        if os.path.isfile(manifest):
+            with open(manifest, "r") as handle:
+                add(os.path.join(tiles, e), json.load(handle).get("sprites", {}))
+
+    return jobs
+
+def build(base, cache=None, workers=None):
+    """Converts all sprite sheets of the core and the tiles that changed, see recipes and convert_all"""
+    if cache is None:
+        cache = os.path.join(base, "build", "sprites")
+    return convert_all(recipes(base), cache, workers)
+
 def main():
 
     parser = argparse.ArgumentParser(description='NodeMCU app manager', prog="nodeamg")
@@ -19,66 +310,34 @@ def main():
     parser.add_argument('--select', default=None, help='Limit selected tiles')
     parser.add_argument('--background', default="black", help='Background color')
     parser.add_argument('--format', choices=("rgb", "rgbw", "grb", "grbw", "font"), default="grb")
-    parser.add_argument('filename') 
+    parser.add_argument('--compress', default=False, action='store_true', help='Store frames with an indexed palette and run-length encoding')
+    parser.add_argument('--delta', default=False, action='store_true', help='Store compressed frames as changes to the previous frame')
+    parser.add_argument('--keyframe', default=0, type=int, help='Interval of forced keyframes for delta encoding')
+    parser.add_argument('--first', default=32, type=int, help='Code of the first character stored in a font')
+    parser.add_argument('--all', default=False, action='store_true', help='Convert sprite sheets of the core and all tiles as declared in their tile.json files')
+    parser.add_argument('-j', '--jobs', default=None, type=int, help='Number of worker processes')
+    parser.add_argument('--cache', default=None, help='Directory of converted sprite sheets, unchanged images are not converted again')
+    parser.add_argument('filename', nargs='*', help='Images to convert with the same options, the output is stored next to each one')
 
     args = parser.parse_args()
 
-    source = Image.open(args.filename)
-    output = os.path.splitext(args.filename)[0] + ".dat"
-
-    tile_width = source.width if args.width is None else args.width
-    tile_height = source.height if args.height is None else args.height
-
-    assert source.width % tile_width == 0
-    assert source.height % tile_height == 0
-
-    frames = source.n_frames
+    if (args.compress or args.delta) and args.format == "font":
+        parser.error("Fonts can not be compressed")
 
-    size = (tile_width, tile_height)
-
-    background = Image.new("RGBA", size, ImageColor.getrgb(args.background))
-
-    content = bytearray()
-
-    count = 0
-    total = int((source.width / tile_width) * (source.height / tile_height) * frames)
-
-    if args.select is None:
-        selection = list(range(0,total))
+    if args.all:
+        if args.filename:
+            parser.error("Images are given in tile.json files")
+        results = build(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."), args.cache, args.jobs)
     else:
-        selection = [int(x) for x in args.select.split(",")]
-
-    tile = 0
-
-    for y in range(0, source.height, tile_height):
-        for x in range(0, source.width, tile_width):
-            if tile in selection:
-                for i in range(0, frames):
-                    source.seek(i)
-                    frame = source.crop((x, y, x + tile_width, y + tile_height)).convert()
-                    if args.format == "font":
-                        frame = np.asarray(frame)[:, :, 3] > 0
-                    else:
-                        frame = Image.alpha_composite(background, frame)
-                        frame = np.asarray(frame)[:, :, 0:3]
-                        if args.format == "grb":
-                            frame = frame[:, :, (1, 0, 2)]
-                        elif args.format == "grbw":
-                            frame = frame[:, :, (1, 0, 2)]
-                            frame = np.stack((frame, np.mean(frame, axis=2, keepdims=True)), axis=2)
-                        elif args.format == "rgbw":
-                            frame = np.stack((frame, np.mean(frame, axis=2, keepdims=True)), axis=2)
-                        elif args.format == "font":
-                            frame = np.stack((frame, np.mean(frame, axis=2, keepdims=True)), axis=2)
-                    content += frame.tobytes()
-                    count += 1
-            tile += 1
-            
-    content = struct.pack("3H", count, *size) + content
-            
-    with open(output, "wb") as out:
-        out.write(content)
+        if not args.filename:
+            parser.error("No images given")
+        selection = None if args.select is None else [int(x) for x in args.select.split(",")]
+        options = {"size": [args.width, args.height], "format": args.format, "background": args.background, "selection": selection,
+            "indexed": args.compress, "delta": args.delta, "keyframe": args.keyframe, "first": args.first}
+        results = convert_all([(filename, os.path.splitext(filename)[0] + ".dat", options) for filename in args.filename], args.cache, args.jobs)
+
+    for output, status in sorted(results.items()):
+        print("%s: %s" % (os.path.relpath(output), status))
 
 if __name__ == "__main__":
     main()
-